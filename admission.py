@@ -0,0 +1,199 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, status
+
+# Requests per user and endpoint class, as "<requests>/<seconds>"; the burst
+# is the full allowance. Overridden by RATE_LIMIT_<CLASS> (e.g. RATE_LIMIT_SYNC=2/600).
+DEFAULT_RATE_LIMITS = {
+    "sync": "4/300",     # IBKR round trip plus a full parse
+    "report": "60/60",   # /latest, /tax/*, /fx/*, exports
+}
+# Parse/sync jobs running at once in this worker, and jobs allowed to wait for a slot
+MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", 2))
+MAX_QUEUED = int(os.getenv("ADMISSION_QUEUE_SIZE", 8))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 30))
+# Recent queue waits and job durations kept for percentiles and Retry-After
+SAMPLE_SIZE = 1000
+# Idle buckets are dropped once there are more than this many
+MAX_BUCKETS = 10000
+
+
+def parse_rate(spec: str) -> Tuple[float, float]:
+    """'<requests>/<seconds>' as (capacity, tokens per second)."""
+    requests, _, seconds = spec.partition("/")
+    capacity, period = float(requests), float(seconds or 1)
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    return capacity, capacity / period
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, now: float) -> float:
+        """Take a token: 0.0 if one was available, else seconds until there is one."""
+        if self.refill(now) >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class AdmissionRejected(HTTPException):
+    """429 with Retry-After; an HTTPException so endpoint error handling passes it through."""
+
+    def __init__(self, reason: str, retry_after: float, detail: str):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+def _percentiles(samples) -> dict:
+    if not samples:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "max": ordered[-1],
+    }
+
+
+class AdmissionController:
+    """
+    In-process admission control for expensive endpoints.
+
+    Two independent checks:
+
+    - a token bucket per (user, endpoint class), so one user cannot use up
+      the worker by calling /sync or /latest in a loop;
+    - a global cap on parse/sync jobs running at once, with a bounded FIFO
+      queue in front of it. A job that finds the queue full, or waits longer
+      than `queue_timeout`, is rejected instead of piling up behind the others.
+
+    Rejections are AdmissionRejected (429 with Retry-After). Limits are per
+    worker process, like the rest of the in-memory state. Use from the event
+    loop only.
+    """
+
+    def __init__(self, rate_limits: Optional[Dict[str, str]] = None, max_concurrent: int = MAX_CONCURRENT,
+                 max_queued: int = MAX_QUEUED, queue_timeout: float = QUEUE_TIMEOUT_SECONDS):
+        specs = rate_limits or DEFAULT_RATE_LIMITS
+        self.rate_limits = {
+            name: parse_rate(os.getenv(f"RATE_LIMIT_{name.upper()}", spec)) for name, spec in specs.items()
+        }
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._running = 0
+        self._queued = 0
+        self._waits = deque(maxlen=SAMPLE_SIZE)
+        self._durations = deque(maxlen=SAMPLE_SIZE)
+        self._counters = {
+            name: {"admitted": 0, "rate_limited": 0, "queue_full": 0, "queue_timeout": 0} for name in self.rate_limits
+        }
+
+    def check_rate(self, user: str, endpoint_class: str):
+        """Take a token from the user's bucket for `endpoint_class`, or raise AdmissionRejected."""
+        capacity, rate = self.rate_limits[endpoint_class]
+        now = time.monotonic()
+        key = (user, endpoint_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._prune(now)
+            bucket = self._buckets[key] = TokenBucket(capacity, rate, now)
+        retry_after = bucket.take(now)
+        if retry_after:
+            self._counters[endpoint_class]["rate_limited"] += 1
+            raise AdmissionRejected(
+                "rate_limited", retry_after, f"Too many {endpoint_class} requests. Try again later."
+            )
+
+    def _prune(self, now: float):
+        # A full bucket behaves exactly like a new one
+        full = [key for key, bucket in self._buckets.items() if bucket.refill(now) >= bucket.capacity]
+        for key in full:
+            del self._buckets[key]
+
+    def retry_after(self) -> float:
+        """Rough time until a slot frees up: the mean recent job duration."""
+        return sum(self._durations) / len(self._durations) if self._durations else 1.0
+
+    def check_capacity(self, endpoint_class: str):
+        """Raise AdmissionRejected if a job queued now would be refused (for work started later)."""
+        if self._semaphore.locked() and self._queued >= self.max_queued:
+            self._counters[endpoint_class]["queue_full"] += 1
+            raise AdmissionRejected("queue_full", self.retry_after(), "Server is busy. Try again later.")
+
+    @asynccontextmanager
+    async def slot(self, endpoint_class: str):
+        """Hold one of the `max_concurrent` job slots, waiting in the bounded queue if needed."""
+        counters = self._counters[endpoint_class]
+        started = time.monotonic()
+        if self._semaphore.locked():
+            self.check_capacity(endpoint_class)
+            self._queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                counters["queue_timeout"] += 1
+                raise AdmissionRejected("queue_timeout", self.retry_after(), "Server is busy. Try again later.")
+            finally:
+                self._queued -= 1
+        else:
+            await self._semaphore.acquire()
+
+        admitted = time.monotonic()
+        self._waits.append(admitted - started)
+        counters["admitted"] += 1
+        self._running += 1
+        try:
+            yield
+        finally:
+            self._running -= 1
+            self._durations.append(time.monotonic() - admitted)
+            self._semaphore.release()
+
+    def metrics(self) -> dict:
+        return {
+            "running": self._running,
+            "queued": self._queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "queue_timeout": self.queue_timeout,
+            "rate_limits": {
+                name: {"requests": capacity, "per_seconds": capacity / rate}
+                for name, (capacity, rate) in self.rate_limits.items()
+            },
+            "tracked_buckets": len(self._buckets),
+            "by_class": {name: dict(counters) for name, counters in self._counters.items()},
+            "queue_wait_seconds": _percentiles(self._waits),
+            "job_seconds": _percentiles(self._durations),
+        }
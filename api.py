@@ -1,16 +1,23 @@
-from fastapi import FastAPI, HTTPException, Header, Depends, status
+from fastapi import FastAPI, HTTPException, Header, Depends, Query, Request, BackgroundTasks, status
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, Response, FileResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, TYPE_CHECKING
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 import os
+import sys
 import json
-import numpy as np
-import pandas as pd
-from ibkr_client import IBKRFlexClient, load_config
-from parser import parse_ibkr_xml
+import time
+from cache import SharedCache, MISSING
+from report_archive import save_report, latest_report_path
+from events import EventBroker, event_stream
+from admission import AdmissionController
+from profiling import Profiler, stage
 from database import (
+    init_db,
     create_user, 
     get_user_by_username, 
     update_user_profile, 
@@ -23,13 +30,37 @@ from auth import (
     get_password_hash, 
     create_access_token, 
     get_current_user, 
+    get_current_user_from_query,
+    get_admin_user,
+    get_username_from_token,
+    create_stream_token,
+    ADMIN_USERS,
+    STREAM_TOKEN_SCOPE,
+    STREAM_TOKEN_EXPIRE_SECONDS,
     validate_password_strength,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     Token
 )
 
+# pandas, numpy, the XML parser and the IBKR client are imported by the
+# functions that need them, so the app starts (and /health answers) without
+# paying for them; the first report request does.
+if TYPE_CHECKING:
+    import pandas as pd
+    from fx import FxRates
+
 # --- App Setup ---
-app = FastAPI(title="IBKR Flex Analytics API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Creates or upgrades the user database; refuses a newer schema
+    init_db()
+    yield
+    # The household process pool only exists once a household was consolidated
+    consolidation = sys.modules.get("consolidation")
+    if consolidation is not None:
+        consolidation.shutdown_pool()
+
+app = FastAPI(title="IBKR Flex Analytics API", lifespan=lifespan)
 
 # Enable CORS
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "*").split(",")
@@ -41,6 +72,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Parsed payloads and analytics, shared by all workers on this host
+report_cache = SharedCache()
+# Sync progress pushed to /events streams of this worker
+event_broker = EventBroker()
+# Users with a sync running in this worker
+syncs_in_progress = set()
+# Per-user rate limits and the cap on concurrent parse/sync work
+admission = AdmissionController()
+# Request profiling armed from /admin/profiling
+profiler = Profiler()
+
+def rate_limited(endpoint_class: str):
+    """Dependency: the current user, after taking a token from their `endpoint_class` bucket (else 429)."""
+    async def dependency(current_user: str = Depends(get_current_user)):
+        admission.check_rate(current_user, endpoint_class)
+        return current_user
+    return dependency
+
+def request_user(request: Request) -> Optional[str]:
+    """Username of the request's bearer token (or stream token in the `token` query parameter), or None."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    scope = None
+    if scheme.lower() != "bearer":
+        token, scope = request.query_params.get("token"), STREAM_TOKEN_SCOPE
+    if not token:
+        return None
+    try:
+        return get_username_from_token(token, scope)
+    except HTTPException:
+        return None
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """
+    Profile the request if an armed rule matches its user and path, or if an
+    admin sent it with `X-Profile: cpu` (or `memory` to trace allocations too).
+    """
+    requested = request.headers.get("X-Profile")
+    if not profiler.armed and not requested:
+        return await call_next(request)
+    user = request_user(request)
+    if user is None:
+        return await call_next(request)
+    rule = profiler.claim(user, request.url.path) if profiler.armed else None
+    if rule is None and not (requested and user in ADMIN_USERS):
+        return await call_next(request)
+    
+    memory = rule["memory"] if rule else requested.strip().lower() == "memory"
+    token = profiler.start(user, request.method, request.url.path, rule["id"] if rule else None, memory)
+    status_code = None
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        # Streamed bodies are profiled up to the first byte
+        summary = profiler.finish(token, status_code)
+    response.headers["X-Profile-Capture"] = summary["capture_id"]
+    return response
+
 # --- User Directory Management ---
 def get_user_dir(user_id: str):
     base_dir = "users"
@@ -70,6 +160,20 @@ class UserPreferencesUpdate(BaseModel):
     language: Optional[str] = None
     default_currency: Optional[str] = None
 
+class ProfilingRule(BaseModel):
+    user: Optional[str] = None
+    path: Optional[str] = None
+    count: int = 1
+    memory: bool = False
+
+class HouseholdLinks(BaseModel):
+    users: List[str]
+
+class QueryRequest(BaseModel):
+    sql: str
+    format: str = "json"
+    limit: Optional[int] = None
+
 # --- Auth Endpoints ---
 @app.post("/auth/register")
 async def register(user: UserCreate):
@@ -227,6 +331,7 @@ async def get_account_config(current_user: str = Depends(get_current_user)):
                 "token_masked": ""
             }
             
+        from ibkr_client import load_config
         config = load_config(config_path)
         token = config.get("token", "")
         masked_token = token[:4] + "*" * (len(token) - 8) + token[-4:] if len(token) > 8 else "****"
@@ -258,109 +363,859 @@ async def update_config(new_config: dict, current_user: str = Depends(get_curren
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/sync")
-async def sync_report(current_user: str = Depends(get_current_user)):
+def report_version(report_path: str) -> str:
+    """Identify a stored report by its mtime and size, for cache keys."""
+    stat = os.stat(report_path)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+@stage("serialize")
+def frame_to_records(df: "pd.DataFrame") -> list:
+    """JSON-safe list of row dicts: NaN/inf become None, datetimes ISO strings."""
+    import numpy as np
+    import pandas as pd
+    
+    if df.empty:
+        return []
+    df_clean = df.copy()
+    for col in df_clean.columns:
+        if pd.api.types.is_datetime64_any_dtype(df_clean[col]):
+            df_clean[col] = df_clean[col].dt.strftime("%Y-%m-%dT%H:%M:%S")
+    df_clean = df_clean.replace({np.nan: None, np.inf: None, -np.inf: None})
+    return df_clean.to_dict(orient="records")
+
+def parse_section_list(sections: Optional[str]) -> Optional[List[str]]:
+    """Comma separated section names (None if empty), or 400 for unknown ones."""
+    if not sections:
+        return None
+    from parser import SECTION_ROW_TAGS
+    section_list = [name.strip() for name in sections.split(",") if name.strip()]
+    unknown = [name for name in section_list if name not in SECTION_ROW_TAGS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}")
+    return section_list
+
+def build_report_payload(report_source, sections: Optional[List[str]] = None) -> dict:
+    """Parse a report and turn it into the JSON-safe body served by /sync and /latest."""
+    import numpy as np
+    from parser import parse_ibkr_xml
+    
+    results, last_update, summary = parse_ibkr_xml(report_source, sections=sections)
+    
+    serializable_results = {section: frame_to_records(df) for section, df in results.items()}
+    
+    # Clean summary dict for NaNs
+    clean_summary = {}
+    for k, v in summary.items():
+        if isinstance(v, (float, np.floating)) and (np.isnan(v) or np.isinf(v)):
+            clean_summary[k] = 0.0
+        else:
+            clean_summary[k] = v
+    
+    return {
+        "data": serializable_results,
+        "summary": clean_summary,
+        "last_report_generated": last_update
+    }
+
+def get_preferred_currency(username: str) -> str:
+    prefs = get_user_preferences(username) or {}
+    return (prefs.get("default_currency") or "USD").upper()
+
+def fx_rate_files(user_dir: str) -> List[str]:
+    """Local rate files: the shared FX_RATES_FILE, then the user's own fx_rates.csv."""
+    paths = [os.getenv("FX_RATES_FILE"), os.path.join(user_dir, "fx_rates.csv")]
+    return [path for path in paths if path and os.path.exists(path)]
+
+def load_fx_rates(current_user: str, report_path: str) -> "FxRates":
+    """Rate table of a report plus the local rate files, cached per report and rate file version."""
+    from fx import FxRates, FX_SECTIONS
+    from parser import FlexReport
+    
+    rate_files = fx_rate_files(get_user_dir(current_user))
+    version = ":".join([report_version(report_path)] + [report_version(path) for path in rate_files])
+    
+    def compute():
+        with FlexReport(report_path) as report:
+            sections = report.sections(FX_SECTIONS)
+        return FxRates.from_sections(sections, rate_files)
+    
+    return report_cache.get_or_set(current_user, f"fx:{version}", compute)
+
+def apply_preferred_currency(payload: dict, current_user: str, report_path: str) -> dict:
+    """Payload with its summary in the user's default_currency, converted at the report date."""
+    summary = payload.get("summary") or {}
+    if not summary.get("accounts"):
+        return payload
+    import pandas as pd
+    from parser import flex_datetimes
+    from summary import convert_summary
+    
+    fx_rates = load_fx_rates(current_user, report_path)
+    currency = get_preferred_currency(current_user)
+    if currency == fx_rates.base_currency or not fx_rates.can_convert(currency):
+        currency, factor = fx_rates.base_currency, 1.0
+    else:
+        as_of = flex_datetimes(pd.Series([payload.get("last_report_generated") or ""])).to_numpy()
+        factor = float(fx_rates.convert([1.0], [fx_rates.base_currency], as_of, currency)[0])
+    return {**payload, "summary": convert_summary(summary, factor, currency, fx_rates.base_currency)}
+
+def read_sync_state(user_dir: str) -> dict:
+    """Outcome of the user's latest sync (see write_sync_state); {} before the first one."""
+    sync_state_path = os.path.join(user_dir, "sync_state.json")
     try:
-        user_dir = get_user_dir(current_user)
-        config_path = os.path.join(user_dir, "config.json")
+        with open(sync_state_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_sync_state(user_dir: str, **changes) -> dict:
+    """
+    Update sync_state.json: `status` (running, completed, failed) with
+    `started_at`, `finished_at` and `error` of the latest sync, and
+    `last_sync`, the end of the latest successful one. Any worker can read
+    it, so clients that missed the events (no stream open, or a sync run by
+    another worker) poll /sync/status instead.
+    """
+    state = {**read_sync_state(user_dir), **changes}
+    sync_state_path = os.path.join(user_dir, "sync_state.json")
+    with open(sync_state_path + ".partial", "w") as f:
+        json.dump(state, f)
+    os.replace(sync_state_path + ".partial", sync_state_path)
+    return state
+
+@stage("sync")
+def download_report(current_user: str, config: dict, notify) -> str:
+    """
+    Have IBKR generate the report and stream it into the user's archive;
+    returns its path. Blocking: runs in the threadpool, outside the
+    admission slots, since it mostly waits on IBKR.
+    """
+    from ibkr_client import IBKRFlexClient
+    
+    client = IBKRFlexClient(config["token"], config["query_id"])
+    
+    notify("sync", stage="requesting")
+    with stage("ibkr.request"):
+        ref_code = client.trigger_report()
+    notify("sync", stage="downloading", bytes=0)
+    
+    def with_progress(chunks):
+        received = 0
+        for chunk in chunks:
+            received += len(chunk)
+            notify("sync", stage="downloading", bytes=received)
+            yield chunk
+    
+    # Streamed straight into the compressed archive, never held in memory
+    with stage("ibkr.download"):
+        return save_report(get_user_dir(current_user), with_progress(client.stream_report(ref_code)))
+
+@stage("sync")
+def process_report(current_user: str, report_path: str) -> dict:
+    """Parse and summarize a downloaded report and update the lot state. Blocking: runs in the threadpool."""
+    from parser import FlexReport
+    from lots import update_lot_state, LOT_SECTIONS
+    
+    user_dir = get_user_dir(current_user)
+    # Every worker shares the cache, so stale entries must go before the
+    # new payload is published.
+    report_cache.invalidate(current_user)
+    version = report_version(report_path)
+    payload = build_report_payload(report_path)
+    report_cache.set(current_user, f"payload:{version}", payload)
+    payload = apply_preferred_currency(payload, current_user, report_path)
+    
+    # Only executions newer than the stored lot state are applied
+    try:
+        with stage("lots"), FlexReport(report_path) as report:
+            update_lot_state(user_dir, report.sections(LOT_SECTIONS))
+    except Exception as e:
+        print(f"Warning: could not update lot state for {current_user}: {e}")
+    return {**payload, "report_version": version}
+
+async def run_sync(current_user: str, config: dict, notify) -> dict:
+    """
+    Download, archive and parse a new report, reporting each stage through
+    `notify(event, **data)` and recording the outcome in sync_state.json.
+    Only the parse holds a "sync" admission slot; the IBKR request and
+    download wait on the network without one.
+    """
+    user_dir = get_user_dir(current_user)
+    try:
+        report_path = await run_in_threadpool(download_report, current_user, config, notify)
+        notify("sync", stage="parsing")
+        async with admission.slot("sync"):
+            payload = await run_in_threadpool(process_report, current_user, report_path)
+        version = payload.pop("report_version")
         
-        if not os.path.exists(config_path):
-            raise HTTPException(status_code=404, detail="Configuration not found. Please set it up first.")
-            
+        last_sync = datetime.now().isoformat()
+        write_sync_state(
+            user_dir, status="completed", finished_at=last_sync, error=None, last_sync=last_sync,
+            report_version=version
+        )
+        notify(
+            "sync", stage="completed", report_version=version, summary=payload["summary"],
+            last_report_generated=payload["last_report_generated"], last_sync=last_sync
+        )
+        return {"status": "success", **payload, "last_sync": last_sync}
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        write_sync_state(user_dir, status="failed", finished_at=datetime.now().isoformat(), error=error)
+        notify("sync", stage="failed", error=error)
+        raise
+    finally:
+        # Also on cancellation (client gone while waiting), which skips the except above
+        syncs_in_progress.discard(current_user)
+
+async def run_background_sync(current_user: str, config: dict, notify):
+    try:
+        await run_sync(current_user, config, notify)
+    except Exception as e:
+        print(f"Error: background sync for {current_user} failed: {e}")
+
+@app.post("/sync")
+async def sync_report(
+    background_tasks: BackgroundTasks,
+    wait: bool = True,
+    current_user: str = Depends(rate_limited("sync"))
+):
+    """
+    Fetch a new report from IBKR; progress is pushed to the user's /events
+    streams. With wait=false the sync runs after a 202 response and the
+    `completed` event tells when /latest has the new data; clients without
+    a stream poll /sync/status for the sync started at the returned
+    `started_at`. Syncs share the admission queue with report parsing; 429
+    when it is full.
+    """
+    user_dir = get_user_dir(current_user)
+    config_path = os.path.join(user_dir, "config.json")
+    
+    if not os.path.exists(config_path):
+        raise HTTPException(status_code=404, detail="Configuration not found. Please set it up first.")
+    if current_user in syncs_in_progress:
+        raise HTTPException(status_code=409, detail="A sync is already running.")
+    
+    try:
+        from ibkr_client import load_config
         config = load_config(config_path)
-        client = IBKRFlexClient(config["token"], config["query_id"])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    notify = event_broker.threadsafe_publisher(current_user)
+    
+    if not wait:
+        admission.check_capacity("sync")
+        syncs_in_progress.add(current_user)
+        started_at = datetime.now().isoformat()
+        write_sync_state(user_dir, status="running", started_at=started_at, finished_at=None, error=None)
+        background_tasks.add_task(run_background_sync, current_user, config, notify)
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED, content={"status": "accepted", "started_at": started_at}
+        )
+    
+    syncs_in_progress.add(current_user)
+    write_sync_state(
+        user_dir, status="running", started_at=datetime.now().isoformat(), finished_at=None, error=None
+    )
+    try:
+        return await run_sync(current_user, config, notify)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/sync/status")
+async def get_sync_status(current_user: str = Depends(get_current_user)):
+    """Persisted outcome of the user's latest sync, for clients that missed its events."""
+    return {"status": "success", "sync": read_sync_state(get_user_dir(current_user))}
+
+@app.post("/events/token")
+async def get_stream_token(current_user: str = Depends(get_current_user)):
+    """Short-lived token for opening /events; request a new one for each (re)connection."""
+    return {"token": create_stream_token(current_user), "expires_in": STREAM_TOKEN_EXPIRE_SECONDS}
+
+@app.get("/events")
+async def stream_events(request: Request, current_user: str = Depends(get_current_user_from_query)):
+    """
+    Server-Sent Events for the user: `sync` progress (requesting,
+    downloading, parsing, completed with the new summary, failed) and
+    `report` when a newer report shows up. EventSource cannot send headers,
+    so `token` is a stream token from POST /events/token, never the
+    access token: URLs end up in proxy and access logs.
+    """
+    user_dir = get_user_dir(current_user)
+    
+    def current_version():
+        report_path = latest_report_path(user_dir)
+        return report_version(report_path) if report_path else None
+    
+    return StreamingResponse(
+        event_stream(event_broker, current_user, request.is_disconnected, current_version),
+        media_type="text/event-stream",
+        # Proxies must not buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/latest")
+async def get_latest_report(sections: Optional[str] = None, current_user: str = Depends(rate_limited("report"))):
+    """Latest stored report. `sections` (comma separated) limits which sections are parsed and returned."""
+    section_list = parse_section_list(sections)
+    
+    user_dir = get_user_dir(current_user)
+    report_path = latest_report_path(user_dir)
+    
+    if report_path is None:
+        return {"status": "error", "message": "No report found. Please sync first."}
         
-        ref_code = client.trigger_report()
-        xml_report = client.get_report(ref_code)
+    try:
+        cache_key = f"payload:{report_version(report_path)}"
+        if section_list is not None:
+            cache_key += ":" + ",".join(sorted(section_list))
         
-        report_path = os.path.join(user_dir, "last_report.xml")
-        with open(report_path, "w") as f:
-            f.write(xml_report)
-            
-        results, last_update, summary = parse_ibkr_xml(xml_report)
+        @stage("report")
+        def load():
+            payload = report_cache.get_or_set(
+                current_user, cache_key, lambda: build_report_payload(report_path, section_list)
+            )
+            return apply_preferred_currency(payload, current_user, report_path)
         
-        serializable_results = {}
-        for section, df in results.items():
-            if not df.empty:
-                df_clean = df.replace({np.nan: None, np.inf: None, -np.inf: None})
-                serializable_results[section] = df_clean.to_dict(orient="records")
-            else:
-                serializable_results[section] = []
+        # A miss is a full parse, and even a hit may load the FX rates of
+        # the report: both run in the threadpool under the concurrency cap
+        async with admission.slot("report"):
+            payload = await run_in_threadpool(load)
         
-        last_sync = datetime.now().isoformat()
-        sync_state_path = os.path.join(user_dir, "sync_state.json")
-        with open(sync_state_path, "w") as f:
-            json.dump({"last_sync": last_sync}, f)
+        last_sync = read_sync_state(user_dir).get("last_sync")
+        return {"status": "success", **payload, "last_sync": last_sync}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def cached_report_analysis(current_user: str, name: str, compute):
+    """
+    Run `compute(report_path)` on the user's latest report, cached per report
+    version in the shared cache so every worker reuses the result. On a miss
+    it runs in the threadpool under the admission concurrency cap.
+    """
+    report_path = latest_report_path(get_user_dir(current_user))
+    if report_path is None:
+        raise HTTPException(status_code=404, detail="No report found. Please sync first.")
+    key = f"{name}:{report_version(report_path)}"
+    result = report_cache.get(current_user, key, MISSING)
+    if result is MISSING:
+        @stage(f"analysis:{name.split(':')[0]}")
+        def load():
+            return report_cache.get_or_set(current_user, key, lambda: compute(report_path))
         
-        # Clean summary dict for NaNs
-        clean_summary = {}
-        for k, v in summary.items():
-            if isinstance(v, (float, np.floating)) and (np.isnan(v) or np.isinf(v)):
-                clean_summary[k] = 0.0
-            else:
-                clean_summary[k] = v
-                
+        async with admission.slot("report"):
+            result = await run_in_threadpool(load)
+    return result
+
+# --- Tax Endpoints ---
+@app.get("/tax/wash-sales")
+async def get_wash_sales(
+    window_days: Optional[int] = Query(None, ge=0, le=366),
+    match_on: str = "conid",
+    year: Optional[int] = None,
+    current_user: str = Depends(rate_limited("report"))
+):
+    """
+    Loss sales with repurchases inside the window (default
+    WASH_SALE_WINDOW_DAYS), with disallowed losses and basis carry-forward.
+    """
+    from parser import FlexReport
+    from wash_sales import detect_wash_sales, summarize_wash_sales, MATCH_KEYS, WASH_SALE_WINDOW_DAYS
+    
+    if window_days is None:
+        window_days = WASH_SALE_WINDOW_DAYS
+    if match_on not in MATCH_KEYS:
+        raise HTTPException(status_code=400, detail=f"match_on must be one of: {', '.join(MATCH_KEYS)}")
+    
+    def compute(report_path):
+        with FlexReport(report_path) as report:
+            adjustments = detect_wash_sales(report.section("Trades"), window_days, match_on)
+        if year is not None and not adjustments.empty:
+            adjustments = adjustments[adjustments["sale_date"].dt.year == year]
         return {
-            "status": "success",
-            "data": serializable_results,
-            "summary": clean_summary,
-            "last_report_generated": last_update,
-            "last_sync": last_sync
+            "summary": summarize_wash_sales(adjustments),
+            "adjustments": frame_to_records(adjustments)
         }
+    
+    try:
+        result = await cached_report_analysis(current_user, f"wash-sales:{window_days}:{match_on}:{year}", compute)
+        return {"status": "success", "window_days": window_days, "match_on": match_on, **result}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/latest")
-async def get_latest_report(current_user: str = Depends(get_current_user)):
-    user_dir = get_user_dir(current_user)
-    report_path = os.path.join(user_dir, "last_report.xml")
+@app.get("/tax/income")
+async def get_income_report(year: Optional[int] = None, current_user: str = Depends(rate_limited("report"))):
+    """Dividends, payments in lieu, withholding, interest and fees by year, country and currency."""
+    from parser import FlexReport
+    from income import build_income_report
     
-    if not os.path.exists(report_path):
-        return {"status": "error", "message": "No report found. Please sync first."}
+    currency = get_preferred_currency(current_user)
+    
+    def compute(report_path):
+        with FlexReport(report_path) as report:
+            sections = report.sections(["CashTransactions", "ChangeInDividendAccruals"])
+        income = build_income_report(
+            sections["CashTransactions"], sections["ChangeInDividendAccruals"],
+            fx_rates=load_fx_rates(current_user, report_path), target_currency=currency
+        )
         
+        result = {"currency": income["currency"], "by_year": income["by_year"]}
+        if year is not None:
+            result["by_year"] = {y: totals for y, totals in income["by_year"].items() if y == year}
+        for key in ("breakdown", "dividends", "unmatched_withholding", "accruals"):
+            df = income[key]
+            if year is not None and not df.empty:
+                df = df[df["year"] == year]
+            result[key] = frame_to_records(df)
+        return result
+    
     try:
-        with open(report_path, "r") as f:
-            xml_report = f.read()
-            
-        results, last_update, summary = parse_ibkr_xml(xml_report)
-        
-        serializable_results = {}
-        for section, df in results.items():
-            if not df.empty:
-                df_clean = df.replace({np.nan: None, np.inf: None, -np.inf: None})
-                serializable_results[section] = df_clean.to_dict(orient="records")
-            else:
-                serializable_results[section] = []
-        
-        last_sync = None
-        sync_state_path = os.path.join(user_dir, "sync_state.json")
-        if os.path.exists(sync_state_path):
-            try:
-                with open(sync_state_path, "r") as f:
-                    last_sync = json.load(f).get("last_sync")
-            except:
-                pass
-
-        # Clean summary dict for NaNs
-        clean_summary = {}
-        for k, v in summary.items():
-            if isinstance(v, (float, np.floating)) and (np.isnan(v) or np.isinf(v)):
-                clean_summary[k] = 0.0
-            else:
-                clean_summary[k] = v
+        result = await cached_report_analysis(current_user, f"income:{year}:{currency}", compute)
+        return {"status": "success", **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/tax/lots")
+async def get_tax_lots(current_user: str = Depends(rate_limited("report"))):
+    """Open FIFO lots from the persisted lot state, reconciled against IBKR's cost basis."""
+    from parser import FlexReport
+    from lots import update_lot_state, lots_frame, LOT_SECTIONS
+    
+    user_dir = get_user_dir(current_user)
+    
+    def compute(report_path):
+        with FlexReport(report_path) as report:
+            state = update_lot_state(user_dir, report.sections(LOT_SECTIONS), save=False)
+        return {
+            "watermark": state["watermark"],
+            "trades_applied": state["trades_applied"],
+            "reconciliation": state["reconciliation"],
+            "lots": frame_to_records(lots_frame(state))
+        }
+    
+    try:
+        result = await cached_report_analysis(current_user, "lots", compute)
+        return {"status": "success", **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/tax/harvest")
+async def get_harvest_candidates(
+    window_days: Optional[int] = Query(None, ge=0, le=366),
+    match_on: str = "conid",
+    min_loss: float = Query(0.0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    current_user: str = Depends(rate_limited("report"))
+):
+    """
+    Open lots that would realize a loss at the report's mark prices, ranked
+    by loss and holding period, with repurchase-window conflicts and the
+    realized PnL they could offset per account.
+    """
+    from parser import FlexReport
+    from lots import update_lot_state
+    from harvest import prepare_harvest_data, scan_harvest, HARVEST_SECTIONS, HARVEST_MATCH_KEYS
+    from wash_sales import WASH_SALE_WINDOW_DAYS
+
+    if window_days is None:
+        window_days = WASH_SALE_WINDOW_DAYS
+    if match_on not in HARVEST_MATCH_KEYS:
+        raise HTTPException(status_code=400, detail=f"match_on must be one of: {', '.join(HARVEST_MATCH_KEYS)}")
+    user_dir = get_user_dir(current_user)
+
+    def compute(report_path):
+        with FlexReport(report_path) as report:
+            sections = report.sections(HARVEST_SECTIONS)
+        return prepare_harvest_data(update_lot_state(user_dir, sections, save=False), sections)
+
+    try:
+        # The lots joined with prices are cached per report; each scan is array math over them
+        data = await cached_report_analysis(current_user, "harvest-data", compute)
+        with stage("harvest.scan"):
+            result = scan_harvest(data, window_days, match_on, min_loss, limit)
         return {
             "status": "success",
-            "data": serializable_results,
-            "summary": clean_summary,
-            "last_report_generated": last_update,
-            "last_sync": last_sync
+            "as_of": result["as_of"],
+            "window_days": window_days,
+            "match_on": match_on,
+            "by_account": frame_to_records(result["by_account"]),
+            "candidates": frame_to_records(result["candidates"])
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/export/tax/{year}")
+async def export_tax_report(
+    year: int,
+    section: str = "trades",
+    format: str = "csv",
+    current_user: str = Depends(rate_limited("report"))
+):
+    """
+    Stream the realized trades, income or fees of a tax year as CSV, or as
+    XLSX (section=all puts the three sections on separate sheets).
+    """
+    import tax_export
+    
+    if format not in tax_export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(tax_export.EXPORT_FORMATS)}")
+    sections = tax_export.EXPORT_SECTIONS if section == "all" and format == "xlsx" else [section]
+    if any(name not in tax_export.EXPORT_SECTIONS for name in sections):
+        raise HTTPException(status_code=400, detail=f"section must be one of: {', '.join(tax_export.EXPORT_SECTIONS)}")
+    if format == "xlsx" and tax_export.xlsxwriter is None:
+        raise HTTPException(status_code=501, detail="XLSX export is not available: 'xlsxwriter' is not installed")
+    
+    report_path = latest_report_path(get_user_dir(current_user))
+    if report_path is None:
+        raise HTTPException(status_code=404, detail="No report found. Please sync first.")
+    
+    def loader(name):
+        return lambda: tax_export.export_frame(report_path, name, year)
+    
+    filename = f"tax_{year}_{section}.{format}"
+    if format == "csv":
+        rows = tax_export.iter_csv(tax_export.EXPORT_COLUMNS[section], loader(section))
+        media_type = "text/csv"
+    else:
+        rows = tax_export.iter_xlsx({name: (tax_export.EXPORT_COLUMNS[name], loader(name)) for name in sections})
+        media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    
+    # The report is parsed while the body streams, so the slot is taken by
+    # the body; a full queue is still refused before the response starts
+    admission.check_capacity("report")
+    
+    async def body():
+        async with admission.slot("report"):
+            async for chunk in iterate_in_threadpool(rows):
+                yield chunk
+    
+    return StreamingResponse(
+        body(), media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# --- FX Endpoints ---
+@app.get("/fx/rates")
+async def get_fx_rates(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    currency: Optional[str] = None,
+    current_user: str = Depends(rate_limited("report"))
+):
+    """Rates to the report's base currency (from the report and local rate files) over a date range."""
+    import pandas as pd
+    
+    currencies = [code.strip().upper() for code in currency.split(",") if code.strip()] if currency else None
+    try:
+        start_date = pd.Timestamp(start) if start else None
+        end_date = pd.Timestamp(end) if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be dates (YYYY-MM-DD)")
+    
+    def compute(report_path):
+        fx_rates = load_fx_rates(current_user, report_path)
+        return {
+            "base_currency": fx_rates.base_currency,
+            "currencies": fx_rates.currencies,
+            "rates": frame_to_records(fx_rates.rate_range(start_date, end_date, currencies))
         }
+    
+    try:
+        rate_files = ":".join(report_version(path) for path in fx_rate_files(get_user_dir(current_user)))
+        key = f"fx-rates:{start_date}:{end_date}:{','.join(currencies or [])}:{rate_files}"
+        result = await cached_report_analysis(current_user, key, compute)
+        return {"status": "success", **result}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- Household Endpoints ---
+def household_reports(current_user: str, linked: bool) -> dict:
+    """Latest report path of each household member that has one, the current user first."""
+    from consolidation import household_members
+    
+    members = household_members(current_user, get_user_dir) if linked else [current_user]
+    reports = {member: latest_report_path(get_user_dir(member)) for member in members}
+    reports = {member: path for member, path in reports.items() if path is not None}
+    if not reports:
+        raise HTTPException(status_code=404, detail="No report found. Please sync first.")
+    return reports
+
+async def cached_household_analysis(current_user: str, key: str, compute):
+    """Like cached_report_analysis, for results that depend on several members' reports (in `key`)."""
+    result = report_cache.get(current_user, key, MISSING)
+    if result is MISSING:
+        @stage(f"analysis:{key.split(':')[0]}")
+        def load():
+            return report_cache.get_or_set(current_user, key, compute)
+        
+        async with admission.slot("report"):
+            result = await run_in_threadpool(load)
+    return result
+
+@app.get("/household/links")
+async def get_household_links(current_user: str = Depends(get_current_user)):
+    """Users this user links with; `members` have linked back, `pending` have not (yet)."""
+    from consolidation import load_links, household_members
+    
+    links = load_links(get_user_dir(current_user))
+    members = household_members(current_user, get_user_dir)[1:]
+    return {
+        "status": "success",
+        "links": links,
+        "members": members,
+        "pending": [user for user in links if user not in members]
+    }
+
+@app.put("/household/links")
+async def update_household_links(links: HouseholdLinks, current_user: str = Depends(get_current_user)):
+    """
+    Replace the users this user agrees to share a household with. Reports
+    are only combined once both users have listed each other.
+    """
+    from consolidation import save_links
+    
+    users = list(dict.fromkeys(name.strip() for name in links.users if name.strip()))
+    if current_user in users:
+        raise HTTPException(status_code=400, detail="Cannot link to yourself")
+    unknown = [user for user in users if get_user_by_username(user) is None]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown users: {', '.join(unknown)}")
+    save_links(get_user_dir(current_user), users)
+    return {"status": "success", "links": sorted(users)}
+
+@app.get("/household")
+async def get_household(linked: bool = True, current_user: str = Depends(rate_limited("report"))):
+    """
+    All accounts of the user's latest report, and with `linked` of the
+    reports of every mutually linked user, consolidated in the user's
+    default_currency: household totals, per-member and per-currency
+    breakdowns, and each account's own summary for drilldown. Accounts are
+    processed in parallel, one statement per worker process.
+    """
+    import consolidation
+    from parser import FlexReport
+    
+    reports = household_reports(current_user, linked)
+    currency = get_preferred_currency(current_user)
+    rate_files = {member: fx_rate_files(get_user_dir(member)) for member in reports}
+    versions = ",".join(
+        f"{member}={':'.join(report_version(path) for path in [report_path] + rate_files[member])}"
+        for member, report_path in reports.items()
+    )
+    
+    def compute():
+        started = time.perf_counter()
+        jobs = []
+        for member, report_path in reports.items():
+            with FlexReport(report_path) as report:
+                jobs.extend(consolidation.statement_jobs(member, report_path, report))
+        results = consolidation.run_jobs(jobs, currency, rate_files)
+        return {
+            **consolidation.merge_household(results, currency),
+            "members": list(reports),
+            "statements": len(jobs),
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+    
+    try:
+        result = await cached_household_analysis(current_user, f"household:{currency}:{versions}", compute)
+        return {"status": "success", **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/household/accounts/{account_id}")
+async def get_household_account(
+    account_id: str,
+    sections: Optional[str] = None,
+    linked: bool = True,
+    current_user: str = Depends(rate_limited("report"))
+):
+    """
+    Drilldown into one household account: the sections (comma separated,
+    default all) of its own statement, from the most recent member report
+    that has it.
+    """
+    from parser import FlexReport, SECTION_ROW_TAGS
+    
+    section_list = parse_section_list(sections) or list(SECTION_ROW_TAGS)
+    reports = household_reports(current_user, linked)
+    versions = ",".join(f"{member}={report_version(path)}" for member, path in reports.items())
+    
+    def compute():
+        matches = []
+        for member, report_path in reports.items():
+            with FlexReport(report_path) as report:
+                matches.extend(
+                    (statement["attrs"].get("whenGenerated") or "", member, report_path, index)
+                    for index, statement in enumerate(report.statements)
+                    if statement["attrs"].get("accountId") == account_id
+                )
+        if not matches:
+            return None
+        last_update, member, report_path, index = max(matches, key=lambda match: match[0])
+        with FlexReport(report_path) as report:
+            frames = report.sections(section_list, statement=index)
+        return {
+            "user": member,
+            "account_id": account_id,
+            "statement": index,
+            "last_report_generated": last_update or None,
+            "data": {name: frame_to_records(df) for name, df in frames.items()}
+        }
+    
+    try:
+        key = f"household-account:{account_id}:{','.join(section_list)}:{versions}"
+        result = await cached_household_analysis(current_user, key, compute)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Account not found in the household")
+        return {"status": "success", **result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- Query Endpoints ---
+def query_engine_for(current_user: str):
+    """The user's QueryEngine module and latest report path, or the matching HTTP error."""
+    import query_engine
+
+    if query_engine.duckdb is None:
+        raise HTTPException(status_code=501, detail="SQL queries are not available: 'duckdb' is not installed")
+    report_path = latest_report_path(get_user_dir(current_user))
+    if report_path is None:
+        raise HTTPException(status_code=404, detail="No report found. Please sync first.")
+    return query_engine, report_path
+
+@app.post("/query")
+async def run_query(request: QueryRequest, current_user: str = Depends(rate_limited("report"))):
+    """
+    Run one read-only SQL SELECT over the sections of the user's latest
+    report (one table per section, e.g. Trades, CashTransactions). Results
+    are JSON rows, or an Arrow IPC stream with format=arrow.
+    """
+    query_engine, report_path = query_engine_for(current_user)
+    if request.format not in query_engine.QUERY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(query_engine.QUERY_FORMATS)}")
+    arrow = request.format == "arrow"
+    if arrow and not query_engine.arrow_available():
+        raise HTTPException(status_code=501, detail="Arrow output is not available: 'pyarrow' is not installed")
+    limit = min(max(request.limit or query_engine.QUERY_MAX_ROWS, 1), query_engine.QUERY_MAX_ROWS)
+    
+    @stage("query")
+    def execute():
+        engine = query_engine.get_engine(current_user, report_version(report_path), report_path)
+        return engine.execute(request.sql, max_rows=limit, arrow=arrow)
+    
+    try:
+        async with admission.slot("report"):
+            result, truncated = await run_in_threadpool(execute)
+    except query_engine.QueryTimeout as e:
+        raise HTTPException(status_code=408, detail=str(e))
+    except query_engine.QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if arrow:
+        import pyarrow as pa
+        
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, result.schema) as writer:
+            writer.write_table(result)
+        return Response(
+            sink.getvalue().to_pybytes(), media_type="application/vnd.apache.arrow.stream",
+            headers={"X-Truncated": str(truncated).lower()}
+        )
+    return {
+        "status": "success",
+        "columns": [str(column) for column in result.columns],
+        "rows": frame_to_records(result),
+        "truncated": truncated
+    }
+
+@app.get("/query/tables")
+async def get_query_tables(current_user: str = Depends(rate_limited("report"))):
+    """Tables available to /query, with their columns and SQL types."""
+    query_engine, report_path = query_engine_for(current_user)
+    
+    def tables():
+        return query_engine.get_engine(current_user, report_version(report_path), report_path).tables()
+    
+    try:
+        async with admission.slot("report"):
+            result = await run_in_threadpool(tables)
+        return {"status": "success", "tables": result}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- Admin Endpoints ---
+@app.get("/admin/admission")
+async def get_admission_metrics(current_user: str = Depends(get_admin_user)):
+    """Admission counters by endpoint class (admitted jobs, rejections by reason) and queue wait times."""
+    return {"status": "success", **admission.metrics()}
+
+@app.post("/admin/profiling")
+async def arm_profiling(rule: ProfilingRule, current_user: str = Depends(get_admin_user)):
+    """
+    Profile the next `count` requests of `user` (any user if omitted) whose
+    path starts with `path` (any path if omitted); `memory` adds tracemalloc.
+
+    Rules live in the worker process that handled this request (`pid`):
+    with API_WORKERS > 1 only the requests routed to that worker are
+    profiled, and GET/DELETE only see the rules of the worker they reach.
+    Arm several rules, or run a single worker, to catch a given request.
+    """
+    if rule.count < 1:
+        raise HTTPException(status_code=400, detail="count must be at least 1")
+    return {"status": "success", "rule": profiler.arm(rule.user, rule.path, rule.count, rule.memory)}
+
+@app.get("/admin/profiling")
+async def get_profiling(current_user: str = Depends(get_admin_user)):
+    """Armed rules and the stored captures, newest first."""
+    return {
+        "status": "success",
+        "rules": [dict(rule) for rule in profiler.rules.values()],
+        "captures": await run_in_threadpool(profiler.captures)
+    }
+
+@app.delete("/admin/profiling/{rule_id}")
+async def disarm_profiling(rule_id: int, current_user: str = Depends(get_admin_user)):
+    if not profiler.disarm(rule_id):
+        raise HTTPException(status_code=404, detail="Profiling rule not found")
+    return {"status": "success"}
+
+@app.get("/admin/profiling/captures/{name}")
+async def download_capture(name: str, current_user: str = Depends(get_admin_user)):
+    """One capture file: .folded (collapsed stacks), .json (stage summary) or .tracemalloc (snapshot)."""
+    path = profiler.capture_file(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Capture not found")
+    media_type = "application/json" if name.endswith(".json") else \
+        "text/plain" if name.endswith(".folded") else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=name)
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("API_PORT", 8000))
     reload = os.getenv("ENVIRONMENT", "development") == "development"
-    uvicorn.run("api:app", host="0.0.0.0", port=port, reload=reload)
+    # uvicorn refuses to combine reload with multiple workers
+    workers = 1 if reload else int(os.getenv("API_WORKERS", 1))
+    uvicorn.run("api:app", host="0.0.0.0", port=port, reload=reload, workers=workers)
@@ -1,7 +1,7 @@
 import os
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from jose import JWTError, jwt
@@ -20,6 +20,11 @@ class Token(BaseModel):
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 week
+# Lifetime of the single-purpose tokens that go in URLs (EventSource cannot send headers)
+STREAM_TOKEN_EXPIRE_SECONDS = int(os.getenv("STREAM_TOKEN_EXPIRE_SECONDS", 60))
+STREAM_TOKEN_SCOPE = "events"
+# Comma separated usernames allowed on the /admin endpoints
+ADMIN_USERS = {name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()}
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
@@ -67,8 +72,22 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    """Dependency to get the current authenticated user."""
+def create_stream_token(username: str) -> str:
+    """
+    Short-lived token only valid for opening the /events stream. It travels
+    in the query string, where proxies and access logs can record it, so it
+    must not be usable as an access token nor for long.
+    """
+    return create_access_token(
+        {"sub": username, "scope": STREAM_TOKEN_SCOPE}, timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS)
+    )
+
+def get_username_from_token(token: str, scope: Optional[str] = None) -> str:
+    """
+    Validate a JWT and return the username it belongs to, or raise 401.
+    The token's `scope` must be `scope`: access tokens have none, so a
+    stream token is rejected where an access token is expected.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -77,7 +96,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("scope") != scope:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
@@ -86,3 +105,21 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     if user is None:
         raise credentials_exception
     return username
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    """Dependency to get the current authenticated user."""
+    return get_username_from_token(token)
+
+async def get_current_user_from_query(token: str = Query(...)):
+    """
+    Same as get_current_user, with a stream token (see create_stream_token)
+    in the `token` query parameter, for clients that cannot set headers
+    (EventSource).
+    """
+    return get_username_from_token(token, STREAM_TOKEN_SCOPE)
+
+async def get_admin_user(current_user: str = Depends(get_current_user)):
+    """Dependency for operator endpoints: the current user, if listed in ADMIN_USERS."""
+    if current_user not in ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
@@ -0,0 +1,216 @@
+import glob
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from parser import FlexReport, SECTION_ROW_TAGS, SUMMARY_SECTIONS
+from summary import compute_summary, SUMMARY_MONEY_FIELDS
+
+REPORT_EXTENSIONS = (".xml", ".xml.gz", ".xml.zst")
+OUTPUT_FORMATS = ["auto", "parquet", "csv"]
+SOURCE_COLUMN = "source_file"
+CHUNK_SIZE = 1024 * 1024
+
+
+def parquet_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def resolve_format(output_format):
+    """'auto' means Parquet when pyarrow is installed, else CSV."""
+    if output_format == "auto":
+        return "parquet" if parquet_available() else "csv"
+    if output_format == "parquet" and not parquet_available():
+        raise RuntimeError("Parquet output requires the 'pyarrow' package")
+    return output_format
+
+
+def expand_inputs(inputs):
+    """Report files from a mix of files, directories (searched recursively) and glob patterns."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, names in os.walk(item):
+                paths.extend(os.path.join(root, name) for name in names if name.endswith(REPORT_EXTENSIONS))
+        elif os.path.isfile(item):
+            paths.append(item)
+        else:
+            paths.extend(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+    return sorted(set(paths))
+
+
+def _write_part(df, path, output_format):
+    if output_format == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def process_report(index, path, sections, parts_dir, output_format):
+    """
+    Worker: parse one report, write each section as an intermediate part in
+    the output format under `parts_dir` and return only small metadata, so
+    no DataFrame crosses the process boundary.
+    """
+    started = time.perf_counter()
+    result = {"index": index, "path": path, "bytes": os.path.getsize(path), "sections": {}, "error": None}
+    try:
+        with FlexReport(path) as report:
+            if not report.is_flex_query:
+                raise ValueError("not a Flex Query report")
+            frames = report.sections(list(dict.fromkeys(sections + SUMMARY_SECTIONS)))
+            result["accounts"] = [account for account in report.account_ids if account]
+            result["last_update"] = report.last_update
+
+        for name in sections:
+            df = frames[name]
+            if df.empty:
+                continue
+            part_path = os.path.join(parts_dir, name, f"{index:06d}.{output_format}")
+            _write_part(df.assign(**{SOURCE_COLUMN: path}), part_path, output_format)
+            result["sections"][name] = {"rows": len(df), "columns": list(df.columns), "part": part_path}
+
+        # compute_summary types OpenPositions in place, so it runs after the parts are written
+        result["summary"] = compute_summary(frames)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def _write_section(name, parts, output_dir, output_format):
+    """
+    Append the parts of one section, in input order, into a single output
+    file with the union of their columns. Parts that already have exactly
+    those columns are copied without being parsed (the usual case, as one
+    Flex query always yields the same attributes); the others are read and
+    reindexed one at a time.
+    """
+    columns = list(dict.fromkeys(column for part in parts for column in part["columns"]))
+    columns.append(SOURCE_COLUMN)
+    output_path = os.path.join(output_dir, f"{name}.{output_format}")
+
+    if output_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([(column, pa.string()) for column in columns])
+        with pq.ParquetWriter(output_path, schema) as writer:
+            for part in parts:
+                table = pq.read_table(part["part"])
+                if table.column_names != columns:
+                    df = table.to_pandas().reindex(columns=columns).astype(object)
+                    table = pa.Table.from_pandas(df.where(df.notna(), None), preserve_index=False)
+                writer.write_table(table.cast(schema))
+    else:
+        with open(output_path, "wb") as out:
+            out.write((",".join(columns) + "\n").encode("utf-8"))
+            for part in parts:
+                if part["columns"] + [SOURCE_COLUMN] == columns:
+                    with open(part["part"], "rb") as f:
+                        f.readline()  # header
+                        shutil.copyfileobj(f, out, CHUNK_SIZE)
+                else:
+                    df = pd.read_csv(part["part"], dtype=str, keep_default_na=False)
+                    out.write(df.reindex(columns=columns).to_csv(header=False, index=False).encode("utf-8"))
+    return output_path
+
+
+def _summary_tables(results):
+    """(one row per report, one row per account per report) summary DataFrames."""
+    reports, accounts = [], []
+    for result in results:
+        summary = result["summary"]
+        reports.append({
+            SOURCE_COLUMN: result["path"],
+            "accounts": ",".join(result["accounts"]),
+            "last_update": result["last_update"],
+            **{field: summary.get(field, 0.0) for field in SUMMARY_MONEY_FIELDS},
+            **{f"{name}_rows": result["sections"].get(name, {}).get("rows", 0) for name in SECTION_ROW_TAGS},
+        })
+        accounts.extend({SOURCE_COLUMN: result["path"], **account} for account in summary.get("accounts", []))
+    return pd.DataFrame(reports), pd.DataFrame(accounts)
+
+
+def run_batch(inputs, output_dir, sections=None, workers=None, output_format="auto", log=print):
+    """
+    Parse every report matched by `inputs` in a process pool and write
+    consolidated outputs to `output_dir`:
+
+    - `<Section>.parquet|csv`: the rows of each section across all reports,
+      with a `source_file` column;
+    - `summaries.csv`: one portfolio summary row per report;
+    - `account_summaries.csv`: the per-account breakdown of each summary;
+    - `summaries.json`: the full summaries plus failed files.
+
+    Returns run statistics, including files/sec and rows/sec.
+    """
+    output_format = resolve_format(output_format)
+    sections = list(sections or SECTION_ROW_TAGS)
+    unknown = [name for name in sections if name not in SECTION_ROW_TAGS]
+    if unknown:
+        raise ValueError(f"Unknown sections: {', '.join(unknown)}")
+    paths = expand_inputs(inputs)
+    if not paths:
+        raise ValueError("No report files found")
+
+    os.makedirs(output_dir, exist_ok=True)
+    parts_dir = tempfile.mkdtemp(prefix=".parts_", dir=output_dir)
+    for name in sections:
+        os.makedirs(os.path.join(parts_dir, name))
+
+    started = time.perf_counter()
+    results, failed = [], []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(process_report, index, path, sections, parts_dir, output_format)
+                for index, path in enumerate(paths)
+            ]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                if result["error"]:
+                    failed.append(result)
+                    log(f"[{done}/{len(paths)}] {result['path']}: ERROR {result['error']}")
+                else:
+                    results.append(result)
+                    log(f"[{done}/{len(paths)}] {result['path']} ({result['seconds']:.2f}s)")
+        parse_seconds = time.perf_counter() - started
+
+        results.sort(key=lambda result: result["index"])
+        outputs = {}
+        for name in sections:
+            parts = [result["sections"][name] for result in results if name in result["sections"]]
+            if parts:
+                outputs[name] = _write_section(name, parts, output_dir, output_format)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    reports, accounts = _summary_tables(results)
+    reports.to_csv(os.path.join(output_dir, "summaries.csv"), index=False)
+    accounts.to_csv(os.path.join(output_dir, "account_summaries.csv"), index=False)
+    with open(os.path.join(output_dir, "summaries.json"), "w") as f:
+        json.dump({
+            "reports": {result["path"]: result["summary"] for result in results},
+            "failed": {result["path"]: result["error"] for result in failed},
+        }, f, indent=2, default=str)
+
+    elapsed = time.perf_counter() - started
+    rows = sum(part["rows"] for result in results for part in result["sections"].values())
+    total_bytes = sum(result["bytes"] for result in results + failed)
+    return {
+        "files": len(paths),
+        "failed": len(failed),
+        "rows": rows,
+        "bytes": total_bytes,
+        "format": output_format,
+        "outputs": outputs,
+        "parse_seconds": parse_seconds,
+        "seconds": elapsed,
+        "files_per_sec": len(paths) / elapsed if elapsed else 0.0,
+        "rows_per_sec": rows / elapsed if elapsed else 0.0,
+        "mb_per_sec": total_bytes / 1e6 / elapsed if elapsed else 0.0,
+    }
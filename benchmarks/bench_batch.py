@@ -0,0 +1,47 @@
+"""
+Offline batch mode over a directory of archived statements.
+
+Usage: python benchmarks/bench_batch.py [--clients 20] [--years 3] [--trades 5000] [--workers 1 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import run_batch
+from synthetic import write_flex_report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--trades", type=int, default=5000)
+    parser.add_argument("--positions", type=int, default=100)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--format", default="auto")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # One directory per client, one statement per year
+        for client in range(args.clients):
+            client_dir = os.path.join(tmp, "in", f"client_{client:04d}")
+            os.makedirs(client_dir)
+            for year in range(2024 - args.years + 1, 2025):
+                write_flex_report(
+                    os.path.join(client_dir, f"report_{year}.xml"), n_trades=args.trades,
+                    n_positions=args.positions, accounts=(f"U{client:07d}",), year=year, seed=client * 100 + year
+                )
+
+        for workers in dict.fromkeys(args.workers):
+            stats = run_batch([os.path.join(tmp, "in")], os.path.join(tmp, f"out_{workers}"),
+                              workers=workers, output_format=args.format, log=lambda message: None)
+            print(f"{workers:>2} worker(s), {stats['files']} files ({stats['format']}): {stats['seconds']:.2f} s, "
+                  f"{stats['files_per_sec']:.1f} files/s, {stats['rows_per_sec']:,.0f} rows/s, "
+                  f"{stats['mb_per_sec']:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Hit latency of the shared cross-worker cache versus a per-process dict.
+
+Usage: python benchmarks/bench_cache.py [--rows 5000] [--iterations 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import SharedCache
+
+
+def make_payload(rows):
+    # Roughly the shape of a /latest body: lists of attribute dicts per section
+    trades = [
+        {"@symbol": f"SYM{i % 300}", "@quantity": i % 50, "@tradePrice": 10.0 + i % 7, "@currency": "USD"}
+        for i in range(rows)
+    ]
+    return {"data": {"Trades": trades}, "summary": {"total_equity": 1.0}, "last_report_generated": None}
+
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    payload = make_payload(args.rows)
+    local_cache = {"payload:1": payload}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shared = SharedCache(path=os.path.join(tmp, "cache.db"))
+        shared.set("bench", "payload:1", payload)
+
+        local_ms = timed(lambda: local_cache["payload:1"], args.iterations)
+        shared_ms = timed(lambda: shared.get("bench", "payload:1"), args.iterations)
+        miss_ms = timed(lambda: shared.get("bench", "missing"), args.iterations)
+
+    print(f"Payload rows:          {args.rows}")
+    print(f"Per-process dict hit:  {local_ms:.4f} ms")
+    print(f"Shared cache hit:      {shared_ms:.4f} ms")
+    print(f"Shared cache miss:     {miss_ms:.4f} ms")
+    print("A per-process cache misses once per worker and keeps one copy per worker;")
+    print("the shared cache misses once per host and keeps a single copy.")
+
+
+if __name__ == "__main__":
+    main()
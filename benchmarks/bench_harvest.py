@@ -0,0 +1,63 @@
+"""
+Tax-loss harvesting scan over the open lots of large trade histories.
+
+Times the per-report preparation (cached by the API) separately from the
+scan itself, which is what each /tax/harvest request pays on a cache hit,
+including unpickling the cached data.
+
+Usage: python benchmarks/bench_harvest.py [--trades 100000 250000] [--symbols 500] [--accounts 4]
+"""
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import FlexReport
+from lots import update_lot_state
+from harvest import prepare_harvest_data, scan_harvest, HARVEST_SECTIONS
+from synthetic import write_flex_report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trades", type=int, nargs="+", default=[100000, 250000])
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--accounts", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    accounts = tuple(f"U{i:07d}" for i in range(args.accounts))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_trades in args.trades:
+            path = write_flex_report(
+                os.path.join(tmp, f"trades_{n_trades}.xml"),
+                n_trades=n_trades, n_positions=args.symbols, n_symbols=args.symbols, accounts=accounts
+            )
+            with FlexReport(path) as report:
+                sections = report.sections(HARVEST_SECTIONS)
+            user_dir = os.path.join(tmp, f"user_{n_trades}")
+            os.makedirs(user_dir)
+            state = update_lot_state(user_dir, sections)
+
+            start = time.perf_counter()
+            data = prepare_harvest_data(state, sections)
+            cached = pickle.dumps(data)
+            prepare_seconds = time.perf_counter() - start
+
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = scan_harvest(pickle.loads(cached), limit=100)
+                timings.append(time.perf_counter() - start)
+            totals = result["by_account"]
+            print(f"{n_trades:>7} trades, {len(data['lots']['quantity'])} lots: prepare {prepare_seconds * 1000:.1f} ms, "
+                  f"scan best {min(timings) * 1000:.1f} ms, {int(totals['candidates'].sum())} candidates, "
+                  f"{totals['allowed_loss'].sum():.2f} allowed loss")
+
+
+if __name__ == "__main__":
+    main()
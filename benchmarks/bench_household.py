@@ -0,0 +1,62 @@
+"""
+Household consolidation as the number of linked accounts grows.
+
+Each account is a separate FlexStatement of one report; statements are
+processed serially and then in the shared process pool (started, and
+warmed up, before timing). On N cores the parallel time should stay
+roughly flat up to N accounts.
+
+Usage: python benchmarks/bench_household.py [--accounts 1 2 4 8] [--trades 20000] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import consolidation
+from parser import FlexReport
+from synthetic import write_flex_report
+
+
+def timed(jobs, parallel):
+    start = time.perf_counter()
+    results = consolidation.run_jobs(jobs, "USD", {}, parallel=parallel)
+    elapsed = time.perf_counter() - start
+    household = consolidation.merge_household(results, "USD")
+    return elapsed, household
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--trades", type=int, default=20000, help="trades per account")
+    parser.add_argument("--positions", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    consolidation.CONSOLIDATION_WORKERS = args.workers
+    with tempfile.TemporaryDirectory() as tmp:
+        warmup = write_flex_report(os.path.join(tmp, "warmup.xml"), n_trades=10, n_positions=5,
+                                   accounts=tuple(f"W{i}" for i in range(args.workers)))
+        with FlexReport(warmup) as report:
+            consolidation.run_jobs(consolidation.statement_jobs("bench", warmup, report), "USD", {})
+
+        for n_accounts in args.accounts:
+            path = write_flex_report(
+                os.path.join(tmp, f"household_{n_accounts}.xml"), n_trades=args.trades,
+                n_positions=args.positions, accounts=tuple(f"U{i:07d}" for i in range(n_accounts))
+            )
+            with FlexReport(path) as report:
+                jobs = consolidation.statement_jobs("bench", path, report)
+            serial, household = timed(jobs, parallel=False)
+            parallel, _ = timed(jobs, parallel=True)
+            print(f"{n_accounts:>3} accounts: serial {serial:.2f} s, {args.workers} workers {parallel:.2f} s, "
+                  f"equity {household['summary']['total_equity']:,.2f}")
+    consolidation.shutdown_pool()
+
+
+if __name__ == "__main__":
+    main()
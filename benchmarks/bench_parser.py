@@ -0,0 +1,52 @@
+"""
+Full parse versus lazy per-section access on a trade-heavy report.
+
+Usage: python benchmarks/bench_parser.py [--trades 100000] [--positions 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import FlexReport, parse_ibkr_xml, SUMMARY_SECTIONS
+from summary import compute_summary
+from synthetic import write_flex_report
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed * 1000:10.1f} ms")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trades", type=int, default=100000)
+    parser.add_argument("--positions", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_flex_report(os.path.join(tmp, "report.xml"), n_trades=args.trades, n_positions=args.positions)
+        print(f"Report: {os.path.getsize(path) / 1e6:.1f} MB, {args.trades} trades, {args.positions} positions")
+
+        def positions_only():
+            with FlexReport(path) as report:
+                compute_summary(report.sections(SUMMARY_SECTIONS))
+
+        def index_only():
+            with FlexReport(path):
+                pass
+
+        full = timed("parse_ibkr_xml (all sections)", lambda: parse_ibkr_xml(path))
+        timed("FlexReport index scan", index_only)
+        lazy = timed("positions + summary only", positions_only)
+        print(f"Positions view costs {lazy / full:.1%} of a full parse")
+
+
+if __name__ == "__main__":
+    main()
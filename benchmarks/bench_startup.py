@@ -0,0 +1,82 @@
+"""
+Cold start of the API: import time, lifespan (DB init) and first responses.
+
+Each run is a fresh interpreter, so nothing is warm but the OS file cache.
+The first report request is what pays for pandas, the parser and friends.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--importtime 15]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["pandas", "numpy", "xmltodict", "requests", "parser", "ibkr_client"]
+
+# Runs in the child interpreter; prints one JSON line of timings
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import api
+imported = time.perf_counter()
+loaded = [name for name in %r if name in sys.modules]
+from fastapi.testclient import TestClient  # test harness only, not part of the app's cost
+ready = time.perf_counter()
+client = TestClient(api.app).__enter__()
+lifespan = time.perf_counter()
+assert client.get("/health").status_code == 200
+health = time.perf_counter()
+# What the first /latest or /sync pulls in before it can parse anything
+import pandas as pd, parser, ibkr_client, fx, summary
+api.frame_to_records(pd.DataFrame({"a": [1.0]}))
+first_report = time.perf_counter()
+client.__exit__(None, None, None)
+print(json.dumps({
+    "import": imported - started, "lifespan": lifespan - ready, "health": health - lifespan,
+    "first_report_imports": first_report - health, "heavy_at_import": loaded,
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_once():
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_profile(top):
+    """Slowest modules (cumulative) of `import api`, from -X importtime."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import api"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="Also print the N slowest imports of `import api`")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    for key in ["import", "lifespan", "health", "first_report_imports"]:
+        values = [run[key] * 1000 for run in runs]
+        print(f"{key:<22}median {statistics.median(values):>8.1f} ms   min {min(values):>8.1f} ms")
+    heavy = runs[-1]["heavy_at_import"]
+    print(f"heavy modules loaded by `import api`: {', '.join(heavy) if heavy else 'none'}")
+
+    if args.importtime:
+        print("\nSlowest imports (cumulative):")
+        import_profile(args.importtime)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Portfolio summary engine on large position books.
+
+Usage: python benchmarks/bench_summary.py [--positions 10000 50000] [--accounts 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import FlexReport, SUMMARY_SECTIONS
+from summary import compute_summary
+from synthetic import write_flex_report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--positions", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--accounts", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    accounts = tuple(f"U{i:07d}" for i in range(args.accounts))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_positions in args.positions:
+            per_account = n_positions // args.accounts
+            path = write_flex_report(
+                os.path.join(tmp, f"positions_{n_positions}.xml"),
+                n_trades=0, n_positions=per_account, accounts=accounts
+            )
+            with FlexReport(path) as report:
+                raw = report.sections(SUMMARY_SECTIONS)
+
+            timings = []
+            for _ in range(args.repeat):
+                # Fresh copies: the engine types OpenPositions in place
+                sections = {name: df.copy() for name, df in raw.items()}
+                start = time.perf_counter()
+                summary = compute_summary(sections)
+                timings.append(time.perf_counter() - start)
+
+            print(f"{per_account * args.accounts:>7} positions, {args.accounts} accounts, "
+                  f"{len(summary['currencies'])} currencies: best {min(timings) * 1000:.1f} ms, "
+                  f"mean {sum(timings) / len(timings) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Wash-sale detection over large trade histories.
+
+Usage: python benchmarks/bench_wash_sales.py [--trades 100000 250000] [--symbols 500]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import FlexReport
+from wash_sales import detect_wash_sales, summarize_wash_sales
+from synthetic import write_flex_report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trades", type=int, nargs="+", default=[100000, 250000])
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_trades in args.trades:
+            path = write_flex_report(
+                os.path.join(tmp, f"trades_{n_trades}.xml"),
+                n_trades=n_trades, n_positions=10, n_symbols=args.symbols
+            )
+            with FlexReport(path) as report:
+                trades = report.section("Trades")
+
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                adjustments = detect_wash_sales(trades)
+                timings.append(time.perf_counter() - start)
+            totals = summarize_wash_sales(adjustments)
+            print(f"{n_trades:>7} trades, {args.symbols} symbols: best {min(timings) * 1000:.1f} ms, "
+                  f"{totals['wash_sales']} wash sales, {totals['disallowed_loss']:.2f} disallowed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Local stand-in for the IBKR Flex Web Service, for load tests and offline runs.
+
+Serves FlexStatementService.SendRequest and FlexStatementService.GetStatement
+under /Universal/servlet like the real service. A statement answers "Warn"
+(code 1019, generation in progress) until --warn-seconds after its request,
+then returns a synthetic report. --error-rate makes that share of
+SendRequest calls fail; token "expired" always fails with code 1012.
+
+Report size comes from --trades/--positions/--accounts, or per query with a
+query ID of the form "<trades>x<positions>" (e.g. 5000x200). Reports are
+generated once per size and kept in memory.
+
+Usage:
+    python benchmarks/flex_stub.py --port 8081 --warn-seconds 2 --trades 5000
+    IBKR_FLEX_BASE_URL=http://localhost:8081/Universal/servlet IBKR_FLEX_RETRY_DELAY=1 python api.py
+"""
+import argparse
+import itertools
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import make_flex_report
+
+SERVLET_PATH = "/Universal/servlet"
+SIZE_QUERY_RE = re.compile(r"^(\d+)x(\d+)$")
+# Chunks for the statement body, so large reports stream like the real service
+WRITE_CHUNK = 256 * 1024
+
+
+def envelope(status, **fields):
+    body = "".join(f"<{key}>{value}</{key}>" for key, value in fields.items())
+    return (f'<FlexStatementResponse timestamp="{datetime.now():%d %B, %Y %I:%M %p EDT}">'
+            f"<Status>{status}</Status>{body}</FlexStatementResponse>")
+
+
+class FlexStub:
+    def __init__(self, warn_seconds=0.0, error_rate=0.0, latency=0.0, trades=1000, positions=100,
+                 accounts=1, seed=42):
+        self.warn_seconds = warn_seconds
+        self.error_rate = error_rate
+        self.latency = latency
+        self.default_size = (trades, positions)
+        self.accounts = tuple(f"U{i:07d}" for i in range(accounts))
+        self.random = random.Random(seed)
+        self.seed = seed
+        self._references = {}
+        self._reports = {}
+        self._counter = itertools.count(1000000000)
+        self._lock = threading.Lock()
+        self.stats = {"send_request": 0, "get_statement": 0, "warn": 0, "errors": 0, "bytes": 0}
+
+    def report_size(self, query_id):
+        match = SIZE_QUERY_RE.match(query_id or "")
+        return (int(match.group(1)), int(match.group(2))) if match else self.default_size
+
+    def report(self, size):
+        with self._lock:
+            if size not in self._reports:
+                trades, positions = size
+                self._reports[size] = make_flex_report(
+                    n_trades=trades, n_positions=positions, accounts=self.accounts, seed=self.seed
+                ).encode("utf-8")
+            return self._reports[size]
+
+    def send_request(self, token, query_id):
+        with self._lock:
+            self.stats["send_request"] += 1
+            failed = token == "expired" or self.random.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+        if token == "expired":
+            return envelope("Fail", ErrorCode=1012, ErrorMessage="Token has expired.")
+        if failed:
+            return envelope("Fail", ErrorCode=1018, ErrorMessage="Too many requests have been made from this token.")
+        reference = str(next(self._counter))
+        with self._lock:
+            self._references[reference] = (time.monotonic(), self.report_size(query_id))
+        return envelope("Success", ReferenceCode=reference, Url=f"{SERVLET_PATH}/FlexStatementService.GetStatement")
+
+    def get_statement(self, reference):
+        """(body, is_report) for a GetStatement call."""
+        with self._lock:
+            self.stats["get_statement"] += 1
+            requested = self._references.get(reference)
+        if requested is None:
+            with self._lock:
+                self.stats["errors"] += 1
+            return envelope("Fail", ErrorCode=1015, ErrorMessage="Reference code is invalid."), False
+        requested_at, size = requested
+        if time.monotonic() - requested_at < self.warn_seconds:
+            with self._lock:
+                self.stats["warn"] += 1
+            return envelope("Warn", ErrorCode=1019,
+                            ErrorMessage="Statement generation in progress. Please try again shortly."), False
+        report = self.report(size)
+        with self._lock:
+            self.stats["bytes"] += len(report)
+        return report, True
+
+
+def make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if stub.latency:
+                time.sleep(stub.latency)
+
+            if url.path == f"{SERVLET_PATH}/FlexStatementService.SendRequest":
+                body, is_report = stub.send_request(params.get("t", ""), params.get("q", "")).encode(), False
+            elif url.path == f"{SERVLET_PATH}/FlexStatementService.GetStatement":
+                body, is_report = stub.get_statement(params.get("q", ""))
+                body = body if is_report else body.encode()
+            else:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/xml; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            for start in range(0, len(body), WRITE_CHUNK):
+                self.wfile.write(body[start:start + WRITE_CHUNK])
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(stub, host="127.0.0.1", port=8081):
+    server = ThreadingHTTPServer((host, port), make_handler(stub))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--warn-seconds", type=float, default=0.0,
+                        help="Seconds a statement stays in 'generation in progress'")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of SendRequest calls that fail")
+    parser.add_argument("--latency", type=float, default=0.0, help="Extra seconds added to every response")
+    parser.add_argument("--trades", type=int, default=1000)
+    parser.add_argument("--positions", type=int, default=100)
+    parser.add_argument("--accounts", type=int, default=1)
+    args = parser.parse_args()
+
+    stub = FlexStub(args.warn_seconds, args.error_rate, args.latency, args.trades, args.positions, args.accounts)
+    server = serve(stub, args.host, args.port)
+    print(f"Flex stub on http://{args.host}:{args.port}{SERVLET_PATH} "
+          f"(warn {args.warn_seconds}s, errors {args.error_rate:.0%}, {args.trades} trades)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Stats: {stub.stats}")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
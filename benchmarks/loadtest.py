@@ -0,0 +1,142 @@
+"""
+Mixed-traffic load test against a running API, with IBKR replaced by the Flex stub.
+
+Start the stub and point the API at it, then run the load test:
+
+    python benchmarks/flex_stub.py --port 8081 --warn-seconds 1 --trades 5000
+    IBKR_FLEX_BASE_URL=http://127.0.0.1:8081/Universal/servlet IBKR_FLEX_RETRY_DELAY=0.5 python api.py
+    python benchmarks/loadtest.py --api http://127.0.0.1:8000 --users 50 --duration 60 --mix login=1,latest=8,sync=1
+
+Each virtual user is a thread with its own session that registers (once),
+logs in, stores a Flex config and then loops over the weighted endpoint mix.
+Latency percentiles and throughput are reported per endpoint, with
+admission-control rejections (429) counted apart from errors.
+"""
+import argparse
+import random
+import threading
+import time
+from collections import defaultdict
+import numpy as np
+import requests
+
+PASSWORD = "LoadTest123"
+ENDPOINTS = ["login", "latest", "sync"]
+
+
+def parse_mix(text):
+    weights = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint in --mix: {name} (use {', '.join(ENDPOINTS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class VirtualUser:
+    def __init__(self, api, username, query_id, flex_token, sync_wait):
+        self.api = api.rstrip("/")
+        self.username = username
+        self.query_id = query_id
+        self.flex_token = flex_token
+        self.sync_wait = sync_wait
+        self.session = requests.Session()
+
+    def setup(self):
+        self.session.post(f"{self.api}/auth/register", json={"username": self.username, "password": PASSWORD})
+        response = self.login()
+        response.raise_for_status()
+        self.session.post(f"{self.api}/config", json={"token": self.flex_token, "query_id": self.query_id}).raise_for_status()
+
+    def login(self):
+        response = self.session.post(f"{self.api}/auth/login", data={"username": self.username, "password": PASSWORD})
+        if response.ok:
+            self.session.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+        return response
+
+    def latest(self):
+        return self.session.get(f"{self.api}/latest")
+
+    def sync(self):
+        return self.session.post(f"{self.api}/sync", params={"wait": str(self.sync_wait).lower()})
+
+
+def run_user(user, weights, deadline, results, lock, seed):
+    rng = random.Random(seed)
+    names, values = list(weights), list(weights.values())
+    local = defaultdict(list)
+    while time.monotonic() < deadline:
+        name = rng.choices(names, values)[0]
+        start = time.perf_counter()
+        try:
+            status = getattr(user, name)().status_code
+        except requests.RequestException:
+            # No response at all
+            status = None
+        local[name].append((time.perf_counter() - start, status))
+    with lock:
+        for name, samples in local.items():
+            results[name].extend(samples)
+
+
+def report(results, elapsed):
+    print(f"\n{'endpoint':<10}{'requests':>10}{'429':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p90 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}")
+    for name in ENDPOINTS:
+        samples = results.get(name)
+        if not samples:
+            continue
+        latencies = np.array([latency for latency, _ in samples]) * 1000
+        statuses = [status for _, status in samples]
+        rejected = statuses.count(429)
+        errors = sum(1 for status in statuses if status is None or (status >= 400 and status != 429))
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print(f"{name:<10}{len(samples):>10}{rejected:>8}{errors:>8}{len(samples) / elapsed:>9.1f}"
+              f"{p50:>10.1f}{p90:>10.1f}{p99:>10.1f}{latencies.max():>10.1f}")
+    total = sum(len(samples) for samples in results.values())
+    print(f"\n{total} requests in {elapsed:.1f} s: {total / elapsed:.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of traffic after setup")
+    parser.add_argument("--mix", default="login=1,latest=8,sync=1", help="Endpoint weights")
+    parser.add_argument("--prefix", default="loadtest", help="Username prefix of the virtual users")
+    parser.add_argument("--query-id", default="", help="Flex query ID; '<trades>x<positions>' sets the stub report size")
+    parser.add_argument("--flex-token", default="stubtoken0000", help="Flex token sent to the stub")
+    parser.add_argument("--no-wait", action="store_true", help="Use /sync?wait=false (202, sync in background)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    users = [
+        VirtualUser(args.api, f"{args.prefix}_{i:04d}", args.query_id, args.flex_token, not args.no_wait)
+        for i in range(args.users)
+    ]
+    print(f"Setting up {len(users)} users...")
+    for user in users:
+        user.setup()
+    # One sync each so /latest has a report to serve (stub errors are tolerated)
+    for user in users:
+        user.session.post(f"{user.api}/sync")
+
+    print(f"Running {args.mix} for {args.duration:.0f} s...")
+    results, lock = defaultdict(list), threading.Lock()
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=run_user, args=(user, weights, deadline, results, lock, args.seed + i))
+        for i, user in enumerate(users)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report(results, time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
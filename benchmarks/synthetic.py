@@ -0,0 +1,186 @@
+"""
+Synthetic IBKR Flex Query reports for benchmarks and the local Flex stub.
+
+The attribute sets mirror real Flex statements closely enough for the
+parser, summary and tax engines; values are random but reproducible.
+"""
+import random
+from datetime import date, timedelta
+from xml.sax.saxutils import quoteattr
+
+CURRENCIES = [("USD", 1.0), ("EUR", 1.08), ("GBP", 1.27), ("CAD", 0.74)]
+COUNTRIES = ["US", "IE", "DE", "GB", "CA", "CN"]
+
+
+def _attrs(values):
+    return " ".join(f"{key}={quoteattr(str(value))}" for key, value in values.items())
+
+
+def _datetime(day, seconds):
+    return f"{day:%Y%m%d};{seconds // 3600:02d}{seconds // 60 % 60:02d}{seconds % 60:02d}"
+
+
+def make_statement_rows(account_id, n_trades, n_positions, n_symbols, year, rng):
+    """Yield XML lines of one FlexStatement."""
+    symbols = [f"SYM{i:04d}" for i in range(n_symbols)]
+    start = date(year, 1, 1)
+    end = date(year, 12, 31)
+
+    yield (f'<FlexStatement accountId="{account_id}" fromDate="{start:%Y%m%d}" toDate="{end:%Y%m%d}" '
+           f'period="LastYear" whenGenerated="{end:%Y%m%d};120000">')
+
+    yield "<EquitySummaryInBase>"
+    for offset in range(0, 365, 7):
+        day = start + timedelta(days=offset)
+        yield "<EquitySummaryByReportDateInBase " + _attrs({
+            "accountId": account_id, "acctAlias": "", "model": "", "currency": "USD",
+            "reportDate": f"{day:%Y%m%d}", "cash": round(rng.uniform(100, 5000), 2),
+            "stock": round(rng.uniform(1e4, 1e5), 2), "dividendAccruals": round(rng.uniform(0, 50), 2),
+            "total": round(rng.uniform(1e4, 1e5), 2),
+        }) + " />"
+    yield "</EquitySummaryInBase>"
+
+    yield "<CashReport>"
+    for currency in ["BASE_SUMMARY"] + [c for c, _ in CURRENCIES]:
+        yield "<CashReportCurrency " + _attrs({
+            "accountId": account_id, "currency": currency, "levelOfDetail": "Currency",
+            "startingCash": round(rng.uniform(0, 5000), 2), "endingCash": round(rng.uniform(0, 5000), 2),
+            "fromDate": f"{start:%Y%m%d}", "toDate": f"{end:%Y%m%d}",
+        }) + " />"
+    yield "</CashReport>"
+
+    yield "<FIFOPerformanceSummaryInBase>"
+    total_realized = 0.0
+    for i, symbol in enumerate(symbols):
+        realized = round(rng.uniform(-500, 800), 2)
+        total_realized += realized
+        yield "<FIFOPerformanceSummaryUnderlying " + _attrs({
+            "accountId": account_id, "assetCategory": "STK", "symbol": symbol, "description": f"{symbol} INC",
+            "conid": 100000 + i, "realizedSTProfit": max(realized, 0), "realizedSTLoss": min(realized, 0),
+            "totalRealizedPnl": realized, "totalUnrealizedPnl": round(rng.uniform(-500, 500), 2),
+            "totalFifoPnl": realized, "reportDate": f"{end:%Y%m%d}",
+        }) + " />"
+    yield "<FIFOPerformanceSummaryUnderlying " + _attrs({
+        "accountId": account_id, "assetCategory": "", "symbol": "", "description": "Total (All Assets)",
+        "conid": "", "totalRealizedPnl": round(total_realized, 2), "reportDate": f"{end:%Y%m%d}",
+    }) + " />"
+    yield "</FIFOPerformanceSummaryInBase>"
+
+    # Trades first, so OpenPositions can report where they left each symbol:
+    # every symbol starts with shares held before the report, and sales
+    # never exceed the holding, so the closing indicator is always right
+    held = [rng.randint(0, 300) for _ in range(n_symbols)]
+    trades = []
+    seconds = sorted(rng.randrange(0, 365 * 86400) for _ in range(n_trades))
+    for i, second in enumerate(seconds):
+        symbol_index = rng.randrange(n_symbols)
+        currency, fx = CURRENCIES[symbol_index % len(CURRENCIES)]
+        day = start + timedelta(seconds=second)
+        buy = rng.random() < 0.55 or held[symbol_index] == 0
+        quantity = rng.randint(1, 100) if buy else -min(rng.randint(1, 100), held[symbol_index])
+        held[symbol_index] += quantity
+        price = round(rng.uniform(5, 400), 2)
+        commission = -round(rng.uniform(0.35, 5), 2)
+        trades.append("<Trade " + _attrs({
+            "accountId": account_id, "currency": currency, "fxRateToBase": fx, "assetCategory": "STK",
+            "symbol": symbols[symbol_index], "description": f"{symbols[symbol_index]} INC",
+            "conid": 100000 + symbol_index, "underlyingSymbol": symbols[symbol_index],
+            "listingExchange": "NASDAQ", "exchange": rng.choice(["NASDAQ", "ARCA", "IBKRATS", "BATS"]),
+            "multiplier": 1, "tradeID": f"{account_id}{i:08d}", "reportDate": f"{day:%Y%m%d}",
+            "dateTime": _datetime(day, second % 86400), "tradeDate": f"{day:%Y%m%d}",
+            "settleDateTarget": f"{day + timedelta(days=2):%Y%m%d}", "transactionType": "ExchTrade",
+            "quantity": quantity, "tradePrice": price, "tradeMoney": round(quantity * price, 2),
+            "proceeds": round(-quantity * price, 2), "ibCommission": commission,
+            "ibCommissionCurrency": currency, "netCash": round(-quantity * price + commission, 2),
+            "cost": round(quantity * price - commission, 2) if buy else round(quantity * price * 0.95, 2),
+            "fifoPnlRealized": 0 if buy else round(rng.uniform(-300, 400), 2),
+            "buySell": "BUY" if buy else "SELL", "openCloseIndicator": "O" if buy else "C",
+            "levelOfDetail": "EXECUTION",
+        }) + " />")
+
+    yield "<OpenPositions>"
+    for i in range(n_positions):
+        symbol_index = i % n_symbols
+        currency, fx = CURRENCIES[symbol_index % len(CURRENCIES)]
+        position = held[symbol_index]
+        if position == 0:
+            continue
+        mark = round(rng.uniform(5, 400), 2)
+        cost_price = round(mark * rng.uniform(0.6, 1.4), 4)
+        value = round(position * mark, 2)
+        cost = round(position * cost_price, 2)
+        yield "<OpenPosition " + _attrs({
+            "accountId": account_id, "currency": currency, "fxRateToBase": fx, "assetCategory": "STK",
+            "subCategory": "COMMON", "symbol": symbols[symbol_index], "description": f"{symbols[symbol_index]} INC",
+            "conid": 100000 + symbol_index, "listingExchange": "NASDAQ",
+            "issuerCountryCode": COUNTRIES[symbol_index % len(COUNTRIES)], "multiplier": 1,
+            "reportDate": f"{end:%Y%m%d}", "position": position, "markPrice": mark, "positionValue": value,
+            "openPrice": cost_price, "costBasisPrice": cost_price, "costBasisMoney": cost,
+            "percentOfNAV": round(rng.uniform(0.1, 5), 2), "fifoPnlUnrealized": round(value - cost, 2),
+            "side": "Long", "levelOfDetail": "SUMMARY", "openDateTime": "", "holdingPeriodDateTime": "",
+        }) + " />"
+    yield "</OpenPositions>"
+
+    yield "<Trades>"
+    yield from trades
+    yield "</Trades>"
+
+    yield "<CashTransactions>"
+    for i in range(max(n_positions // 2, 1)):
+        symbol_index = i % n_symbols
+        currency, fx = CURRENCIES[symbol_index % len(CURRENCIES)]
+        day = start + timedelta(days=rng.randrange(365))
+        gross = round(rng.uniform(1, 200), 2)
+        common = {
+            "accountId": account_id, "currency": currency, "fxRateToBase": fx, "assetCategory": "STK",
+            "symbol": symbols[symbol_index], "conid": 100000 + symbol_index,
+            "issuerCountryCode": COUNTRIES[symbol_index % len(COUNTRIES)],
+            "dateTime": f"{day:%Y%m%d}", "settleDate": f"{day:%Y%m%d}", "reportDate": f"{day:%Y%m%d}",
+        }
+        yield "<CashTransaction " + _attrs(dict(common, type="Dividends", amount=gross,
+                                                description=f"{symbols[symbol_index]} CASH DIVIDEND")) + " />"
+        yield "<CashTransaction " + _attrs(dict(common, type="Withholding Tax", amount=-round(gross * 0.15, 2),
+                                                description=f"{symbols[symbol_index]} US TAX")) + " />"
+    for month in range(1, 13):
+        yield "<CashTransaction " + _attrs({
+            "accountId": account_id, "currency": "USD", "fxRateToBase": 1, "assetCategory": "",
+            "symbol": "", "conid": "", "issuerCountryCode": "", "type": "Broker Interest Received",
+            "amount": round(rng.uniform(1, 30), 2), "dateTime": f"{year}{month:02d}03",
+            "settleDate": f"{year}{month:02d}03", "reportDate": f"{year}{month:02d}03",
+            "description": "USD CREDIT INT",
+        }) + " />"
+        yield "<CashTransaction " + _attrs({
+            "accountId": account_id, "currency": "USD", "fxRateToBase": 1, "assetCategory": "",
+            "symbol": "", "conid": "", "issuerCountryCode": "", "type": "Other Fees",
+            "amount": -10, "dateTime": f"{year}{month:02d}03", "settleDate": f"{year}{month:02d}03",
+            "reportDate": f"{year}{month:02d}03", "description": "MARKET DATA FEE",
+        }) + " />"
+    yield "</CashTransactions>"
+
+    yield "<ChangeInDividendAccruals />"
+    yield "</FlexStatement>"
+
+
+def iter_flex_report(n_trades=1000, n_positions=100, n_symbols=None, accounts=("U0000001",), year=2025, seed=42):
+    """Yield the lines of a synthetic FlexQueryResponse document."""
+    rng = random.Random(seed)
+    n_symbols = n_symbols or max(n_positions, 1)
+    yield '<?xml version="1.0" encoding="UTF-8"?>'
+    yield '<FlexQueryResponse queryName="Synthetic" type="AF">'
+    yield f'<FlexStatements count="{len(accounts)}">'
+    for account_id in accounts:
+        yield from make_statement_rows(account_id, n_trades, n_positions, n_symbols, year, rng)
+    yield "</FlexStatements>"
+    yield "</FlexQueryResponse>"
+
+
+def make_flex_report(**kwargs):
+    return "\n".join(iter_flex_report(**kwargs))
+
+
+def write_flex_report(path, **kwargs):
+    with open(path, "w", encoding="utf-8") as f:
+        for line in iter_flex_report(**kwargs):
+            f.write(line)
+            f.write("\n")
+    return path
@@ -0,0 +1,153 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+from profiling import stage
+
+# Shared by every uvicorn worker on the host. Values are unpickled on read, so
+# the file lives in the app directory, private to the app user (0600), rather
+# than at a predictable path in a world-writable /tmp. It has a directory of
+# its own: users/ holds one directory per username, which any name may take.
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "shared_cache.db")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+# Recording every read as a write would serialize readers on the WAL lock,
+# so the LRU timestamp is only refreshed when it is older than this.
+TOUCH_INTERVAL_SECONDS = 30
+
+# Returned by get() on a miss when passed as `default`; a stored None is a hit
+MISSING = object()
+
+
+class SharedCache:
+    """
+    Host-wide cache for parsed report payloads and analytics aggregates.
+
+    Entries live in a SQLite file in WAL mode so that all worker processes
+    see the same data. Entries are grouped by namespace (the username), which
+    lets the worker that ran /sync drop everything for that user at once.
+    When the file grows over `max_bytes` the least recently used entries are
+    evicted.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[int] = None):
+        self.path = path or os.getenv("SHARED_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.max_bytes = max_bytes or int(os.getenv("SHARED_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.ttl_seconds = ttl_seconds or int(os.getenv("SHARED_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+        # Nothing touches the disk until the first call: the API creates its
+        # cache at import time
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Created owner-only; SQLite gives the -wal/-shm files the same mode
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            os.chmod(self.path, 0o600)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Losing cache entries on a power cut is fine, fsyncs are not.
+            conn.execute("PRAGMA synchronous=OFF")
+            self._init_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _init_schema(conn: sqlite3.Connection):
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (accessed_at)')
+
+    @stage("cache.get")
+    def get(self, namespace: str, key: str, default: Any = None) -> Optional[Any]:
+        """Return the cached value, or `default` on a miss or expired entry."""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT value, expires_at, accessed_at FROM cache_entries WHERE namespace = ? AND key = ?',
+            (namespace, key)
+        ).fetchone()
+        if row is None:
+            return default
+
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at < now:
+            conn.execute('DELETE FROM cache_entries WHERE namespace = ? AND key = ?', (namespace, key))
+            return default
+        if now - accessed_at > TOUCH_INTERVAL_SECONDS:
+            conn.execute(
+                'UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?',
+                (now, namespace, key)
+            )
+        return pickle.loads(value)
+
+    @stage("cache.set")
+    def set(self, namespace: str, key: str, value: Any, ttl_seconds: Optional[int] = None):
+        """Store a value and evict least recently used entries if over budget."""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + (ttl_seconds or self.ttl_seconds)
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (namespace, key, blob, len(blob), expires_at, now)
+            )
+            self._evict(conn, now)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute('DELETE FROM cache_entries WHERE expires_at < ?', (now,))
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache_entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Walk entries oldest-access first until enough bytes are freed.
+        excess = total - self.max_bytes
+        victims = []
+        for namespace, key, size in conn.execute(
+            'SELECT namespace, key, size FROM cache_entries ORDER BY accessed_at ASC'
+        ):
+            victims.append((namespace, key))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany('DELETE FROM cache_entries WHERE namespace = ? AND key = ?', victims)
+
+    def get_or_set(self, namespace: str, key: str, compute: Callable[[], Any],
+                   ttl_seconds: Optional[int] = None) -> Any:
+        """Return the cached value, computing and storing it on a miss (None results are cached too)."""
+        value = self.get(namespace, key, MISSING)
+        if value is MISSING:
+            value = compute()
+            self.set(namespace, key, value, ttl_seconds)
+        return value
+
+    def invalidate(self, namespace: str):
+        """Drop every entry of a namespace, e.g. after a user synced a new report."""
+        self._connect().execute('DELETE FROM cache_entries WHERE namespace = ?', (namespace,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache_entries')
@@ -0,0 +1,259 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional
+import pandas as pd
+from parser import FlexReport, SUMMARY_SECTIONS, flex_datetimes
+from fx import FxRates, FX_SECTIONS
+from summary import compute_summary, convert_summary, SUMMARY_MONEY_FIELDS, TOP_POSITIONS
+
+HOUSEHOLD_FILE = "household.json"
+# Worker processes shared by all household requests of this API worker; by
+# default the cores are split between the API workers, each having a pool
+CONSOLIDATION_WORKERS = int(os.getenv(
+    "CONSOLIDATION_WORKERS", max(1, (os.cpu_count() or 1) // max(1, int(os.getenv("API_WORKERS", 1))))
+))
+STATEMENT_SECTIONS = list(dict.fromkeys(SUMMARY_SECTIONS + FX_SECTIONS))
+# Per-currency figures in the currency itself, so they add up across accounts
+CURRENCY_FIELDS = ["position_value", "unrealized_pnl", "cash"]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+# --- Household links ---
+def load_links(user_dir: str) -> List[str]:
+    """Users this user agreed to share a household with."""
+    path = os.path.join(user_dir, HOUSEHOLD_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return list(json.load(f).get("links", []))
+
+
+def save_links(user_dir: str, users: List[str]):
+    with open(os.path.join(user_dir, HOUSEHOLD_FILE), "w") as f:
+        json.dump({"links": sorted(set(users))}, f, indent=4)
+
+
+def household_members(user: str, user_dir: Callable[[str], str]) -> List[str]:
+    """
+    The user followed by every user linked with them in both directions:
+    a household only includes someone's reports once both have listed each
+    other in their household.json. Links are not transitive.
+    """
+    members = [user]
+    for other in load_links(user_dir(user)):
+        if other != user and user in load_links(user_dir(other)):
+            members.append(other)
+    return members
+
+
+# --- Per-account processing ---
+def statement_jobs(user: str, report_path: str, report: FlexReport) -> List[dict]:
+    """
+    One job per FlexStatement (one account each) of an open report. Jobs
+    carry the report's byte index, so workers read their own statement's
+    sections without scanning the whole file again.
+    """
+    return [
+        {"user": user, "report_path": report_path, "statement": index, "account_id": account or "",
+         "index": report.index}
+        for index, account in enumerate(report.account_ids)
+    ]
+
+
+def process_statement(job: dict, target_currency: str, rate_files: List[str]) -> dict:
+    """
+    Worker: summary of one statement (one account) of a report, converted
+    from the report's base currency into `target_currency` at the report
+    date. Only the statement's own byte ranges are parsed; only the summary
+    (a few KB) goes back to the parent process.
+    """
+    started = time.perf_counter()
+    result = {key: value for key, value in job.items() if key != "index"}
+    result["error"] = None
+    try:
+        with FlexReport(job["report_path"], index=job["index"]) as report:
+            sections = report.sections(STATEMENT_SECTIONS, statement=job["statement"])
+            last_update = report.statements[job["statement"]]["attrs"].get("whenGenerated") or report.last_update
+        fx_rates = FxRates.from_sections(sections, rate_files)
+        base = fx_rates.base_currency
+        if target_currency == base:
+            factor = 1.0
+        elif fx_rates.can_convert(target_currency):
+            as_of = flex_datetimes(pd.Series([last_update or ""])).to_numpy()
+            factor = float(fx_rates.convert([1.0], [base], as_of, target_currency)[0])
+        else:
+            factor = None
+        summary = compute_summary(sections)
+        result.update({
+            "last_report_generated": last_update,
+            "base_currency": base,
+            "converted": factor is not None,
+            "factor": factor or 1.0,
+            # Accounts without a rate to the household currency stay in their base currency
+            "summary": convert_summary(summary, factor or 1.0, target_currency if factor else base, base),
+            "rows": {name: len(df) for name, df in sections.items()},
+        })
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """The shared process pool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that runs threads (the API threadpool) is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=CONSOLIDATION_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def shutdown_pool(pool: Optional[ProcessPoolExecutor] = None):
+    """Shut the shared pool down; with `pool`, only if that is still the shared one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and pool in (None, _pool):
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def run_jobs(jobs: List[dict], target_currency: str, rate_files: Dict[str, List[str]],
+             parallel: bool = True) -> List[dict]:
+    """
+    Process statements, in the shared process pool when there is more than
+    one, so the wall-clock time stays close to that of the slowest account
+    rather than growing with their number. Results keep the order of `jobs`.
+
+    A pool whose worker died (killed by the OOM killer, say) is broken for
+    good: it is replaced and the jobs retried once, then run serially.
+    """
+    if not parallel or len(jobs) <= 1 or CONSOLIDATION_WORKERS <= 1:
+        return [process_statement(job, target_currency, rate_files.get(job["user"], [])) for job in jobs]
+    for attempt in range(2):
+        pool = get_pool()
+        try:
+            return _run_in_pool(pool, jobs, target_currency, rate_files)
+        except BrokenProcessPool as e:
+            print(f"Warning: consolidation pool broke (attempt {attempt + 1}): {e}")
+            # Another request may have replaced it already
+            shutdown_pool(pool)
+    return run_jobs(jobs, target_currency, rate_files, parallel=False)
+
+
+def _run_in_pool(pool: ProcessPoolExecutor, jobs: List[dict], target_currency: str,
+                 rate_files: Dict[str, List[str]]) -> List[dict]:
+    futures = {
+        pool.submit(process_statement, job, target_currency, rate_files.get(job["user"], [])): index
+        for index, job in enumerate(jobs)
+    }
+    results = [None] * len(jobs)
+    for future in as_completed(futures):
+        results[futures[future]] = future.result()
+    return results
+
+
+# --- Household merge ---
+def _latest_per_account(results: List[dict]) -> List[dict]:
+    """
+    One result per account: an account shared by two members' Flex queries
+    (or listed twice in one report) counts once, from the most recent report.
+    """
+    latest = {}
+    for result in results:
+        key = result["account_id"] or f"{result['user']}:{result['report_path']}:{result['statement']}"
+        current = latest.get(key)
+        if current is None or (result["last_report_generated"] or "") > (current["last_report_generated"] or ""):
+            latest[key] = result
+    return list(latest.values())
+
+
+def merge_household(results: List[dict], currency: str) -> dict:
+    """
+    Household summary from per-account results: totals over the accounts
+    converted to `currency`, per-member and per-currency breakdowns, the
+    largest positions across accounts, and one drilldown entry per account
+    with its own summary. Accounts that could not be converted are listed
+    (with their figures in their base currency) but left out of the totals.
+    """
+    failed = [
+        {"user": result["user"], "account_id": result["account_id"], "error": result["error"]}
+        for result in results if result["error"]
+    ]
+    accounts = sorted(
+        _latest_per_account([result for result in results if not result["error"]]),
+        key=lambda result: (result["user"], result["account_id"])
+    )
+    included = [result for result in accounts if result["converted"]]
+
+    totals = {field: 0.0 for field in SUMMARY_MONEY_FIELDS}
+    by_user: Dict[str, dict] = {}
+    currencies: Dict[str, dict] = {}
+    positions = []
+    for result in included:
+        summary = result["summary"]
+        member = by_user.setdefault(result["user"], {
+            "user": result["user"], "accounts": 0, **{field: 0.0 for field in SUMMARY_MONEY_FIELDS}
+        })
+        member["accounts"] += 1
+        for field in SUMMARY_MONEY_FIELDS:
+            totals[field] += summary.get(field, 0.0)
+            member[field] += summary.get(field, 0.0)
+        for entry in summary.get("currencies", []):
+            merged = currencies.setdefault(entry["currency"], {
+                "currency": entry["currency"], "positions": 0, "position_value_household": 0.0,
+                **{field: 0.0 for field in CURRENCY_FIELDS}
+            })
+            merged["positions"] += entry["positions"]
+            merged["position_value_household"] += entry["position_value_base"] * result["factor"]
+            for field in CURRENCY_FIELDS:
+                merged[field] += entry[field]
+        positions.extend(
+            {**position, "user": result["user"], "account_id": result["account_id"]}
+            for position in summary.get("top_positions", [])
+        )
+
+    # The household's largest positions are among the largest of each account
+    equity = totals["total_equity"]
+    top_positions = [
+        {**position, "allocation": round(position["value"] / equity * 100.0, 2) if equity else 0.0}
+        for position in sorted(positions, key=lambda position: position["value"], reverse=True)[:TOP_POSITIONS]
+    ]
+    return {
+        "currency": currency,
+        "summary": {
+            **{field: round(value, 2) for field, value in totals.items()},
+            "top_positions": top_positions,
+            "accounts": len(included),
+        },
+        "by_user": [
+            {**member, **{field: round(member[field], 2) for field in SUMMARY_MONEY_FIELDS}}
+            for member in by_user.values()
+        ],
+        "currencies": [
+            {**entry, **{field: round(entry[field], 2) for field in CURRENCY_FIELDS + ["position_value_household"]}}
+            for _, entry in sorted(currencies.items())
+        ],
+        "accounts": [
+            {
+                "user": result["user"],
+                "account_id": result["account_id"],
+                "statement": result["statement"],
+                "last_report_generated": result["last_report_generated"],
+                "base_currency": result["base_currency"],
+                "in_totals": result["converted"],
+                "summary": result["summary"],
+            }
+            for result in accounts
+        ],
+        "failed": failed,
+    }
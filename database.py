@@ -1,8 +1,11 @@
 import sqlite3
 import os
 from typing import Optional, Dict, Any
+from profiling import stage
 
 DB_NAME = "users.db"
+# Bump when the DDL in init_db changes; stored in PRAGMA user_version
+SCHEMA_VERSION = 1
 
 def get_db_path():
     # Store db in the users directory for persistence
@@ -10,11 +13,25 @@ def get_db_path():
     os.makedirs(users_dir, exist_ok=True)
     return os.path.join(users_dir, DB_NAME)
 
-def init_db():
-    """Initialize the database with the users table."""
+def init_db() -> int:
+    """
+    Create the tables if the database is older than SCHEMA_VERSION. An
+    up-to-date database costs one PRAGMA read; a newer one (written by a
+    later release) is refused. Returns the schema version.
+    """
     conn = sqlite3.connect(get_db_path())
     cursor = conn.cursor()
     
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    if version == SCHEMA_VERSION:
+        conn.close()
+        return version
+    if version > SCHEMA_VERSION:
+        conn.close()
+        raise RuntimeError(
+            f"Database schema version {version} is newer than this release supports ({SCHEMA_VERSION})"
+        )
+    
     # Create users table with profile fields
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -39,10 +56,13 @@ def init_db():
     )
     ''')
     
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
     conn.commit()
     conn.close()
+    return SCHEMA_VERSION
 
 
+@stage("db.get_user_by_username")
 def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
     """Retrieve a user by username."""
     conn = sqlite3.connect(get_db_path())
@@ -58,6 +78,7 @@ def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
         return dict(user)
     return None
 
+@stage("db.create_user")
 def create_user(username: str, hashed_password: str) -> bool:
     """Create a new user. Returns True if successful, False if username exists."""
     try:
@@ -87,6 +108,7 @@ def create_user(username: str, hashed_password: str) -> bool:
         print(f"Error creating user: {e}")
         return False
 
+@stage("db.update_user_profile")
 def update_user_profile(username: str, email: Optional[str] = None, display_name: Optional[str] = None) -> bool:
     """Update user profile information."""
     try:
@@ -118,6 +140,7 @@ def update_user_profile(username: str, email: Optional[str] = None, display_name
         print(f"Error updating user profile: {e}")
         return False
 
+@stage("db.update_user_password")
 def update_user_password(username: str, new_hashed_password: str) -> bool:
     """Update user password."""
     try:
@@ -136,6 +159,7 @@ def update_user_password(username: str, new_hashed_password: str) -> bool:
         print(f"Error updating password: {e}")
         return False
 
+@stage("db.get_user_preferences")
 def get_user_preferences(username: str) -> Optional[Dict[str, Any]]:
     """Get user preferences."""
     try:
@@ -159,6 +183,7 @@ def get_user_preferences(username: str) -> Optional[Dict[str, Any]]:
         print(f"Error getting preferences: {e}")
         return None
 
+@stage("db.update_user_preferences")
 def update_user_preferences(username: str, theme: Optional[str] = None, 
                            language: Optional[str] = None, 
                            default_currency: Optional[str] = None) -> bool:
@@ -208,6 +233,3 @@ def update_user_preferences(username: str, theme: Optional[str] = None,
     except Exception as e:
         print(f"Error updating preferences: {e}")
         return False
-
-# Initialize DB on module import (or can be called explicitly)
-init_db()
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+from typing import Callable, Dict, Optional, Set
+
+# Events buffered per connection before the oldest are dropped (slow client)
+SUBSCRIBER_QUEUE_SIZE = 100
+# Seconds between keepalive comments, which keep proxies from closing idle streams
+KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", 15))
+# Reconnect delay suggested to EventSource clients, in milliseconds
+RETRY_MS = 5000
+
+
+def format_sse(event: str, data, event_id: Optional[str] = None) -> str:
+    """One Server-Sent Events message with a JSON payload."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventBroker:
+    """
+    In-process publish/subscribe of per-user events.
+
+    Each open stream is one bounded asyncio.Queue, so an idle connection
+    costs a queue and a suspended coroutine, and thousands of them fit in
+    one worker. Publishing must happen on the event loop; worker threads
+    (syncs run in the threadpool) go through `threadsafe_publisher`.
+
+    Subscribers only see events published by the same process. Streams also
+    watch the stored report version (see `event_stream`) so a sync finished
+    by another worker still reaches them.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._sequence = 0
+
+    def subscribe(self, user: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user]
+
+    def subscriber_count(self, user: Optional[str] = None) -> int:
+        if user is not None:
+            return len(self._subscribers.get(user, ()))
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def publish(self, user: str, event: str, data: dict):
+        """Queue an event for every stream of `user`. Call from the event loop."""
+        self._sequence += 1
+        message = (str(self._sequence), event, data)
+        for queue in self._subscribers.get(user, ()):
+            if queue.full():
+                # Keep the newest events for clients that fall behind
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def threadsafe_publisher(self, user: str) -> Callable[..., None]:
+        """
+        `notify(event, **data)` usable from any thread; it hands the event to
+        the loop that was running when this was called.
+        """
+        loop = asyncio.get_running_loop()
+
+        def notify(event: str, **data):
+            if self._subscribers.get(user):
+                loop.call_soon_threadsafe(self.publish, user, event, data)
+
+        return notify
+
+
+async def event_stream(broker: EventBroker, user: str, is_disconnected,
+                       current_version: Callable[[], Optional[str]],
+                       keepalive: float = KEEPALIVE_SECONDS):
+    """
+    Async generator of SSE text for one connection: a `ready` event, then
+    each published event as it arrives. Every `keepalive` seconds without
+    events it sends a comment, stops if the client went away, and emits a
+    `report` event when `current_version()` changed since the last one it
+    reported.
+    """
+    queue = broker.subscribe(user)
+    try:
+        version = current_version()
+        yield f"retry: {RETRY_MS}\n\n"
+        yield format_sse("ready", {"report_version": version})
+        while True:
+            try:
+                event_id, event, data = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    break
+                latest = current_version()
+                if latest != version:
+                    version = latest
+                    yield format_sse("report", {"report_version": version})
+                else:
+                    yield ": keepalive\n\n"
+                continue
+            if data.get("report_version"):
+                version = data["report_version"]
+            yield format_sse(event, data, event_id)
+    finally:
+        broker.unsubscribe(user, queue)
@@ -42,6 +42,8 @@ function App() {
   const [lastReportGenerated, setLastReportGenerated] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  // started_at of the sync being waited for (true: whichever sync is running)
+  const [pendingSync, setPendingSync] = useState(null);
   const [currentTime, setCurrentTime] = useState(new Date());
   const [activeIndex, setActiveIndex] = useState(null);
   const [focusedIndex, setFocusedIndex] = useState(null);
@@ -208,11 +210,18 @@ function App() {
   const fetchData = async (isSync = false) => {
     setLoading(true);
     setError(null);
+    // A sync keeps the loading state until its 'completed' or 'failed' event
+    // (or until /sync/status reports it, if the event is missed)
+    let syncPending = false;
     try {
       const config = { headers: { 'Authorization': `Bearer ${token}` } };
-      const response = isSync
-        ? await axios.post(`${API_BASE}/sync`, {}, config)
-        : await axios.get(`${API_BASE}/latest`, config);
+      if (isSync) {
+        const response = await axios.post(`${API_BASE}/sync?wait=false`, {}, config);
+        syncPending = true;
+        setPendingSync(response.data.started_at || true);
+        return;
+      }
+      const response = await axios.get(`${API_BASE}/latest`, config);
       if (response.data.status === 'success') {
         setData(response.data.data);
         setSummary(response.data.summary);
@@ -226,6 +235,12 @@ function App() {
         handleLogout();
         return;
       }
+      if (err.response?.status === 409) {
+        // A sync is already running; wait for its events
+        syncPending = true;
+        setPendingSync(true);
+        return;
+      }
       if (err.response?.data?.detail) {
         setError(err.response.data.detail);
       } else {
@@ -233,7 +248,9 @@ function App() {
         setError(t('error_connection'));
       }
     } finally {
-      setLoading(false);
+      if (!syncPending) {
+        setLoading(false);
+      }
     }
   };
 
@@ -243,6 +260,80 @@ function App() {
     }
   }, [user, token]);
 
+  // Sync progress and new reports pushed by the API
+  useEffect(() => {
+    if (!user || !token) return;
+    let source = null;
+    let retryTimer = null;
+    let closed = false;
+
+    // Each (re)connection gets a fresh short-lived stream token: the URL is
+    // logged by proxies, so the access token never goes in it
+    const connect = async () => {
+      try {
+        const config = { headers: { 'Authorization': `Bearer ${token}` } };
+        const response = await axios.post(`${API_BASE}/events/token`, {}, config);
+        if (closed) return;
+        source = new EventSource(`${API_BASE}/events?token=${encodeURIComponent(response.data.token)}`);
+      } catch (err) {
+        if (!closed) retryTimer = setTimeout(connect, 5000);
+        return;
+      }
+      source.addEventListener('sync', (event) => {
+        const message = JSON.parse(event.data);
+        if (message.stage === 'completed') {
+          setPendingSync(null);
+          fetchData();
+        } else if (message.stage === 'failed') {
+          setPendingSync(null);
+          setError(message.error);
+          setLoading(false);
+        } else {
+          setLoading(true);
+        }
+      });
+      source.addEventListener('report', () => fetchData());
+      source.onerror = () => {
+        // EventSource retries on its own with the same URL, which fails
+        // once the stream token expired; reconnect with a new one instead
+        if (source.readyState === EventSource.CLOSED && !closed) {
+          retryTimer = setTimeout(connect, 5000);
+        }
+      };
+    };
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+    };
+  }, [user, token]);
+
+  // Fallback for a sync whose events never arrive (stream down, or the sync
+  // ran in another API worker): poll its persisted outcome
+  useEffect(() => {
+    if (!pendingSync || !token) return;
+    const config = { headers: { 'Authorization': `Bearer ${token}` } };
+    const timer = setInterval(async () => {
+      try {
+        const response = await axios.get(`${API_BASE}/sync/status`, config);
+        const sync = response.data.sync || {};
+        if (pendingSync !== true && sync.started_at !== pendingSync) return;
+        if (sync.status === 'completed') {
+          setPendingSync(null);
+          fetchData();
+        } else if (sync.status === 'failed') {
+          setPendingSync(null);
+          setError(sync.error);
+          setLoading(false);
+        }
+      } catch (err) {
+        if (err.response?.status === 401) handleLogout();
+      }
+    }, 3000);
+    return () => clearInterval(timer);
+  }, [pendingSync, token]);
+
   const openPositions = data?.OpenPositions || [];
 
   // Use summary if available, otherwise fallback (though summary should always be there if data is there)
@@ -0,0 +1,170 @@
+import os
+import numpy as np
+import pandas as pd
+from parser import flex_datetimes
+from summary import numeric
+
+# Sections carrying @fxRateToBase, with their date columns in order of preference
+RATE_SOURCES = {
+    "Trades": ["@dateTime", "@tradeDate"],
+    "CashTransactions": ["@dateTime", "@settleDate", "@reportDate"],
+    "OpenPositions": ["@reportDate"],
+}
+# EquitySummaryInBase rows carry the base currency itself
+FX_SECTIONS = list(RATE_SOURCES) + ["EquitySummaryInBase"]
+DEFAULT_BASE_CURRENCY = "USD"
+
+
+def _day(dates):
+    return pd.Series(np.asarray(dates, dtype="datetime64[s]")).dt.normalize().to_numpy()
+
+
+def extract_rates(sections):
+    """(date, currency, rate_to_base) rows from the @fxRateToBase of every RATE_SOURCES section."""
+    frames = []
+    for name, date_columns in RATE_SOURCES.items():
+        df = sections.get(name, pd.DataFrame())
+        date_column = next((col for col in date_columns if col in df.columns), None)
+        if df.empty or date_column is None or "@currency" not in df.columns or "@fxRateToBase" not in df.columns:
+            continue
+        frames.append(pd.DataFrame({
+            "date": _day(flex_datetimes(df[date_column])),
+            "currency": df["@currency"].fillna("").astype(str).to_numpy(),
+            "rate_to_base": numeric(df, "@fxRateToBase"),
+        }))
+    if not frames:
+        return pd.DataFrame(columns=["date", "currency", "rate_to_base"])
+    rates = pd.concat(frames, ignore_index=True)
+    return rates[rates["date"].notna() & (rates["currency"] != "") & (rates["rate_to_base"] > 0)]
+
+
+def load_rate_file(path):
+    """
+    Rates from a local CSV with `date,currency,rate_to_base` columns, where
+    rate_to_base is the value of one unit of `currency` in the report's base
+    currency (the same convention as IBKR's fxRateToBase).
+    """
+    if not path or not os.path.exists(path):
+        return pd.DataFrame(columns=["date", "currency", "rate_to_base"])
+    raw = pd.read_csv(path, dtype=str)
+    rates = pd.DataFrame({
+        "date": _day(flex_datetimes(raw["date"])),
+        "currency": raw["currency"].str.strip().str.upper().to_numpy(),
+        "rate_to_base": pd.to_numeric(raw["rate_to_base"], errors="coerce").to_numpy(),
+    })
+    return rates[rates["date"].notna() & (rates["rate_to_base"] > 0)]
+
+
+class FxRates:
+    """
+    Date-indexed table of rates to the report's base currency.
+
+    Conversions are as-of joins (pd.merge_asof by currency): an amount dated
+    D uses the latest known rate on or before D, or the earliest one after it
+    when D precedes every known rate.
+    """
+
+    def __init__(self, table, base_currency=DEFAULT_BASE_CURRENCY):
+        self.base_currency = base_currency
+        self.table = table.sort_values("date", kind="stable").reset_index(drop=True)
+
+    @classmethod
+    def from_sections(cls, sections, rate_files=()):
+        """Build the table from report sections; local rate files fill currencies and dates they lack."""
+        report_rates = extract_rates(sections)
+        base_currency = cls.reported_base_currency(sections) or cls.detect_base_currency(report_rates)
+        frames = [frame for frame in [report_rates] + [load_rate_file(path) for path in rate_files] if not frame.empty]
+        table = pd.concat(frames, ignore_index=True) if frames else report_rates
+        # Report rates come first, so they win over file rates for the same day
+        table = table.drop_duplicates(subset=["date", "currency"], keep="first")
+        return cls(table[table["currency"] != base_currency], base_currency)
+
+    @staticmethod
+    def reported_base_currency(sections):
+        """The @currency of the EquitySummaryInBase rows (amounts in base), or None without them."""
+        equity_summary = sections.get("EquitySummaryInBase", pd.DataFrame())
+        if equity_summary.empty or "@currency" not in equity_summary.columns:
+            return None
+        currencies = equity_summary["@currency"].fillna("").astype(str).str.strip()
+        currencies = currencies[currencies != ""]
+        return currencies.mode().iloc[0] if not currencies.empty else None
+
+    @staticmethod
+    def detect_base_currency(rates):
+        """
+        The most used currency whose rate to base is always 1: the guess
+        for reports without EquitySummaryInBase.
+        """
+        if rates.empty:
+            return DEFAULT_BASE_CURRENCY
+        is_one = rates.assign(is_one=np.isclose(rates["rate_to_base"], 1.0))
+        stats = is_one.groupby("currency")["is_one"].agg(["all", "size"])
+        candidates = stats[stats["all"]]
+        if candidates.empty:
+            return DEFAULT_BASE_CURRENCY
+        return candidates["size"].idxmax()
+
+    @property
+    def currencies(self):
+        return sorted(set(self.table["currency"]) | {self.base_currency})
+
+    def can_convert(self, currency):
+        return currency in self.currencies
+
+    def rates_to_base(self, currencies, dates):
+        """Vector of as-of rates to base; NaN where a currency has no rate at all."""
+        currencies = np.asarray(currencies, dtype=object)
+        dates = np.asarray(dates, dtype="datetime64[s]")
+        result = np.full(len(currencies), np.nan)
+        result[currencies == self.base_currency] = 1.0
+
+        todo = np.flatnonzero(currencies != self.base_currency)
+        if len(todo) == 0 or self.table.empty:
+            return result
+
+        table = self.table.assign(date=self.table["date"].astype("datetime64[s]"))
+        left_dates = dates[todo]
+        # Undated amounts use the latest rate
+        left_dates = np.where(np.isnat(left_dates), table["date"].max().to_datetime64(), left_dates)
+        left = pd.DataFrame({"currency": currencies[todo], "date": left_dates, "pos": todo}).sort_values("date")
+
+        merged = pd.merge_asof(left, table, on="date", by="currency", direction="backward")
+        missing = merged["rate_to_base"].isna().to_numpy()
+        if missing.any():
+            forward = pd.merge_asof(left[missing], table, on="date", by="currency", direction="forward")
+            merged.loc[missing, "rate_to_base"] = forward["rate_to_base"].to_numpy()
+        result[merged["pos"].to_numpy()] = merged["rate_to_base"].to_numpy()
+        return result
+
+    def convert(self, amounts, currencies, dates, target):
+        """Convert amounts in `currencies` on `dates` into `target`."""
+        amounts = np.asarray(amounts, dtype=float)
+        dates = np.asarray(dates, dtype="datetime64[s]")
+        source = self.rates_to_base(currencies, dates)
+        target_rates = self.rates_to_base(np.full(len(amounts), target, dtype=object), dates)
+        return amounts * source / target_rates
+
+    def convert_columns(self, df, columns, currency_column, date_column, target, suffix="_converted"):
+        """Copy of `df` with `<column><suffix>` in `target` for each of `columns`, in one as-of join."""
+        converted = df.copy()
+        if df.empty:
+            for column in columns:
+                converted[column + suffix] = pd.Series(dtype=float)
+            return converted
+        currencies = df[currency_column].to_numpy()
+        dates = df[date_column].to_numpy()
+        factor = self.convert(np.ones(len(df)), currencies, dates, target)
+        for column in columns:
+            converted[column + suffix] = df[column].to_numpy(dtype=float) * factor
+        return converted
+
+    def rate_range(self, start=None, end=None, currencies=None):
+        """Slice of the rate table, optionally limited to a date range and currencies."""
+        table = self.table
+        if start is not None:
+            table = table[table["date"] >= pd.Timestamp(start)]
+        if end is not None:
+            table = table[table["date"] <= pd.Timestamp(end)]
+        if currencies:
+            table = table[table["currency"].isin(currencies)]
+        return table
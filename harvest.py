@@ -0,0 +1,221 @@
+import numpy as np
+import pandas as pd
+from parser import flex_datetimes
+from summary import numeric, TOTAL_ROW_DESCRIPTION
+from lots import lots_frame, QUANTITY_EPSILON
+from wash_sales import WASH_SALE_WINDOW_DAYS, SECONDS_PER_DAY
+
+HARVEST_SECTIONS = ["Trades", "OpenPositions", "FIFOPerformanceSummaryInBase"]
+HARVEST_MATCH_KEYS = ["conid", "symbol", "underlying"]
+# Holding period after which a gain or loss is long term
+LONG_TERM_DAYS = 365
+
+REALIZED_COLUMNS = {
+    "realized_st_profit": "@realizedSTProfit",
+    "realized_st_loss": "@realizedSTLoss",
+    "realized_lt_profit": "@realizedLTProfit",
+    "realized_lt_loss": "@realizedLTLoss",
+    "realized_total": "@totalRealizedPnl",
+}
+
+CANDIDATE_COLUMNS = [
+    "account_id", "symbol", "conid", "trade_id", "acquired", "holding_days", "term", "quantity",
+    "currency", "cost", "mark_price", "market_value", "unrealized_pnl", "unrealized_pnl_base",
+    "conflict_quantity", "allowed_loss_base", "repurchase_conflict", "rebuy_after",
+]
+MONEY_COLUMNS = ["cost", "market_value", "unrealized_pnl", "unrealized_pnl_base", "allowed_loss_base"]
+
+
+def _text(df, column):
+    if column not in df.columns:
+        return np.full(len(df), "", dtype=object)
+    return df[column].fillna("").astype(str).to_numpy()
+
+
+def _summary_rows(df):
+    """Rows with levelOfDetail SUMMARY (all rows when the column is missing)."""
+    if df.empty or "@levelOfDetail" not in df.columns:
+        return df
+    return df[(df["@levelOfDetail"].fillna("SUMMARY").astype(str).str.upper() == "SUMMARY").to_numpy()]
+
+
+def _position_prices(open_positions):
+    """Mark price, multiplier, FX rate and match keys per (account, conid) from OpenPositions."""
+    rows = _summary_rows(open_positions)
+    multiplier = numeric(rows, "@multiplier")
+    fx_rate = numeric(rows, "@fxRateToBase")
+    symbols = pd.Series(_text(rows, "@symbol")).str.strip().str.upper()
+    underlying = pd.Series(_text(rows, "@underlyingSymbol")).str.strip().str.upper()
+    prices = pd.DataFrame({
+        "account_id": _text(rows, "@accountId"),
+        "conid": _text(rows, "@conid"),
+        "currency": _text(rows, "@currency"),
+        "mark_price": numeric(rows, "@markPrice"),
+        "multiplier": np.where(multiplier == 0, 1.0, multiplier),
+        "fx_rate_to_base": np.where(fx_rate == 0, 1.0, fx_rate),
+        "symbol_key": symbols.to_numpy(),
+        # Stocks usually have an empty underlyingSymbol; they are their own underlying
+        "underlying_key": underlying.where(underlying != "", symbols).to_numpy(),
+    })
+    return prices.drop_duplicates(["account_id", "conid"], keep="last")
+
+
+def _as_of(open_positions):
+    """Report date of OpenPositions (latest @reportDate), else today."""
+    if "@reportDate" in open_positions.columns:
+        dates = flex_datetimes(open_positions["@reportDate"]).dropna()
+        if not dates.empty:
+            return dates.max().to_datetime64().astype("datetime64[s]")
+    return np.datetime64(pd.Timestamp.now().normalize(), "s")
+
+
+def _realized_by_account(fifo_summary):
+    """Realized short/long term profit and loss per account, from the Total rows when present."""
+    if fifo_summary.empty:
+        return pd.DataFrame(columns=["account_id"] + list(REALIZED_COLUMNS))
+    rows = fifo_summary
+    if "@description" in rows.columns:
+        is_total = (rows["@description"] == TOTAL_ROW_DESCRIPTION).to_numpy()
+        if is_total.any():
+            rows = rows[is_total]
+        else:
+            # Per-underlying rows only; other rows of the section are subtotals
+            rows = rows[(_text(rows, "@symbol") != "")]
+    realized = pd.DataFrame({name: numeric(rows, column) for name, column in REALIZED_COLUMNS.items()})
+    realized["account_id"] = _text(rows, "@accountId")
+    return realized.groupby("account_id", as_index=False, sort=True).sum()
+
+
+def prepare_harvest_data(state, sections):
+    """
+    Everything the scanner needs from a lot state and a report: the open
+    lots joined with their OpenPositions mark price, multiplier and FX
+    rate, one integer key code per lot for each HARVEST_MATCH_KEYS mode,
+    the realized PnL per account from FIFOPerformanceSummaryInBase, and the
+    report date.
+
+    It depends only on the report, so the API computes it once per report
+    and caches it. Lots are kept as plain NumPy arrays (text as fixed-width
+    strings) rather than a DataFrame, which makes the cached copy cheap to
+    unpickle and leaves each scan nothing but array arithmetic.
+    """
+    empty = pd.DataFrame()
+    open_positions = sections.get("OpenPositions", empty)
+    lots = lots_frame(state).merge(_position_prices(open_positions), on=["account_id", "conid"], how="left")
+    symbols = lots["symbol"].astype(str).str.strip().str.upper()
+    lots["symbol_key"] = lots["symbol_key"].fillna(symbols)
+    lots["underlying_key"] = lots["underlying_key"].fillna(lots["symbol_key"])
+
+    def codes(values):
+        return pd.factorize(values.fillna("").astype(str))[0].astype(np.int64)
+
+    account_codes, accounts = pd.factorize(lots["account_id"].astype(str))
+    # Lots of positions missing from OpenPositions have no price (NaN) and are never candidates
+    columns = {
+        "quantity": lots["quantity"].to_numpy(dtype=float),
+        "cost": lots["cost"].to_numpy(dtype=float),
+        "mark_price": lots["mark_price"].to_numpy(dtype=float, na_value=np.nan),
+        "multiplier": lots["multiplier"].to_numpy(dtype=float, na_value=1.0),
+        "fx_rate_to_base": lots["fx_rate_to_base"].to_numpy(dtype=float, na_value=1.0),
+        "acquired": pd.to_datetime(lots["acquired"]).to_numpy().astype("datetime64[s]").astype(np.int64),
+        "account_code": account_codes.astype(np.int64),
+    }
+    for name in ["account_id", "symbol", "conid", "trade_id", "currency"]:
+        columns[name] = np.asarray(lots[name].fillna("").astype(str).to_numpy(), dtype=str)
+    return {
+        "as_of": _as_of(open_positions),
+        "lots": columns,
+        "accounts": np.asarray(accounts, dtype=str),
+        "key_codes": {
+            "conid": codes(lots["conid"]),
+            "symbol": codes(lots["symbol_key"]),
+            "underlying": codes(lots["underlying_key"]),
+        },
+        "realized": _realized_by_account(sections.get("FIFOPerformanceSummaryInBase", empty)),
+    }
+
+
+def scan_harvest(data, window_days=WASH_SALE_WINDOW_DAYS, match_on="conid", min_loss=0.0, limit=None):
+    """
+    Long lots that would realize a loss if sold at the report's mark price,
+    ranked by unrealized loss in base currency (largest first), then by
+    holding period (short term first, as short-term losses offset gains
+    taxed at the higher rate).
+
+    A sale today is washed by purchases in the `window_days` before it that
+    are still held after it: the other open lots of the same security
+    (per `match_on`) acquired inside the window. Each candidate is checked
+    on its own against those lots, with one array pass over all accounts:
+    `conflict_quantity` is how much of the lot the sale could not deduct
+    (`allowed_loss_base` is what remains), and `rebuy_after` the first day
+    a repurchase is outside the window.
+
+    Returns the candidates (CANDIDATE_COLUMNS) and per-account totals of
+    realized PnL and allowed harvestable loss.
+    """
+    if match_on not in HARVEST_MATCH_KEYS:
+        raise ValueError(f"match_on must be one of {', '.join(HARVEST_MATCH_KEYS)}")
+    lots, as_of = data["lots"], data["as_of"]
+    as_of_seconds = int(as_of.astype(np.int64))
+
+    quantity = lots["quantity"]
+    market_value = quantity * lots["mark_price"] * lots["multiplier"]
+    unrealized = market_value - lots["cost"]
+    unrealized_base = unrealized * lots["fx_rate_to_base"]
+    holding_days = (as_of_seconds - lots["acquired"]) // SECONDS_PER_DAY
+
+    # Open lots of the same key (across accounts, like wash_sales) bought
+    # inside the window, minus the lot itself
+    key_codes = data["key_codes"][match_on]
+    window_start = as_of_seconds - as_of_seconds % SECONDS_PER_DAY - window_days * SECONDS_PER_DAY
+    recent_quantity = np.where((quantity > 0) & (lots["acquired"] >= window_start), quantity, 0.0)
+    held_recent = np.bincount(key_codes, weights=recent_quantity)
+    conflict = np.clip(held_recent[key_codes] - recent_quantity, 0.0, np.maximum(quantity, 0.0)) \
+        if len(key_codes) else recent_quantity
+    allowed = unrealized_base * (1.0 - conflict / np.where(quantity == 0, 1.0, quantity))
+
+    candidate = (quantity > QUANTITY_EPSILON) & np.isfinite(unrealized_base) & (unrealized_base < -abs(min_loss))
+    all_rows = np.flatnonzero(candidate)
+    rows = all_rows[np.lexsort((holding_days[all_rows], unrealized_base[all_rows]))]
+    if limit is not None:
+        rows = rows[:limit]
+
+    rebuy_after = np.datetime64(as_of, "D") + np.timedelta64(window_days + 1, "D")
+    candidates = pd.DataFrame({
+        "account_id": lots["account_id"][rows],
+        "symbol": lots["symbol"][rows],
+        "conid": lots["conid"][rows],
+        "trade_id": lots["trade_id"][rows],
+        "acquired": lots["acquired"][rows].astype("datetime64[s]"),
+        "holding_days": holding_days[rows],
+        "term": np.where(holding_days[rows] > LONG_TERM_DAYS, "long", "short"),
+        "quantity": quantity[rows],
+        "currency": lots["currency"][rows],
+        "cost": lots["cost"][rows],
+        "mark_price": lots["mark_price"][rows],
+        "market_value": market_value[rows],
+        "unrealized_pnl": unrealized[rows],
+        "unrealized_pnl_base": unrealized_base[rows],
+        "conflict_quantity": conflict[rows],
+        "allowed_loss_base": allowed[rows],
+        "repurchase_conflict": conflict[rows] > QUANTITY_EPSILON,
+        "rebuy_after": str(rebuy_after),
+    }, columns=CANDIDATE_COLUMNS)
+
+    # Totals over every candidate, not only the first `limit`
+    accounts = data["accounts"]
+    account_codes = lots["account_code"][all_rows]
+    harvest = pd.DataFrame({
+        "account_id": accounts,
+        "candidates": np.bincount(account_codes, minlength=len(accounts)),
+        "unrealized_loss": np.bincount(account_codes, weights=unrealized_base[all_rows], minlength=len(accounts)),
+        "allowed_loss": np.bincount(account_codes, weights=allowed[all_rows], minlength=len(accounts)),
+    })
+    by_account = data["realized"].merge(harvest, on="account_id", how="outer").fillna(0)
+    by_account["candidates"] = by_account["candidates"].astype(int)
+    by_account["realized_after_harvest"] = by_account["realized_total"] + by_account["allowed_loss"]
+    return {
+        "as_of": str(np.datetime64(as_of, "D")),
+        "candidates": candidates.round({column: 2 for column in MONEY_COLUMNS}),
+        "by_account": by_account.round(2),
+    }
@@ -4,12 +4,23 @@ import time
 import os
 import json
 
+# Enough of the body to see the root element of a GetStatement response
+SNIFF_BYTES = 1024
+CHUNK_SIZE = 1024 * 1024
+# Seconds to connect / between received bytes, not for the whole download
+STREAM_TIMEOUT = (10, 120)
+# Flex Web Service root; IBKR_FLEX_BASE_URL can point it at a local stub (benchmarks/flex_stub.py)
+DEFAULT_FLEX_BASE_URL = "https://www.interactivebrokers.com/Universal/servlet"
+# Seconds between GetStatement attempts while the report is being generated
+RETRY_DELAY = float(os.getenv("IBKR_FLEX_RETRY_DELAY", 5))
+
 class IBKRFlexClient:
-    def __init__(self, token, query_id):
+    def __init__(self, token, query_id, base_url=None):
         self.token = token
         self.query_id = query_id
-        self.base_url = "https://www.interactivebrokers.com/Universal/servlet/FlexStatementService.SendRequest"
-        self.fetch_url = "https://www.interactivebrokers.com/Universal/servlet/FlexStatementService.GetStatement"
+        base_url = (base_url or os.getenv("IBKR_FLEX_BASE_URL") or DEFAULT_FLEX_BASE_URL).rstrip("/")
+        self.base_url = f"{base_url}/FlexStatementService.SendRequest"
+        self.fetch_url = f"{base_url}/FlexStatementService.GetStatement"
 
     def trigger_report(self):
         """Step 1: Request the report generation."""
@@ -48,7 +59,7 @@ class IBKRFlexClient:
         else:
             raise Exception(f"Unexpected response format: {response.text}")
 
-    def get_report(self, reference_code, max_retries=5, delay=5):
+    def get_report(self, reference_code, max_retries=5, delay=RETRY_DELAY):
         """Step 2: Fetch the generated report using the reference code."""
         params = {
             "t": self.token,
@@ -79,6 +90,65 @@ class IBKRFlexClient:
                 
         raise Exception("Timeout waiting for report generation.")
 
+    def stream_report(self, reference_code, max_retries=5, delay=RETRY_DELAY, chunk_size=CHUNK_SIZE):
+        """
+        Step 2, streaming: yield the generated report as byte chunks.
+
+        The body is never decoded into one string. The first bytes are sniffed
+        to tell a FlexStatementResponse status envelope ("Warn" while the
+        report is being generated) from the real FlexQueryResponse; only the
+        small envelope is ever parsed.
+        """
+        params = {
+            "t": self.token,
+            "q": reference_code,
+            "v": "3"
+        }
+        
+        for i in range(max_retries):
+            print(f"Fetching report (attempt {i+1}/{max_retries})...")
+            with requests.get(self.fetch_url, params=params, stream=True, timeout=STREAM_TIMEOUT) as response:
+                if response.status_code != 200:
+                    print(f"Wait for report generation... ({response.status_code})")
+                    time.sleep(delay)
+                    continue
+                
+                chunks = response.iter_content(chunk_size=chunk_size)
+                head = b""
+                for chunk in chunks:
+                    head += chunk
+                    if len(head) >= SNIFF_BYTES:
+                        break
+                
+                if b"<FlexStatementResponse" in head[:SNIFF_BYTES]:
+                    envelope = head + b"".join(chunks)
+                    data = xmltodict.parse(envelope)["FlexStatementResponse"]
+                    if data.get("Status") == "Warn":
+                        print(f"Report not ready yet: {data.get('ErrorMessage')}")
+                        time.sleep(delay)
+                        continue
+                    raise Exception(f"IBKR Error: {data.get('ErrorMessage', 'Unknown error')}")
+                
+                yield head
+                for chunk in chunks:
+                    yield chunk
+                return
+                
+        raise Exception("Timeout waiting for report generation.")
+
+    def download_report(self, reference_code, dest_path, **kwargs):
+        """Stream the report into `dest_path` via a temp file and return the path."""
+        tmp_path = dest_path + ".partial"
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in self.stream_report(reference_code, **kwargs):
+                    f.write(chunk)
+            os.replace(tmp_path, dest_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return dest_path
+
 def load_config(config_path="config.json"):
     if not os.path.exists(config_path):
         raise FileNotFoundError(f"Config file not found at {config_path}. Please create it based on config.json.example")
@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+from parser import flex_datetimes
+from summary import numeric
+
+# CashTransaction @type (lowercased) -> income category
+CASH_TYPE_CATEGORIES = {
+    "dividends": "dividend",
+    "payment in lieu of dividends": "payment_in_lieu",
+    "withholding tax": "withholding_tax",
+    "871(m) withholding": "withholding_tax",
+    "broker interest received": "interest",
+    "bond interest received": "interest",
+    "broker interest paid": "interest_paid",
+    "bond interest paid": "interest_paid",
+    "other fees": "fee",
+    "commission adjustments": "fee",
+    "advisor fees": "fee",
+    "deposits/withdrawals": "transfer",
+    "deposits & withdrawals": "transfer",
+}
+INCOME_CATEGORIES = ["dividend", "payment_in_lieu", "withholding_tax", "interest", "interest_paid", "fee", "other"]
+DIVIDEND_CATEGORIES = ["dividend", "payment_in_lieu"]
+UNKNOWN_COUNTRY = "UNKNOWN"
+
+PAIR_KEYS = ["account_id", "conid", "date"]
+
+
+def classify_cash_transactions(cash_transactions, fx_rates=None, target_currency=None):
+    """
+    Typed CashTransactions with an income `category`, tax `year`, country,
+    the amount converted to base currency with @fxRateToBase and, when
+    `fx_rates` and `target_currency` are given, `amount_converted` into that
+    currency at each transaction's date (otherwise it equals the base amount).
+    `unconverted` flags rows with no rate to `target_currency` on their
+    date; their `amount_converted` is NaN. Transfers are dropped.
+    """
+    if cash_transactions.empty:
+        return pd.DataFrame()
+
+    def text(column, default=""):
+        if column not in cash_transactions.columns:
+            return pd.Series(default, index=cash_transactions.index)
+        return cash_transactions[column].fillna(default).astype(str)
+
+    date_column = next(
+        (col for col in ("@dateTime", "@settleDate", "@reportDate") if col in cash_transactions.columns), None
+    )
+    dates = flex_datetimes(cash_transactions[date_column]) if date_column \
+        else pd.Series(pd.NaT, index=cash_transactions.index, dtype="datetime64[s]")
+
+    types = text("@type")
+    # String work runs on the few distinct values, then is broadcast back
+    type_codes, distinct_types = pd.factorize(types)
+    categories = pd.Index(distinct_types).str.strip().str.lower().map(CASH_TYPE_CATEGORIES).fillna("other")
+    country_codes, distinct_countries = pd.factorize(text("@issuerCountryCode"))
+    countries = pd.Index(distinct_countries).str.strip()
+    countries = countries.where(countries != "", UNKNOWN_COUNTRY)
+    fx = numeric(cash_transactions, "@fxRateToBase")
+    amount = numeric(cash_transactions, "@amount")
+
+    classified = pd.DataFrame({
+        "account_id": text("@accountId").to_numpy(),
+        "category": categories.to_numpy()[type_codes],
+        "type": types.to_numpy(),
+        "year": dates.dt.year.to_numpy(),
+        "date": dates.dt.normalize().to_numpy(),
+        "currency": text("@currency").to_numpy(),
+        "country": countries.to_numpy()[country_codes],
+        "conid": text("@conid").to_numpy(),
+        "symbol": text("@symbol").to_numpy(),
+        "description": text("@description").to_numpy(),
+        "amount": amount,
+        "fx_rate_to_base": np.where(fx == 0, 1.0, fx),
+    })
+    classified["amount_base"] = classified["amount"] * classified["fx_rate_to_base"]
+    if fx_rates is not None and target_currency and target_currency != fx_rates.base_currency:
+        classified["amount_converted"] = fx_rates.convert(
+            classified["amount"], classified["currency"], classified["date"], target_currency
+        )
+    else:
+        classified["amount_converted"] = classified["amount_base"]
+    classified["unconverted"] = classified["amount_converted"].isna().astype(int)
+    return classified[(classified["category"] != "transfer") & classified["date"].notna()]
+
+
+def pair_withholding(classified):
+    """
+    Match withholding tax to the dividend it was taken from.
+
+    Both sides are first aggregated per (account, conid, pay date), then
+    joined with a hash merge on that key. Descriptive columns (currency,
+    country, symbol) come from the first row of each key. Converted amounts
+    are NaN when any row of the key had no rate (counted in `unconverted`).
+    Returns (dividends with their withholding, withholding that matched no
+    dividend).
+    """
+    dividends = classified[classified["category"].isin(DIVIDEND_CATEGORIES)]
+    withholding = classified[classified["category"] == "withholding_tax"]
+
+    dividends = dividends.groupby(PAIR_KEYS, sort=False, as_index=False).agg(
+        year=("year", "first"), currency=("currency", "first"), country=("country", "first"),
+        symbol=("symbol", "first"), gross=("amount", "sum"), gross_base=("amount_base", "sum"),
+        gross_converted=("amount_converted", "sum"), unconverted=("unconverted", "sum")
+    )
+    dividends["gross_converted"] = dividends["gross_converted"].where(dividends["unconverted"] == 0)
+    withholding = withholding.groupby(PAIR_KEYS, sort=False, as_index=False).agg(
+        withholding=("amount", "sum"), withholding_base=("amount_base", "sum"),
+        withholding_converted=("amount_converted", "sum"), withholding_unconverted=("unconverted", "sum")
+    )
+    withholding["withholding_converted"] = withholding["withholding_converted"].where(
+        withholding["withholding_unconverted"] == 0
+    )
+
+    paired = dividends.merge(withholding, on=PAIR_KEYS, how="left", validate="one_to_one", indicator=True)
+    # Dividends without withholding; NaN from a missing rate is kept
+    no_withholding = paired.pop("_merge") == "left_only"
+    withholding_columns = ["withholding", "withholding_base", "withholding_converted", "withholding_unconverted"]
+    paired.loc[no_withholding, withholding_columns] = 0.0
+    paired["unconverted"] = (paired["unconverted"] + paired.pop("withholding_unconverted")).astype(int)
+    for suffix in ("", "_base", "_converted"):
+        paired["net" + suffix] = paired["gross" + suffix] + paired["withholding" + suffix]
+    paired["withholding_rate"] = np.where(paired["gross"] != 0, -paired["withholding"] / paired["gross"], 0.0)
+
+    matched = withholding.merge(dividends[PAIR_KEYS], on=PAIR_KEYS, how="left", indicator=True)
+    unmatched = matched[matched["_merge"] == "left_only"].drop(columns="_merge").rename(
+        columns={"withholding_unconverted": "unconverted"}
+    )
+    return paired.sort_values(["date", "symbol"]), unmatched.sort_values("date")
+
+
+def summarize_dividend_accruals(accruals):
+    """Posted/reversed dividend accrual changes per year and currency."""
+    if accruals.empty:
+        return pd.DataFrame()
+    date_column = next((col for col in ("@date", "@reportDate", "@payDate") if col in accruals.columns), None)
+    years = flex_datetimes(accruals[date_column]).dt.year if date_column \
+        else pd.Series(np.nan, index=accruals.index)
+    fx = numeric(accruals, "@fxRateToBase")
+    fx = np.where(fx == 0, 1.0, fx)
+    frame = pd.DataFrame({
+        "year": years.to_numpy(),
+        "currency": accruals["@currency"].fillna("").to_numpy() if "@currency" in accruals.columns else "",
+        "gross": numeric(accruals, "@grossAmount"),
+        "tax": numeric(accruals, "@tax"),
+        "net": numeric(accruals, "@netAmount"),
+    })
+    frame["net_base"] = frame["net"] * fx
+    return frame.groupby(["year", "currency"], as_index=False).sum()
+
+
+def build_income_report(cash_transactions, dividend_accruals=None, fx_rates=None, target_currency=None):
+    """
+    Income for tax filing from CashTransactions (and ChangeInDividendAccruals).
+    `*_converted` amounts are in `target_currency` when fx_rates can convert
+    to it, else in base currency:
+
+    - `by_year`: converted totals per year and category, and the number of
+      `unconverted` transactions left out of them for lack of a rate;
+    - `breakdown`: totals per year, country, currency and category, in the
+      original, base and converted currency (NaN when any transaction of
+      the group is unconverted);
+    - `dividends`: each dividend with its withholding, net and rate;
+    - `unmatched_withholding`: withholding with no dividend on that key
+      (typically later refunds or adjustments);
+    - `accruals`: dividend accrual changes per year and currency;
+    - `currency`: the currency of the converted amounts (None when unknown).
+    """
+    if fx_rates is not None and target_currency and not fx_rates.can_convert(target_currency):
+        target_currency = None
+    currency = target_currency or (fx_rates.base_currency if fx_rates is not None else None)
+
+    classified = classify_cash_transactions(cash_transactions, fx_rates, target_currency)
+    accruals = summarize_dividend_accruals(dividend_accruals if dividend_accruals is not None else pd.DataFrame())
+    if classified.empty:
+        return {
+            "by_year": {}, "breakdown": pd.DataFrame(), "dividends": pd.DataFrame(),
+            "unmatched_withholding": pd.DataFrame(), "accruals": accruals, "currency": currency
+        }
+
+    breakdown = classified.groupby(
+        ["year", "country", "currency", "category"], as_index=False
+    ).agg(
+        amount=("amount", "sum"), amount_base=("amount_base", "sum"),
+        amount_converted=("amount_converted", "sum"), transactions=("amount", "size"),
+        unconverted=("unconverted", "sum")
+    )
+    breakdown["amount_converted"] = breakdown["amount_converted"].where(breakdown["unconverted"] == 0)
+
+    # From the transactions, so a group with one unconverted row still counts its converted ones
+    by_year_frame = classified.pivot_table(
+        index="year", columns="category", values="amount_converted", aggfunc="sum", fill_value=0.0
+    )
+    unconverted = classified.groupby("year")["unconverted"].sum()
+    by_year = {
+        int(year): {
+            **{category: round(float(totals.get(category, 0.0)), 2) for category in INCOME_CATEGORIES},
+            "unconverted": int(unconverted.get(year, 0)),
+        }
+        for year, totals in by_year_frame.to_dict(orient="index").items()
+    }
+
+    dividends, unmatched = pair_withholding(classified)
+    return {
+        "by_year": by_year,
+        "breakdown": breakdown,
+        "dividends": dividends,
+        "unmatched_withholding": unmatched,
+        "accruals": accruals,
+        "currency": currency
+    }
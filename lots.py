@@ -0,0 +1,383 @@
+import json
+import os
+from collections import deque
+import numpy as np
+import pandas as pd
+from parser import flex_datetimes
+from summary import numeric
+
+LOT_STATE_NAME = "lot_state.json"
+LOT_STATE_VERSION = 1
+LOT_SECTIONS = ["Trades", "OpenPositions"]
+
+# Each lot is stored as a list in this order, which keeps lot_state.json compact
+LOT_FIELDS = ["quantity", "cost", "acquired", "trade_id"]
+
+# trade_id of lots seeded from OpenPositions rather than opened by a trade
+OPENING_TRADE_ID = "OPENING"
+# Quantities below this are treated as a closed lot (fractional share dust)
+QUANTITY_EPSILON = 1e-9
+# Reconciliation tolerance against IBKR's costBasisMoney: max(absolute, relative * |basis|)
+COST_TOLERANCE_ABS = 1.0
+COST_TOLERANCE_REL = 0.005
+
+
+def empty_lot_state():
+    return {
+        "version": LOT_STATE_VERSION,
+        # Last applied trade time and the trade IDs applied at exactly that time
+        "watermark": {"date_time": None, "trade_ids": []},
+        "trades_applied": 0,
+        "positions": {},
+        "reconciliation": {},
+    }
+
+
+def lot_state_path(user_dir):
+    return os.path.join(user_dir, LOT_STATE_NAME)
+
+
+def load_lot_state(user_dir):
+    path = lot_state_path(user_dir)
+    if not os.path.exists(path):
+        return empty_lot_state()
+    with open(path, "r") as f:
+        state = json.load(f)
+    if state.get("version") != LOT_STATE_VERSION:
+        # Incompatible layout: rebuild from the trades in the next report
+        return empty_lot_state()
+    return state
+
+
+def save_lot_state(user_dir, state):
+    """Write the state through a temporary file so a crash never leaves half a JSON document."""
+    path = lot_state_path(user_dir)
+    tmp_path = path + ".partial"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(state, separators=(",", ":")))
+    os.replace(tmp_path, path)
+
+
+def position_key(account_id, conid):
+    return f"{account_id}|{conid}"
+
+
+def prepare_lot_trades(trades, watermark=None):
+    """
+    Executions of the Trades section after `watermark`, as typed columns
+    sorted by time, with the lot cost of each trade (quantity * price *
+    multiplier - commission, negative for sales) and whether it is a
+    closing trade (@openCloseIndicator "C"). Summary rows
+    (levelOfDetail other than EXECUTION) and currency conversions are left
+    out.
+
+    Rows are filtered on time and trade ID before anything else is typed,
+    so a re-synced report costs little beyond its new executions.
+    """
+    if trades.empty:
+        return pd.DataFrame()
+    date_column = "@dateTime" if "@dateTime" in trades.columns else "@tradeDate"
+    if date_column not in trades.columns:
+        return pd.DataFrame()
+    times = flex_datetimes(trades[date_column]).to_numpy()
+    keep = ~np.isnat(times)
+    if watermark and watermark.get("date_time"):
+        last_time = np.datetime64(watermark["date_time"], "s")
+        same_time = times == last_time
+        if same_time.any() and "@tradeID" in trades.columns:
+            same_time &= ~trades["@tradeID"].isin(watermark.get("trade_ids", [])).to_numpy()
+        else:
+            same_time[:] = False
+        keep &= (times > last_time) | same_time
+    trades, times = trades[keep], times[keep]
+
+    def code_filter(column, default, accept):
+        codes, uniques = pd.factorize(trades[column].fillna(default).astype(str))
+        return np.asarray(accept(pd.Index(uniques).str.upper()))[codes]
+
+    keep = np.ones(len(trades), dtype=bool)
+    if "@levelOfDetail" in trades.columns:
+        keep &= code_filter("@levelOfDetail", "EXECUTION", lambda values: values == "EXECUTION")
+    if "@assetCategory" in trades.columns:
+        keep &= code_filter("@assetCategory", "", lambda values: values != "CASH")
+    trades, times = trades[keep], times[keep]
+
+    def text(column):
+        if column not in trades.columns:
+            return np.full(len(trades), "", dtype=object)
+        return trades[column].fillna("").astype(str).to_numpy()
+
+    multiplier = numeric(trades, "@multiplier")
+    quantity = numeric(trades, "@quantity")
+    prepared = pd.DataFrame({
+        "time": times,
+        "trade_id": text("@tradeID"),
+        "account_id": text("@accountId"),
+        "conid": text("@conid"),
+        "symbol": text("@symbol"),
+        "quantity": quantity,
+        "cost": quantity * numeric(trades, "@tradePrice") * np.where(multiplier == 0, 1.0, multiplier)
+                - numeric(trades, "@ibCommission"),
+        "closing": pd.Series(text("@openCloseIndicator")).str.strip().str.upper().to_numpy() == "C",
+    })
+    prepared = prepared[(prepared["quantity"] != 0) & (prepared["conid"] != "")]
+    return prepared.sort_values("time", kind="stable").reset_index(drop=True)
+
+
+def _apply_trade(lots, quantity, cost, acquired, trade_id, closing=False):
+    """
+    Apply one trade FIFO to the deque of [quantity, cost, acquired, trade_id]
+    lots of a position. Trades against the position's sign close lots from
+    the front; any remainder opens a new lot (long or short), unless the
+    trade is a closing one: what it closes beyond the known lots was held
+    before the state's history, and must not turn into a short lot.
+    """
+    while lots and abs(quantity) > QUANTITY_EPSILON and (lots[0][0] > 0) != (quantity > 0):
+        lot = lots[0]
+        if abs(quantity) >= abs(lot[0]) - QUANTITY_EPSILON:
+            # Whole lot closed
+            cost -= cost * (-lot[0] / quantity)
+            quantity += lot[0]
+            lots.popleft()
+        else:
+            lot[1] -= lot[1] * (-quantity / lot[0])
+            lot[0] += quantity
+            return
+    if abs(quantity) > QUANTITY_EPSILON and not closing:
+        lots.append([quantity, cost, acquired, trade_id])
+
+
+def _iso(times):
+    return pd.Series(times).dt.strftime("%Y-%m-%dT%H:%M:%S").fillna("").to_numpy()
+
+
+def seed_positions(state, trades, open_positions):
+    """
+    Open lots, in place, for positions the state does not know yet that
+    were held before the prepared `trades`. Without them, selling shares
+    bought before the state's history would open a phantom short lot.
+
+    - A position OpenPositions reports at the end of the report opened with
+      the reported quantity minus the net quantity of the trades.
+    - A position absent from OpenPositions whose first trade is a closing
+      one (@openCloseIndicator "C") was sold off within the report: it
+      opened with minus the net traded quantity, or, when the report has no
+      OpenPositions to tell it ended flat, with what the closing trades
+      sold.
+
+    LOT rows of OpenPositions opened before the position's first trade
+    become lots with their own openDateTime and costBasisMoney. The rest of
+    the opening quantity is one lot ahead of them at the SUMMARY row's
+    average cost (no cost without one), acquired at its openDateTime or,
+    without one, at the first trade or report date: the latest it can have
+    been bought, so holding periods of seeded lots are a lower bound.
+    """
+    def text(df, column):
+        if column not in df.columns:
+            return np.full(len(df), "", dtype=object)
+        return df[column].fillna("").astype(str).to_numpy()
+
+    def times(df, column):
+        if column not in df.columns:
+            return np.full(len(df), np.datetime64("NaT"), dtype="datetime64[s]")
+        return flex_datetimes(df[column]).to_numpy()
+
+    rows = pd.DataFrame({
+        "key": [position_key(account, conid) for account, conid in
+                zip(text(open_positions, "@accountId"), text(open_positions, "@conid"))],
+        "account_id": text(open_positions, "@accountId"),
+        "conid": text(open_positions, "@conid"),
+        "symbol": text(open_positions, "@symbol"),
+        "detail": pd.Series(text(open_positions, "@levelOfDetail"), dtype=object)
+        .replace("", "SUMMARY").str.upper().to_numpy(),
+        "quantity": numeric(open_positions, "@position"),
+        "cost": numeric(open_positions, "@costBasisMoney"),
+        # Only a real open date: the report date is after the trades that drew on the lot
+        "opened": times(open_positions, "@openDateTime"),
+        "report_date": times(open_positions, "@reportDate"),
+    })
+    rows = rows[rows["conid"] != ""]
+    summary = rows[rows["detail"] == "SUMMARY"].groupby("key").agg(
+        quantity=("quantity", "sum"), cost=("cost", "sum"), opened=("opened", "min"),
+        report_date=("report_date", "max"),
+    )
+    lot_rows = rows[rows["detail"] == "LOT"].sort_values("opened", kind="stable")
+    names = rows.groupby("key")[["account_id", "conid", "symbol"]].first()
+
+    if trades.empty:
+        traded = pd.DataFrame(columns=["quantity", "closed", "first_time", "first_closing"])
+    else:
+        closing = trades["closing"].to_numpy() if "closing" in trades.columns else np.zeros(len(trades), dtype=bool)
+        frame = pd.DataFrame({
+            "key": [position_key(account, conid) for account, conid in
+                    zip(trades["account_id"].to_numpy(), trades["conid"].to_numpy())],
+            "account_id": trades["account_id"].to_numpy(),
+            "conid": trades["conid"].to_numpy(),
+            "symbol": trades["symbol"].to_numpy(),
+            "quantity": trades["quantity"].to_numpy(),
+            "closed": np.where(closing, trades["quantity"].to_numpy(), 0.0),
+            "time": trades["time"].to_numpy(),
+            "closing": closing,
+        })
+        # Trades come sorted by time, so "first" is the earliest trade of each position
+        traded = frame.groupby("key", sort=False).agg(
+            quantity=("quantity", "sum"), closed=("closed", "sum"), first_time=("time", "first"),
+            first_closing=("closing", "first"),
+        )
+        names = names.combine_first(frame.groupby("key")[["account_id", "conid", "symbol"]].first())
+
+    positions = state["positions"]
+    for key in summary.index.union(traded.index).difference(pd.Index(list(positions))):
+        net = traded.loc[key, "quantity"] if key in traded.index else 0.0
+        if key in summary.index:
+            reported = summary.loc[key]
+            opening = reported["quantity"] - net
+            average_cost = reported["cost"] / reported["quantity"] if reported["quantity"] else 0.0
+            opened, report_date = reported["opened"], reported["report_date"]
+        elif traded.loc[key, "first_closing"]:
+            opening = -net if not rows.empty else -traded.loc[key, "closed"]
+            average_cost, opened, report_date = 0.0, pd.NaT, pd.NaT
+        else:
+            continue
+        if abs(opening) <= QUANTITY_EPSILON:
+            continue
+        first_time = traded.loc[key, "first_time"] if key in traded.index else pd.NaT
+        acquired = next((when for when in (opened, first_time, report_date) if not pd.isna(when)), pd.NaT)
+
+        lots = lot_rows[lot_rows["key"] == key]
+        if not pd.isna(first_time):
+            lots = lots[lots["opened"].isna() | (lots["opened"] < first_time)]
+        lots = lots[lots["quantity"] * opening > 0]
+        seeded = [[float(q), float(c), when or _iso([acquired])[0], OPENING_TRADE_ID]
+                  for q, c, when in zip(lots["quantity"], lots["cost"], _iso(lots["opened"]))]
+        remainder = opening - sum(lot[0] for lot in seeded)
+        if remainder * opening < -QUANTITY_EPSILON:
+            # LOT rows disagree with the SUMMARY row: keep the summary only
+            seeded, remainder = [], opening
+        if abs(remainder) > QUANTITY_EPSILON:
+            seeded.insert(0, [float(remainder), float(remainder * average_cost), _iso([acquired])[0],
+                              OPENING_TRADE_ID])
+        account_id, conid, symbol = names.loc[key, ["account_id", "conid", "symbol"]]
+        positions[key] = {"account_id": account_id, "conid": conid, "symbol": symbol, "lots": seeded}
+    return state
+
+
+def apply_trades(state, trades):
+    """
+    Apply prepared trades (already past the watermark) to the lot state in
+    place and advance the watermark. Only these trades are touched, so the
+    cost is proportional to new activity rather than to account history.
+    """
+    if trades.empty:
+        return state
+    positions = state["positions"]
+    books = {key: deque(position["lots"]) for key, position in positions.items()}
+    acquired = pd.Series(trades["time"]).dt.strftime("%Y-%m-%dT%H:%M:%S").to_numpy()
+
+    closing = trades["closing"].to_numpy() if "closing" in trades.columns else np.zeros(len(trades), dtype=bool)
+    for account_id, conid, symbol, quantity, cost, when, trade_id, is_closing in zip(
+        trades["account_id"].to_numpy(), trades["conid"].to_numpy(), trades["symbol"].to_numpy(),
+        trades["quantity"].to_numpy(), trades["cost"].to_numpy(), acquired, trades["trade_id"].to_numpy(), closing
+    ):
+        key = position_key(account_id, conid)
+        if key not in books:
+            books[key] = deque()
+            positions[key] = {"account_id": account_id, "conid": conid, "symbol": symbol}
+        positions[key]["symbol"] = symbol or positions[key]["symbol"]
+        _apply_trade(books[key], float(quantity), float(cost), when, trade_id, bool(is_closing))
+
+    for key, lots in books.items():
+        if not lots:
+            positions.pop(key, None)
+            continue
+        positions[key]["lots"] = list(lots)
+
+    last_time = trades["time"].iloc[-1]
+    last_ids = trades.loc[trades["time"] == last_time, "trade_id"].tolist()
+    watermark = state["watermark"]
+    last_iso = last_time.strftime("%Y-%m-%dT%H:%M:%S")
+    if watermark.get("date_time") == last_iso:
+        last_ids = sorted(set(watermark.get("trade_ids", [])) | set(last_ids))
+    state["watermark"] = {"date_time": last_iso, "trade_ids": last_ids}
+    state["trades_applied"] = state.get("trades_applied", 0) + len(trades)
+    return state
+
+
+def lots_frame(state):
+    """One row per open lot."""
+    rows = [
+        [position["account_id"], position["conid"], position["symbol"], *lot]
+        for position in state["positions"].values() for lot in position.get("lots", [])
+    ]
+    return pd.DataFrame(rows, columns=["account_id", "conid", "symbol"] + LOT_FIELDS)
+
+
+def reconcile(state, open_positions):
+    """
+    Compare lot quantities and cost against OpenPositions (@position and
+    @costBasisMoney) per (account, conid). Returns totals and the
+    positions whose quantity or cost is out of tolerance.
+    """
+    lots = lots_frame(state)
+    held = lots.groupby(["account_id", "conid"], as_index=False).agg(
+        lot_quantity=("quantity", "sum"), lot_cost=("cost", "sum"), symbol=("symbol", "first")
+    )
+    if open_positions.empty:
+        reported = pd.DataFrame(columns=["account_id", "conid", "position", "cost_basis"])
+    else:
+        summary_rows = np.ones(len(open_positions), dtype=bool)
+        if "@levelOfDetail" in open_positions.columns:
+            summary_rows = (open_positions["@levelOfDetail"].fillna("SUMMARY").astype(str).str.upper()
+                            == "SUMMARY").to_numpy()
+        rows = open_positions[summary_rows]
+        reported = pd.DataFrame({
+            "account_id": rows["@accountId"].fillna("").astype(str).to_numpy() if "@accountId" in rows.columns
+            else "",
+            "conid": rows["@conid"].fillna("").astype(str).to_numpy() if "@conid" in rows.columns else "",
+            "position": numeric(rows, "@position"),
+            "cost_basis": numeric(rows, "@costBasisMoney"),
+        }).groupby(["account_id", "conid"], as_index=False).sum()
+
+    merged = held.merge(reported, on=["account_id", "conid"], how="outer")
+    merged[["lot_quantity", "lot_cost", "position", "cost_basis"]] = \
+        merged[["lot_quantity", "lot_cost", "position", "cost_basis"]].astype(float).fillna(0.0)
+    merged["symbol"] = merged["symbol"].fillna("")
+    merged["quantity_diff"] = merged["lot_quantity"] - merged["position"]
+    merged["cost_diff"] = merged["lot_cost"] - merged["cost_basis"]
+    tolerance = np.maximum(COST_TOLERANCE_ABS, COST_TOLERANCE_REL * merged["cost_basis"].abs())
+    mismatched = (merged["quantity_diff"].abs() > QUANTITY_EPSILON) | (merged["cost_diff"].abs() > tolerance)
+
+    mismatches = merged[mismatched].round({"lot_cost": 2, "cost_basis": 2, "cost_diff": 2})
+    return {
+        "positions": int(len(merged)),
+        "matched": int((~mismatched).sum()),
+        "mismatched": int(mismatched.sum()),
+        "mismatches": mismatches.to_dict(orient="records"),
+    }
+
+
+def update_lot_state(user_dir, sections, save=True):
+    """
+    Bring the persisted lot state of a user up to date with the Trades and
+    OpenPositions of a report, save it and return it.
+
+    Trades at or before the watermark (last applied dateTime and the trade
+    IDs seen at that instant) are dropped with a vectorized filter before
+    any per-trade work, so re-syncing an overlapping report window only
+    costs the new executions. Positions held from before the state's
+    history are seeded from OpenPositions first (see seed_positions). The
+    result is reconciled against IBKR's own cost basis.
+
+    Only the sync saves the state; readers pass `save=False` and bring an
+    in-memory copy up to date, so concurrent requests (in any worker
+    process) never race on lot_state.json.
+    """
+    state = load_lot_state(user_dir)
+    open_positions = sections.get("OpenPositions", pd.DataFrame())
+    trades = prepare_lot_trades(sections.get("Trades", pd.DataFrame()), state["watermark"])
+    seed_positions(state, trades, open_positions)
+    apply_trades(state, trades)
+    state["reconciliation"] = reconcile(state, open_positions)
+    if save:
+        save_lot_state(user_dir, state)
+    return state
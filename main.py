@@ -1,8 +1,10 @@
+import argparse
 import sys
 from ibkr_client import IBKRFlexClient, load_config
-from parser import parse_ibkr_xml, flat_print_report
+from parser import parse_ibkr_xml, flat_print_report, SECTION_ROW_TAGS
+from batch import run_batch, OUTPUT_FORMATS
 
-def main():
+def fetch():
     try:
         config = load_config()
     except FileNotFoundError as e:
@@ -10,23 +12,59 @@ def main():
         sys.exit(1)
 
     client = IBKRFlexClient(config["token"], config["query_id"])
-    
+
     try:
         ref_code = client.trigger_report()
-        xml_report = client.get_report(ref_code)
-        
         # Save XML for debugging if needed
-        with open("last_report.xml", "w") as f: 
-            f.write(xml_report)
+        report_path = client.download_report(ref_code, "last_report.xml")
         print("Debug: Raw XML saved to 'last_report.xml'")
-        
-        results = parse_ibkr_xml(xml_report)
+
+        with open(report_path, "rb") as f:
+            results, last_update, summary = parse_ibkr_xml(f)
+        print(f"Report generated: {last_update}")
         flat_print_report(results)
-        
+
     except Exception as e:
         import traceback
         print(f"Error during execution: {e}")
         traceback.print_exc()
 
+def batch(args):
+    sections = [name.strip() for name in args.sections.split(",") if name.strip()] if args.sections else None
+    try:
+        stats = run_batch(args.inputs, args.output, sections=sections, workers=args.workers,
+                          output_format=args.format, log=(lambda message: None) if args.quiet else print)
+    except (ValueError, RuntimeError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"\nProcessed {stats['files']} file(s), {stats['failed']} failed, {stats['rows']} rows "
+          f"in {stats['seconds']:.2f}s (parsing {stats['parse_seconds']:.2f}s)")
+    print(f"  {stats['files_per_sec']:.1f} files/sec, {stats['rows_per_sec']:,.0f} rows/sec, "
+          f"{stats['mb_per_sec']:.1f} MB/sec")
+    for name, path in stats["outputs"].items():
+        print(f"  {name}: {path}")
+    if stats["failed"]:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="IBKR Flex Query tools. Without a command, fetch the report of config.json.")
+    commands = parser.add_subparsers(dest="command")
+
+    batch_parser = commands.add_parser("batch", help="Parse saved Flex XML files in parallel into consolidated outputs")
+    batch_parser.add_argument("inputs", nargs="+", help="Report files, directories or glob patterns (.xml, .xml.gz, .xml.zst)")
+    batch_parser.add_argument("-o", "--output", default="batch_output", help="Output directory (default: batch_output)")
+    batch_parser.add_argument("-w", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    batch_parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default="auto",
+                              help="Section output format; auto = parquet if pyarrow is installed, else csv")
+    batch_parser.add_argument("-s", "--sections", help=f"Comma separated sections (default: all of {', '.join(SECTION_ROW_TAGS)})")
+    batch_parser.add_argument("-q", "--quiet", action="store_true", help="Do not print one line per file")
+
+    args = parser.parse_args()
+    if args.command == "batch":
+        batch(args)
+    else:
+        fetch()
+
 if __name__ == "__main__":
     main()
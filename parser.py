@@ -1,220 +1,308 @@
-import xmltodict
-import pandas as pd
 import io
+import os
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+from html import unescape
+import numpy as np
+import pandas as pd
+from report_archive import open_report
+from summary import compute_summary
+from profiling import stage
+
+# Section -> row element. Sections are direct children of each FlexStatement.
+SECTION_ROW_TAGS = {
+    "Trades": "Trade",
+    "CashTransactions": "CashTransaction",
+    "OpenPositions": "OpenPosition",
+    "ChangeInDividendAccruals": "ChangeInDividendAccrual",
+    "CashReport": "CashReportCurrency",
+    "EquitySummaryInBase": "EquitySummaryByReportDateInBase",
+    "FIFOPerformanceSummaryInBase": "FIFOPerformanceSummaryUnderlying"
+}
+
+# The only sections summary.compute_summary reads
+SUMMARY_SECTIONS = ["OpenPositions", "CashReport", "EquitySummaryInBase", "FIFOPerformanceSummaryInBase"]
 
-def parse_ibkr_xml(xml_content):
+CHUNK_SIZE = 1024 * 1024
+# Longest tag we look for plus delimiter, kept between chunks so a tag split
+# across a chunk boundary is still found
+_TAG_OVERLAP = 64
+_TAG_RE = re.compile(
+    rb"<(/?)(FlexQueryResponse|FlexStatements|FlexStatement|"
+    + b"|".join(name.encode() for name in SECTION_ROW_TAGS)
+    + rb")(?=[\s/>])"
+)
+_ATTR_RE = re.compile(rb'([\w:.-]+)\s*=\s*"([^"]*)"')
+
+
+class FlexReport:
     """
-    Parses IBKR Flex Query XML and returns a dictionary of DataFrames for different sections.
+    Flex Query report whose sections are parsed on first access.
+
+    Opening a report only scans the raw bytes once to index where each
+    section of each FlexStatement starts and ends; no element is built. A
+    section is parsed when asked for, by reading just its byte range, and the
+    resulting DataFrame is kept for later calls.
+
+    `source` may be XML text or bytes, a path to a stored report (plain or
+    compressed archive), or a binary file object. `index` is the `index` of
+    an earlier FlexReport over the same bytes; it skips the scan, e.g. in
+    worker processes handed one statement each.
     """
-    data_dict = xmltodict.parse(xml_content)
-    
-    # The structure usually has FlexStatements -> FlexStatement
-    if "FlexQueryResponse" not in data_dict or "FlexStatements" not in data_dict["FlexQueryResponse"]:
-        return {}, None, {}
-    
-    statements = data_dict["FlexQueryResponse"]["FlexStatements"].get("FlexStatement", [])
-    
-    # Ensure statements is always a list
-    if not isinstance(statements, list):
-        statements = [statements]
-    
-    print(f"Debug: Found {len(statements)} statement(s).")
-    
-    # Dictionary to collect list of DataFrames for each section
-    collected_data = {
-        "Trades": [],
-        "CashTransactions": [],
-        "OpenPositions": [],
-        "ChangeInDividendAccruals": [],
-        "CashReport": [],
-        "EquitySummaryInBase": [],
-        "FIFOPerformanceSummaryInBase": []
-    }
-    
-    sections_to_extract = list(collected_data.keys())
-
-    for statement in statements:
-        # acct_id = statement.get('@accountId')
-        # print(f"Debug: Processing statement for account {acct_id}")
-        
-        for section in sections_to_extract:
-            if section in statement and statement[section] is not None:
-                # Handle the inner tag name (e.g. Trades -> Trade, OpenPositions -> OpenPosition)
-                tag_name = section[:-1]
-                if section == "Trades": tag_name = "Trade"
-                if section == "CashTransactions": tag_name = "CashTransaction"
-                if section == "ChangeInDividendAccruals": tag_name = "ChangeInDividendAccrual"
-                if section == "CashReport": tag_name = "CashReportCurrency"
-                if section == "EquitySummaryInBase": tag_name = "EquitySummaryByReportDateInBase"
-                if section == "FIFOPerformanceSummaryInBase": tag_name = "FIFOPerformanceSummaryUnderlying"
-
-                section_data = statement[section]
-                if isinstance(section_data, dict):
-                    items = section_data.get(tag_name, [])
-                    # Handle single item vs list
-                    if isinstance(items, dict):
-                        items = [items]
-                    if items:
-                        collected_data[section].append(pd.DataFrame(items))
-    
-    # Extract metadata (e.g. whenGenerated)
-    last_update = None
-    if statements:
-        # Try to find the first statement that has @whenGenerated
-        for s in statements:
-            last_update = s.get('@whenGenerated')
-            if last_update:
-                break
-    
-    # Check at the root level if not found in statements
-    if not last_update:
-        last_update = data_dict.get("FlexQueryResponse", {}).get("@whenGenerated")
-
-    results = {}
-    for section, df_list in collected_data.items():
-        if df_list:
-            results[section] = pd.concat(df_list, ignore_index=True)
-        else:
-            results[section] = pd.DataFrame()
-
-    # --- Calculate Portfolio Summary ---
-    summary = {
-        "total_equity": 0.0,
-        "estimated_cash": 0.0,
-        "total_unrealized_pnl": 0.0,
-        "total_realized_pnl": 0.0,
-        "total_position_value": 0.0,
-        "dividend_accruals": 0.0,
-        "top_positions": [],
-        "change_vs_last": 0.0 # Placeholder
-    }
-
-    if not results["OpenPositions"].empty:
-        df = results["OpenPositions"]
-        
-        # Ensure numeric columns
-        cols_to_numeric = ["@positionValue", "@percentOfNAV", "@fifoPnlUnrealized", "@costBasisMoney"]
-        for col in cols_to_numeric:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
-        
-        # Use Market Value ("@positionValue") instead of Cost Basis
-        total_pos_value = df["@positionValue"].sum()
-        total_pnl = df["@fifoPnlUnrealized"].sum()
-        
-        # Calculate Real Cash from CashReport
-        total_cash = 0.0
-        if not results["CashReport"].empty:
-            cash_df = results["CashReport"]
-            # Filter for base summary to avoid double counting if multiple entries exist, or just sum 'endingCash'
-            # Usually strict base currency summary has currency="BASE_SUMMARY"
-            base_cash_rows = cash_df[cash_df["@currency"] == "BASE_SUMMARY"]
-            if not base_cash_rows.empty:
-                # Use endingCash from the summary row
-                total_cash = pd.to_numeric(base_cash_rows["@endingCash"], errors='coerce').sum()
-            else:
-                # Fallback: sum all endingCash if BASE_SUMMARY not explicitly found (rare for base report)
-                 total_cash = pd.to_numeric(cash_df["@endingCash"], errors='coerce').sum()
+
+    def __init__(self, source, index=None):
+        self._opener = None
+        self._owns_handle = True
+        if isinstance(source, os.PathLike) or (isinstance(source, str) and not source.lstrip().startswith("<")):
+            path = os.fspath(source)
+            self._opener = lambda: open_report(path)
+            self._fh = self._opener()
+        elif isinstance(source, str):
+            self._fh = io.BytesIO(source.encode("utf-8"))
+        elif isinstance(source, bytes):
+            self._fh = io.BytesIO(source)
+        elif source.seekable():
+            self._fh = source
+            self._owns_handle = False
         else:
-             # Fallback to old estimation if CashReport is missing for some reason
-            total_nav_pct = df["@percentOfNAV"].sum()
-            if total_nav_pct > 0:
-                 estimated_equity = total_pos_value / (total_nav_pct / 100.0)
-                 total_cash = estimated_equity - total_pos_value
-
-        # Calculate Dividend Accruals
-        total_dividend_accruals = 0.0
-        if not results["EquitySummaryInBase"].empty:
-            eq_df = results["EquitySummaryInBase"]
-            if "@dividendAccruals" in eq_df.columns:
-                eq_df["@dividendAccruals"] = pd.to_numeric(eq_df["@dividendAccruals"], errors='coerce').fillna(0.0)
-                
-                # We need the LATEST entry for EACH account
-                # Assuming 'accountId' is present. If not, we might take the global latest if it's one account.
-                if "@accountId" in eq_df.columns and "@reportDate" in eq_df.columns:
-                    # Sort by date desc
-                    eq_df = eq_df.sort_values(by="@reportDate", ascending=False)
-                    # Drop duplicates by accountId, keeping first (latest)
-                    latest_eq = eq_df.drop_duplicates(subset=["@accountId"])
-                    total_dividend_accruals = latest_eq["@dividendAccruals"].sum()
-                else:
-                    # Fallback: just take the last row's dividend accruals if structure implies sequence
-                    # Or sum if it's somehow split. Safe bet is finding unique latest report.
-                    pass
+            # Non-seekable streams are copied aside while they are scanned
+            self._fh = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+            self._spool_from = source
+
+        self.root_attrs = {}
+        self.has_statements = False
+        self.statements = []
+        self._cache = {}
+        if index is not None and not hasattr(self, "_spool_from"):
+            self.root_attrs = index["root_attrs"]
+            self.has_statements = index["has_statements"]
+            self.statements = index["statements"]
+            return
+        with stage("parse.scan"):
+            self._scan()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._owns_handle:
+            self._fh.close()
+
+    def _read_for_scan(self):
+        spool_from = getattr(self, "_spool_from", None)
+        if spool_from is None:
+            return self._fh.read(CHUNK_SIZE)
+        chunk = spool_from.read(CHUNK_SIZE)
+        self._fh.write(chunk)
+        return chunk
+
+    def _scan(self):
+        """Index statement attributes and section byte ranges in one pass."""
+        base = 0
+        buf = b""
+        current = None
+        while True:
+            chunk = self._read_for_scan()
+            buf += chunk
+            processed = 0
+            pending = None
+            for m in _TAG_RE.finditer(buf):
+                gt = buf.find(b">", m.end())
+                if gt == -1:
+                    pending = m.start()
+                    break
+                closing, name = m.group(1), m.group(2).decode()
+                processed = gt + 1
+
+                if name == "FlexQueryResponse":
+                    if not closing:
+                        self.root_attrs = _parse_attrs(buf[m.end():gt])
+                elif name == "FlexStatements":
+                    self.has_statements = True
+                elif name == "FlexStatement":
+                    if not closing:
+                        current = {"attrs": _parse_attrs(buf[m.end():gt]), "sections": {}}
+                        self.statements.append(current)
+                elif current is not None:
+                    if closing:
+                        start = current["sections"].get(name, (None, None))[0]
+                        if start is not None:
+                            current["sections"][name] = (start, base + gt + 1)
+                    elif buf[gt - 1:gt] != b"/":
+                        current["sections"][name] = (base + m.start(), None)
+
+            if not chunk:
+                break
+            cut = pending if pending is not None else max(processed, len(buf) - _TAG_OVERLAP)
+            base += cut
+            buf = buf[cut:]
+
+        for statement in self.statements:
+            statement["sections"] = {
+                name: span for name, span in statement["sections"].items() if span[1] is not None
+            }
+
+    @property
+    def index(self):
+        """Statement attributes and section byte ranges found by the scan (small, picklable)."""
+        return {"root_attrs": self.root_attrs, "has_statements": self.has_statements, "statements": self.statements}
+
+    @property
+    def is_flex_query(self):
+        return bool(self.root_attrs) or self.has_statements
+
+    @property
+    def last_update(self):
+        """whenGenerated of the first statement that has it, else of the response."""
+        for statement in self.statements:
+            if statement["attrs"].get("whenGenerated"):
+                return statement["attrs"]["whenGenerated"]
+        return self.root_attrs.get("whenGenerated")
+
+    @property
+    def account_ids(self):
+        return [statement["attrs"].get("accountId") for statement in self.statements]
+
+    def _seek(self, offset):
+        try:
+            self._fh.seek(offset)
+        except (OSError, ValueError):
+            # Compressed streams may not seek backwards; start over instead
+            if self._opener is None:
+                raise
+            self._fh.close()
+            self._fh = self._opener()
+            self._fh.seek(offset)
+
+    def _read_rows(self, name, span):
+        """Attribute dicts of the row elements inside one section byte range."""
+        start, end = span
+        row_tag = SECTION_ROW_TAGS[name]
+        rows = []
+        parser = ET.XMLPullParser(events=("start", "end"))
+        depth = 0
+        root = None
+
+        self._seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = self._fh.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if event == "start":
+                    depth += 1
+                    if root is None:
+                        root = elem
+                    continue
+                depth -= 1
+                if depth == 1 and elem.tag == row_tag:
+                    rows.append(elem.attrib)
+            if root is not None:
+                # Rows are kept through their attrib dicts only
+                root.clear()
+        parser.close()
+        return rows
+
+    def _spans(self, name, statement):
+        indexes = range(len(self.statements)) if statement is None else [statement]
+        return [self.statements[i]["sections"][name] for i in indexes if name in self.statements[i]["sections"]]
+
+    def _load(self, names, statement):
+        """
+        Parse the sections in `names` not cached yet. The byte ranges of all
+        of them, over every statement, are read in one pass in file order:
+        compressed archives cannot seek backwards, so any other order would
+        decompress the stream again for each range behind the current one.
+        """
+        pending = [name for name in dict.fromkeys(names) if (name, statement) not in self._cache]
+        rows = {name: [] for name in pending}
+        for span, name in sorted((span, name) for name in pending for span in self._spans(name, statement)):
+            with stage(f"parse.section:{name}"):
+                rows[name].extend(self._read_rows(name, span))
+        for name in pending:
+            self._cache[(name, statement)] = pd.DataFrame(rows[name]).add_prefix("@") if rows[name] else pd.DataFrame()
+
+    def section(self, name, statement=None):
+        """
+        DataFrame of one section, concatenated over all statements unless a
+        statement index is given. Columns keep the '@' prefix of xmltodict.
+        """
+        self._load([name], statement)
+        return self._cache[(name, statement)]
+
+    def sections(self, names=None, statement=None):
+        """Several sections at once, read in a single forward pass over the file (see `_load`)."""
+        names = list(names or SECTION_ROW_TAGS)
+        self._load(names, statement)
+        return {name: self._cache[(name, statement)] for name in names}
+
+
+def _parse_attrs(tag_body):
+    return {key.decode(): unescape(value.decode("utf-8")) for key, value in _ATTR_RE.findall(tag_body)}
+
+
+def flex_datetimes(values):
+    """
+    Parse Flex date/dateTime strings ("20250115", "20250115;093012",
+    "2025-01-15, 09:30:12") into datetime64; unparseable values become NaT.
+
+    Works on the raw bytes with NumPy: the digits of each value are packed
+    into a fixed 14-digit YYYYMMDDHHMMSS layout whatever the separators, so
+    no per-value strptime is involved.
+    """
+    raw = values.fillna("").astype(str).to_numpy().astype("S32")
+    chars = raw.view(np.uint8).reshape(len(raw), -1) if len(raw) else np.zeros((0, 32), dtype=np.uint8)
+    is_digit = (chars >= 48) & (chars <= 57)
+    rank = np.cumsum(is_digit, axis=1) - 1
+    keep = is_digit & (rank < 14)
+    rows, cols = np.nonzero(keep)
+    digits = np.zeros((len(raw), 14), dtype=np.int64)
+    digits[rows, rank[rows, cols]] = chars[rows, cols] - 48
+
+    def number(start, width):
+        result = np.zeros(len(raw), dtype=np.int64)
+        for i in range(start, start + width):
+            result = result * 10 + digits[:, i]
+        return result
+
+    year, month, day = number(0, 4), number(4, 2), number(6, 2)
+    seconds = number(8, 2) * 3600 + number(10, 2) * 60 + number(12, 2)
+    valid = (is_digit.sum(axis=1) >= 8) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+
+    months = (year - 1970) * 12 + month - 1
+    dates = months.astype("datetime64[M]").astype("datetime64[D]") + (day - 1)
+    result = dates.astype("datetime64[s]") + seconds.astype("timedelta64[s]")
+    result[~valid] = np.datetime64("NaT")
+    return pd.Series(result, index=values.index)
+
+
+@stage("parse")
+def parse_ibkr_xml(xml_content, sections=None):
+    """
+    Parses IBKR Flex Query XML and returns a dictionary of DataFrames for different sections.
+    `xml_content` may be the XML text, a path to a stored report, or a binary
+    file object (see FlexReport). `sections` limits which sections are
+    returned; the summary always reads only SUMMARY_SECTIONS.
+    """
+    with FlexReport(xml_content) as report:
+        if not report.is_flex_query:
+            return {}, None, {}
         
-        # Calculate Realized PnL per symbol and Overall
-        total_realized_pnl = 0.0
-        realized_pnl_map = {}
-        if not results["FIFOPerformanceSummaryInBase"].empty:
-            fifo_df = results["FIFOPerformanceSummaryInBase"]
-            # Extract per-symbol realized PnL
-            if "@totalRealizedPnl" in fifo_df.columns and "@symbol" in fifo_df.columns:
-                symbol_rows = fifo_df[fifo_df["@symbol"].notna() & (fifo_df["@symbol"] != "")]
-                if not symbol_rows.empty:
-                    symbol_pnl = symbol_rows.copy()
-                    symbol_pnl["@totalRealizedPnl"] = pd.to_numeric(symbol_pnl["@totalRealizedPnl"], errors='coerce').fillna(0.0)
-                    # Strip symbols and convert to uppercase for consistency
-                    symbol_pnl["@symbol"] = symbol_pnl["@symbol"].astype(str).str.strip().str.upper()
-                    realized_pnl_map = symbol_pnl.groupby("@symbol")["@totalRealizedPnl"].sum().to_dict()
-            
-            # Extract Overall Total
-            if "@description" in fifo_df.columns and "@totalRealizedPnl" in fifo_df.columns:
-                total_rows = fifo_df[fifo_df["@description"] == "Total (All Assets)"]
-                if not total_rows.empty:
-                    total_realized_pnl = pd.to_numeric(total_rows["@totalRealizedPnl"], errors='coerce').sum()
-
-        # Merge Realized PnL into OpenPositions
-        if "OpenPositions" in results and not results["OpenPositions"].empty:
-            # We must modify results["OpenPositions"] directly to be sure it persists
-            results["OpenPositions"]["realized_pnl"] = 0.0 # Initialize
-            if "@symbol" in results["OpenPositions"].columns:
-                # Create a normalized symbol column for mapping
-                symbols_norm = results["OpenPositions"]["@symbol"].astype(str).str.strip().str.upper()
-                results["OpenPositions"]["realized_pnl"] = symbols_norm.map(realized_pnl_map).fillna(0.0)
-                
-                # Update our local 'df' reference if needed (it should already be updated)
-                df = results["OpenPositions"]
-
-        total_equity = total_pos_value + total_cash + total_dividend_accruals
-
-        summary["total_equity"] = float(round(total_equity, 2))
-        summary["estimated_cash"] = float(round(total_cash, 2))
-        summary["total_unrealized_pnl"] = float(round(total_pnl, 2))
-        summary["total_realized_pnl"] = float(round(total_realized_pnl, 2))
-        summary["total_position_value"] = float(round(total_pos_value, 2))
-        summary["dividend_accruals"] = float(round(total_dividend_accruals, 2))
+        print(f"Debug: Found {len(report.statements)} statement(s).")
         
-        # Get top 5 positions by value
-        df_sorted = df.sort_values(by="@positionValue", ascending=False).head(5)
-        top_positions = []
-        for _, row in df_sorted.iterrows():
-            top_positions.append({
-                "symbol": row.get("@symbol", "Unknown"),
-                "value": float(round(row.get("@positionValue", 0), 2)),
-                "pnl": float(round(row.get("@fifoPnlUnrealized", 0), 2)),
-                "realized_pnl": float(round(row.get("realized_pnl", 0), 2)),
-                "allocation": float(round(row.get("@percentOfNAV", 0), 2))
-            })
-        summary["top_positions"] = top_positions
-
-    # Ensure all numeric values in summary are JSON-safe
-    import math
-    import numpy as np
-
-    def make_json_safe(obj):
-        if isinstance(obj, dict):
-            return {k: make_json_safe(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [make_json_safe(item) for item in obj]
-        elif isinstance(obj, (float, np.floating)):
-            if math.isnan(obj) or math.isinf(obj):
-                return 0.0
-            return float(obj)
-        return obj
-
-    summary = make_json_safe(summary)
-
-    return results, last_update, summary
+        names = list(SECTION_ROW_TAGS) if sections is None else list(sections)
+        results = report.sections(list(dict.fromkeys(names + SUMMARY_SECTIONS)))
+        with stage("parse.summary"):
+            summary = compute_summary(results)
+        return {name: results[name] for name in names}, report.last_update, summary
+
 
 def flat_print_report(results):
     for section, df in results.items():
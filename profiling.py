@@ -0,0 +1,327 @@
+import contextvars
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Captures (folded stacks, stage summary, tracemalloc snapshot) are written
+# here; point it at a mounted volume to keep them across deploys
+DIAGNOSTICS_DIR = os.getenv("DIAGNOSTICS_DIR", "diagnostics")
+# Seconds between stack samples of the threads running a profiled stage
+SAMPLE_INTERVAL_SECONDS = float(os.getenv("PROFILING_INTERVAL_MS", 10)) / 1000
+# Frames kept per tracemalloc traceback; each extra frame makes tracing slower
+TRACEMALLOC_FRAMES = int(os.getenv("PROFILING_TRACEMALLOC_FRAMES", 1))
+# Oldest captures are deleted beyond this many
+MAX_CAPTURES = int(os.getenv("PROFILING_MAX_CAPTURES", 50))
+# Allocation sites listed in each capture summary
+TOP_ALLOCATIONS = 25
+
+_session: contextvars.ContextVar = contextvars.ContextVar("profiling_session", default=None)
+_stage_path: contextvars.ContextVar = contextvars.ContextVar("profiling_stage_path", default=())
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Attribute the work inside to `name` when the current request is being
+    profiled: wall time, CPU samples of this thread, and (with memory
+    tracing) net allocated bytes. Stages nest. A no-op otherwise, so it can
+    wrap hot paths. Also usable as a decorator.
+
+    Wrap synchronous work only: a stage spanning an `await` on the event
+    loop would be charged for whatever else the loop runs meanwhile.
+    """
+    session = _session.get()
+    if session is None:
+        yield
+        return
+    path = _stage_path.get() + (name,)
+    token = _stage_path.set(path)
+    thread = threading.get_ident()
+    outer = session.enter(thread, path)
+    memory = tracemalloc.get_traced_memory()[0] if session.memory else 0
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        net_bytes = tracemalloc.get_traced_memory()[0] - memory if session.memory else 0
+        session.exit(thread, path, outer, time.perf_counter() - started, net_bytes)
+        _stage_path.reset(token)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{code.co_qualname}".replace(";", ":")
+
+
+class ProfileSession:
+    """Samples, stage timings and memory of one profiled request."""
+
+    def __init__(self, capture_id: str, user: str, method: str, path: str, rule_id: Optional[int],
+                 memory: bool):
+        self.capture_id = capture_id
+        self.user = user
+        self.method = method
+        self.path = path
+        self.rule_id = rule_id
+        self.memory = memory
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.stacks: Counter = Counter()
+        self.stages: Dict[tuple, dict] = {}
+        self.sample_count = 0
+        # Thread id -> stage path it is running
+        self.threads: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self.snapshot = tracemalloc.take_snapshot() if memory else None
+
+    def _stats(self, path: tuple) -> dict:
+        stats = self.stages.get(path)
+        if stats is None:
+            stats = self.stages[path] = {"calls": 0, "seconds": 0.0, "samples": 0, "net_bytes": 0}
+        return stats
+
+    def enter(self, thread: int, path: tuple) -> Optional[tuple]:
+        with self._lock:
+            outer = self.threads.get(thread)
+            self.threads[thread] = path
+            return outer
+
+    def exit(self, thread: int, path: tuple, outer: Optional[tuple], seconds: float, net_bytes: int):
+        with self._lock:
+            if outer is None:
+                self.threads.pop(thread, None)
+            else:
+                self.threads[thread] = outer
+            stats = self._stats(path)
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["net_bytes"] += net_bytes
+
+    def sample(self, frames: dict):
+        with self._lock:
+            for thread, path in self.threads.items():
+                frame = frames.get(thread)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                # Folded stacks run root first; stages are the outermost frames
+                self.stacks[";".join(list(path) + stack[::-1])] += 1
+                self._stats(path)["samples"] += 1
+                self.sample_count += 1
+
+    def summary(self, status_code: Optional[int]) -> dict:
+        return {
+            "capture_id": self.capture_id,
+            "user": self.user,
+            "method": self.method,
+            "path": self.path,
+            "rule_id": self.rule_id,
+            "status_code": status_code,
+            "started_at": self.started_at.isoformat(),
+            "seconds": round(time.perf_counter() - self.started, 6),
+            "sample_interval_ms": SAMPLE_INTERVAL_SECONDS * 1000,
+            "samples": self.sample_count,
+            "stages": [
+                {"stage": "/".join(path), **stats, "seconds": round(stats["seconds"], 6)}
+                for path, stats in sorted(self.stages.items())
+            ],
+        }
+
+
+class Profiler:
+    """
+    On-demand profiling of selected requests, armed from the admin API.
+
+    A rule matches requests by user and/or path prefix and profiles the
+    next `count` of them; an admin can also profile one of their own
+    requests with the `X-Profile` header. While a profiled request runs, a
+    sampler thread records the stacks of the threads inside its `stage()`
+    blocks every SAMPLE_INTERVAL_SECONDS (parse stages, serialization,
+    database and cache calls, the IBKR download), and with `memory`
+    tracemalloc traces allocations.
+
+    Each capture is written to `directory` as `<capture>.folded` (collapsed
+    stacks, rooted at the stage names, for flamegraph.pl or speedscope),
+    `<capture>.json` (time, samples and net allocated bytes per stage, top
+    allocation sites) and, with memory, `<capture>.tracemalloc` (a snapshot
+    for tracemalloc.Snapshot.load).
+
+    The sampler is a Python thread: it only runs when the GIL is free, so
+    long C calls show up as fewer, longer samples. Memory figures include
+    whatever other requests allocate at the same time. Rules and running
+    sessions are per worker process: with several API workers a rule only
+    profiles the requests that reach the worker that armed it (`pid` in the
+    rule), while captures land in the shared `directory`.
+    """
+
+    def __init__(self, directory: str = DIAGNOSTICS_DIR, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.directory = directory
+        self.interval = interval
+        self.rules: Dict[int, dict] = {}
+        self._rule_ids = itertools.count(1)
+        self._active: List[ProfileSession] = []
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+        self._tracing_sessions = 0
+        self._started_tracing = False
+
+    @property
+    def armed(self) -> bool:
+        return bool(self.rules)
+
+    def arm(self, user: Optional[str] = None, path: Optional[str] = None, count: int = 1,
+            memory: bool = False) -> dict:
+        """Profile the next `count` requests of `user` (any user if None) under `path` (any if None)."""
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        rule = {
+            "id": next(self._rule_ids), "user": user, "path": path, "remaining": count, "memory": memory,
+            "created_at": datetime.now().isoformat(), "pid": os.getpid(),
+        }
+        with self._lock:
+            self.rules[rule["id"]] = rule
+        return dict(rule)
+
+    def disarm(self, rule_id: int) -> bool:
+        with self._lock:
+            return self.rules.pop(rule_id, None) is not None
+
+    def claim(self, user: str, path: str) -> Optional[dict]:
+        """The first rule matching the request, with one use taken from it; None if no rule matches."""
+        with self._lock:
+            for rule in self.rules.values():
+                if rule["user"] not in (None, user) or (rule["path"] and not path.startswith(rule["path"])):
+                    continue
+                rule["remaining"] -= 1
+                if rule["remaining"] <= 0:
+                    del self.rules[rule["id"]]
+                return dict(rule)
+        return None
+
+    def start(self, user: str, method: str, path: str, rule_id: Optional[int] = None,
+              memory: bool = False) -> contextvars.Token:
+        """Start profiling the current request; pass the returned token to `finish`."""
+        if memory:
+            with self._lock:
+                if self._tracing_sessions == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start(TRACEMALLOC_FRAMES)
+                    self._started_tracing = True
+                self._tracing_sessions += 1
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", path).strip("-") or "root"
+        capture_id = f"{datetime.now():%Y%m%dT%H%M%S%f}-{re.sub(r'[^A-Za-z0-9_.-]', '_', user)}-{slug}"
+        session = ProfileSession(capture_id, user, method, path, rule_id, memory)
+        with self._lock:
+            self._active.append(session)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name="profiling-sampler", daemon=True)
+                self._sampler.start()
+        return _session.set(session)
+
+    def finish(self, token: contextvars.Token, status_code: Optional[int] = None) -> dict:
+        """
+        Stop the session started with `token` and return its summary. The
+        capture files (and the tracemalloc snapshot, which walks every
+        traced block) are written by a background thread, so the caller,
+        usually the event loop, never waits on them.
+        """
+        session = _session.get()
+        _session.reset(token)
+        with self._lock:
+            self._active.remove(session)
+        summary = session.summary(status_code)
+        summary["files"] = [f"{session.capture_id}.folded", f"{session.capture_id}.json"]
+        if session.memory:
+            summary["files"].append(f"{session.capture_id}.tracemalloc")
+        threading.Thread(
+            target=self._write_capture, args=(session, dict(summary)), name="profiling-writer", daemon=True
+        ).start()
+        return summary
+
+    def _write_capture(self, session: ProfileSession, summary: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, session.capture_id)
+        with open(base + ".folded", "w") as f:
+            for stack, count in session.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        if session.memory:
+            try:
+                snapshot = tracemalloc.take_snapshot()
+                summary["memory"] = {
+                    "traced_bytes": tracemalloc.get_traced_memory()[0],
+                    "top_allocations": [
+                        {"location": str(stat.traceback[0]), "size_diff": stat.size_diff,
+                         "count_diff": stat.count_diff}
+                        for stat in snapshot.compare_to(session.snapshot, "lineno")[:TOP_ALLOCATIONS]
+                    ],
+                }
+                snapshot.dump(base + ".tracemalloc")
+            finally:
+                with self._lock:
+                    self._tracing_sessions -= 1
+                    if self._tracing_sessions == 0 and self._started_tracing:
+                        tracemalloc.stop()
+                        self._started_tracing = False
+        with open(base + ".json", "w") as f:
+            json.dump(summary, f, indent=2)
+        self._prune()
+
+    def _sample_loop(self):
+        sampler = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                sessions = list(self._active)
+            frames = sys._current_frames()
+            frames.pop(sampler, None)
+            for session in sessions:
+                session.sample(frames)
+            del frames
+
+    def captures(self) -> List[dict]:
+        """Summaries of the stored captures, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        summaries = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    summary = json.load(f)
+            except (OSError, ValueError):
+                continue
+            summary.pop("stages", None)
+            summary.pop("memory", None)
+            summaries.append(summary)
+        return summaries
+
+    def capture_file(self, name: str) -> Optional[str]:
+        """Path of a stored capture file, or None if there is no such file."""
+        if os.path.basename(name) != name or not os.path.isdir(self.directory) \
+                or name not in os.listdir(self.directory):
+            return None
+        return os.path.join(self.directory, name)
+
+    def _prune(self):
+        ids = sorted({name.rsplit(".", 1)[0] for name in os.listdir(self.directory)})
+        for capture_id in ids[:max(0, len(ids) - MAX_CAPTURES)]:
+            for extension in (".folded", ".json", ".tracemalloc"):
+                try:
+                    os.remove(os.path.join(self.directory, capture_id + extension))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,211 @@
+import importlib.util
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import pandas as pd
+from parser import FlexReport, SECTION_ROW_TAGS, flex_datetimes
+
+try:
+    import duckdb
+except ImportError:  # The SQL endpoint is optional; everything else works without it
+    duckdb = None
+
+QUERY_FORMATS = ["json", "arrow"]
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", 10))
+QUERY_MEMORY_LIMIT = os.getenv("QUERY_MEMORY_LIMIT", "256MB")
+QUERY_THREADS = int(os.getenv("QUERY_THREADS", 1))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", 10000))
+# Users whose tables stay loaded in this worker (least recently used are dropped)
+MAX_OPEN_ENGINES = int(os.getenv("QUERY_MAX_ENGINES", 8))
+
+# First keyword of an accepted query (DuckDB rewrites PRAGMA and SHOW into SELECTs)
+READ_KEYWORDS = {"SELECT", "WITH", "FROM", "VALUES", "TABLE"}
+_LEADING = re.compile(r"(?:\s+|\(|--[^\n]*|/\*.*?\*/)*", re.DOTALL)
+# Identifiers stay text even when every value looks like a number
+TEXT_COLUMNS = {"conid", "underlyingConid", "cusip", "isin", "figi", "securityID", "acctAlias", "model"}
+
+
+class QueryError(ValueError):
+    """Rejected or failed query; the message is safe to show to the user."""
+
+
+class QueryTimeout(QueryError):
+    pass
+
+
+def arrow_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _is_text_column(name):
+    return name in TEXT_COLUMNS or name.endswith("ID") or name.endswith("Id")
+
+
+def typed_table(df):
+    """
+    A section as a SQL-friendly table: '@' dropped from column names, date
+    and dateTime attributes as timestamps, all-numeric attributes as
+    doubles ('' becomes NULL), identifiers and everything else as text.
+    """
+    columns = {}
+    for column in df.columns:
+        name = column.lstrip("@")
+        values = df[column].fillna("").astype(str)
+        if "date" in name.lower():
+            columns[name] = flex_datetimes(values)
+            continue
+        present = values != ""
+        if _is_text_column(name) or not present.any():
+            columns[name] = values
+            continue
+        try:
+            columns[name] = values.where(present, "nan").astype(float)
+        except (ValueError, TypeError):
+            columns[name] = values
+    return pd.DataFrame(columns, index=df.index)
+
+
+class QueryEngine:
+    """
+    In-process DuckDB database over the sections of one user's report.
+
+    Each user gets a separate in-memory database holding only their own
+    report, so a query cannot reach another user's rows whatever it says.
+    The database is locked down before any user SQL runs: no file, network
+    or extension access, no lookups of Python variables, memory and thread
+    limits, and a locked configuration so a query cannot lift them. Only a
+    single SELECT (or WITH ... SELECT) statement is accepted, and each runs
+    on its own cursor that is interrupted after `timeout` seconds.
+    """
+
+    def __init__(self, sections: Dict[str, pd.DataFrame]):
+        if duckdb is None:
+            raise RuntimeError("The query engine requires the 'duckdb' package")
+        self.conn = duckdb.connect(":memory:", config={
+            "threads": QUERY_THREADS,
+            "memory_limit": QUERY_MEMORY_LIMIT,
+            "autoinstall_known_extensions": False,
+            "autoload_known_extensions": False,
+        })
+        self.table_names = []
+        for name, df in sections.items():
+            if df.columns.empty:
+                # Section not in the report: no table
+                continue
+            self.conn.register("_section", typed_table(df))
+            self.conn.execute(f'CREATE TABLE "{name}" AS SELECT * FROM _section')
+            self.conn.unregister("_section")
+            self.table_names.append(name)
+        for setting in ["enable_external_access = false", "python_enable_replacements = false",
+                        "lock_configuration = true"]:
+            self.conn.execute(f"SET {setting}")
+
+    @classmethod
+    def from_report(cls, report_path: str) -> "QueryEngine":
+        with FlexReport(report_path) as report:
+            return cls(report.sections(list(SECTION_ROW_TAGS)))
+
+    def tables(self) -> Dict[str, List[dict]]:
+        """Columns and SQL types of every table."""
+        rows = self.conn.execute(
+            "SELECT table_name, column_name, data_type FROM information_schema.columns "
+            "ORDER BY table_name, ordinal_position"
+        ).fetchall()
+        tables = {name: [] for name in self.table_names}
+        for table, column, data_type in rows:
+            tables.setdefault(table, []).append({"name": column, "type": data_type})
+        return tables
+
+    def _validate(self, sql: str) -> str:
+        try:
+            statements = self.conn.extract_statements(sql)
+        except duckdb.Error as e:
+            raise QueryError(str(e))
+        if len(statements) != 1:
+            raise QueryError("Send exactly one SQL statement")
+        keyword = re.match(r"[A-Za-z]*", sql[_LEADING.match(sql).end():]).group().upper()
+        if statements[0].type != duckdb.StatementType.SELECT or keyword not in READ_KEYWORDS:
+            raise QueryError("Only SELECT queries are allowed")
+        return statements[0].query.strip().rstrip(";")
+
+    def execute(self, sql: str, max_rows: int = QUERY_MAX_ROWS, timeout: float = QUERY_TIMEOUT_SECONDS,
+                arrow: bool = False):
+        """
+        Run one read-only query. Returns (result, truncated): a DataFrame,
+        or a pyarrow Table with `arrow`, of at most `max_rows` rows.
+        """
+        query = self._validate(sql)
+        cursor = self.conn.cursor()
+        timer = threading.Timer(timeout, cursor.interrupt)
+        timer.start()
+        try:
+            # One extra row tells whether the result was cut
+            cursor.execute(f"SELECT * FROM ({query}\n) AS result LIMIT {int(max_rows) + 1}")
+            result = cursor.fetch_arrow_table() if arrow else cursor.fetchdf()
+        except duckdb.InterruptException:
+            raise QueryTimeout(f"Query exceeded the {timeout:g} s time limit")
+        except duckdb.OutOfMemoryException:
+            raise QueryError(f"Query exceeded the {QUERY_MEMORY_LIMIT} memory limit")
+        except duckdb.Error as e:
+            raise QueryError(str(e))
+        finally:
+            timer.cancel()
+            cursor.close()
+        truncated = len(result) > max_rows
+        if truncated:
+            result = result.slice(0, max_rows) if arrow else result.iloc[:max_rows]
+        return result, truncated
+
+
+class EngineCache:
+    """
+    The open QueryEngine of each user, for their latest report version; the
+    least recently used users are dropped beyond `max_engines` (a database
+    is freed once no running query holds it). Builds run under a per-user
+    lock, so concurrent first queries of one user parse the report once
+    while other users' lookups and builds go ahead.
+    """
+
+    def __init__(self, max_engines: int = MAX_OPEN_ENGINES):
+        self.max_engines = max_engines
+        self._engines: "OrderedDict[str, tuple]" = OrderedDict()
+        # Guards _engines and _build_locks; never held during a build
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+
+    def _lookup(self, user: str, version: str) -> Optional[QueryEngine]:
+        with self._lock:
+            cached = self._engines.get(user)
+            if cached is None or cached[0] != version:
+                return None
+            self._engines.move_to_end(user)
+            return cached[1]
+
+    def get(self, user: str, version: str, build: Callable[[], QueryEngine]) -> QueryEngine:
+        engine = self._lookup(user, version)
+        if engine is not None:
+            return engine
+        with self._lock:
+            build_lock = self._build_locks.setdefault(user, threading.Lock())
+        with build_lock:
+            # Another request of this user may have built it meanwhile
+            engine = self._lookup(user, version)
+            if engine is not None:
+                return engine
+            engine = build()
+            with self._lock:
+                self._engines[user] = (version, engine)
+                self._engines.move_to_end(user)
+                while len(self._engines) > self.max_engines:
+                    evicted, _ = self._engines.popitem(last=False)
+                    self._build_locks.pop(evicted, None)
+            return engine
+
+
+engines = EngineCache()
+
+
+def get_engine(user: str, version: str, report_path: str) -> QueryEngine:
+    return engines.get(user, version, lambda: QueryEngine.from_report(report_path))
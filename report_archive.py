@@ -0,0 +1,162 @@
+import gzip
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import BinaryIO, Iterable, List, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+ARCHIVE_DIR_NAME = "reports"
+LEGACY_REPORT_NAME = "last_report.xml"
+CHUNK_SIZE = 1024 * 1024
+
+EXTENSIONS = {"gzip": ".xml.gz", "zstd": ".xml.zst"}
+
+
+def get_compression() -> str:
+    """Compression used for new archives: REPORT_COMPRESSION=gzip|zstd (gzip if zstd is unavailable)."""
+    compression = os.getenv("REPORT_COMPRESSION", "gzip").lower()
+    if compression == "zstd" and zstandard is None:
+        print("Warning: REPORT_COMPRESSION=zstd but 'zstandard' is not installed, using gzip")
+        return "gzip"
+    return compression if compression in EXTENSIONS else "gzip"
+
+
+def get_archive_dir(user_dir: str) -> str:
+    archive_dir = os.path.join(user_dir, ARCHIVE_DIR_NAME)
+    os.makedirs(archive_dir, exist_ok=True)
+    return archive_dir
+
+
+def list_archives(user_dir: str) -> List[str]:
+    """Archived reports of a user, newest first (file names sort chronologically)."""
+    archive_dir = os.path.join(user_dir, ARCHIVE_DIR_NAME)
+    if not os.path.isdir(archive_dir):
+        return []
+    names = [
+        name for name in os.listdir(archive_dir)
+        if name.startswith("report_") and name.endswith(tuple(EXTENSIONS.values()))
+    ]
+    return [os.path.join(archive_dir, name) for name in sorted(names, reverse=True)]
+
+
+def latest_report_path(user_dir: str) -> Optional[str]:
+    """Newest archived report, falling back to the pre-archive last_report.xml."""
+    archives = list_archives(user_dir)
+    if archives:
+        return archives[0]
+    legacy_path = os.path.join(user_dir, LEGACY_REPORT_NAME)
+    if os.path.exists(legacy_path):
+        return legacy_path
+    return None
+
+
+@contextmanager
+def archive_writer(user_dir: str):
+    """
+    Yield `(writer, archive_path)` where writes to the binary `writer` are
+    compressed into a new dated archive.
+
+    Data goes to a temporary file that is renamed to `archive_path` when the
+    block exits cleanly, so a failed download never shows up as the latest
+    report.
+    """
+    compression = get_compression()
+    archive_dir = get_archive_dir(user_dir)
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S_%f")
+    final_path = os.path.join(archive_dir, f"report_{stamp}{EXTENSIONS[compression]}")
+    tmp_path = final_path + ".partial"
+
+    raw = open(tmp_path, "wb")
+    try:
+        if compression == "zstd":
+            writer = zstandard.ZstdCompressor(level=6).stream_writer(raw, closefd=False)
+        else:
+            writer = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+        yield writer, final_path
+        writer.close()
+        raw.close()
+        os.replace(tmp_path, final_path)
+    except BaseException:
+        raw.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_report(user_dir: str, report: Union[str, bytes, Iterable[bytes]]) -> str:
+    """
+    Compress a report into the user's archive and apply the retention policy.
+
+    `report` may be the whole document or an iterable of byte chunks. Returns
+    the archive path.
+    """
+    with archive_writer(user_dir) as (writer, archive_path):
+        if isinstance(report, str):
+            # Encode slice by slice to avoid a second full-size copy
+            for start in range(0, len(report), CHUNK_SIZE):
+                writer.write(report[start:start + CHUNK_SIZE].encode("utf-8"))
+        elif isinstance(report, bytes):
+            writer.write(report)
+        else:
+            for chunk in report:
+                writer.write(chunk)
+
+    # The uncompressed pre-archive copy is superseded by the archive
+    legacy_path = os.path.join(user_dir, LEGACY_REPORT_NAME)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+    apply_retention(user_dir)
+    return archive_path
+
+
+def open_report(path: str) -> BinaryIO:
+    """Open a stored report for streaming reads, decompressing on the fly."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"Cannot read {path}: 'zstandard' is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def apply_retention(user_dir: str, max_count: Optional[int] = None,
+                    max_age_days: Optional[float] = None,
+                    max_bytes: Optional[int] = None) -> List[str]:
+    """
+    Delete archives beyond the retention policy and return the removed paths.
+
+    Limits default to REPORT_RETENTION_COUNT, REPORT_RETENTION_DAYS and
+    REPORT_RETENTION_BYTES; 0 disables a limit. The newest archive is always
+    kept.
+    """
+    if max_count is None:
+        max_count = int(os.getenv("REPORT_RETENTION_COUNT", 30))
+    if max_age_days is None:
+        max_age_days = float(os.getenv("REPORT_RETENTION_DAYS", 365))
+    if max_bytes is None:
+        max_bytes = int(os.getenv("REPORT_RETENTION_BYTES", 0))
+
+    now = time.time()
+    removed = []
+    total_bytes = 0
+    for index, path in enumerate(list_archives(user_dir)):
+        stat = os.stat(path)
+        total_bytes += stat.st_size
+        if index == 0:
+            continue
+
+        too_many = max_count and index >= max_count
+        too_old = max_age_days and (now - stat.st_mtime) > max_age_days * 86400
+        too_big = max_bytes and total_bytes > max_bytes
+        if too_many or too_old or too_big:
+            os.remove(path)
+            removed.append(path)
+            total_bytes -= stat.st_size
+    return removed
@@ -0,0 +1,288 @@
+import numpy as np
+import pandas as pd
+
+# Columns typed in place on OpenPositions; they are served as numbers
+POSITION_NUMERIC_COLUMNS = ["@positionValue", "@percentOfNAV", "@fifoPnlUnrealized", "@costBasisMoney"]
+
+TOTAL_ROW_DESCRIPTION = "Total (All Assets)"
+TOP_POSITIONS = 5
+
+
+def numeric(df, column):
+    """Float array of a column ('' and junk -> 0.0), or zeros if the column is missing."""
+    if df.empty or column not in df.columns:
+        return np.zeros(len(df))
+    values = df[column]
+    if values.dtype.kind != "f":
+        try:
+            # Several times faster than to_numeric when every value parses
+            values = values.astype(float)
+        except (ValueError, TypeError):
+            values = pd.to_numeric(values, errors="coerce")
+    return values.fillna(0.0).to_numpy(dtype=float)
+
+
+def type_positions(positions):
+    """Convert POSITION_NUMERIC_COLUMNS of OpenPositions to floats, once, in place."""
+    for col in POSITION_NUMERIC_COLUMNS:
+        if col in positions.columns and positions[col].dtype.kind != "f":
+            positions[col] = pd.to_numeric(positions[col], errors="coerce").fillna(0.0)
+    return positions
+
+
+def _money(value):
+    """Round to cents and map NaN/inf to 0.0 so the value is JSON safe."""
+    value = float(value)
+    return round(value, 2) if np.isfinite(value) else 0.0
+
+
+def _in_base(df, column):
+    """Values of `column` converted to base currency with each row's @fxRateToBase (missing or 0 -> 1)."""
+    fx = numeric(df, "@fxRateToBase")
+    return numeric(df, column) * np.where(fx == 0, 1.0, fx)
+
+
+def _accounts(df):
+    if "@accountId" in df.columns:
+        return df["@accountId"].fillna("").astype(str).to_numpy()
+    return np.full(len(df), "", dtype=object)
+
+
+def _sum_by(keys, values):
+    """Sum `values` grouped by `keys` into a dict."""
+    if len(keys) == 0:
+        return {}
+    return pd.Series(values).groupby(keys, sort=True).sum().to_dict()
+
+
+def _cash_by_account(cash_report, positions):
+    if not cash_report.empty:
+        base_rows = cash_report["@currency"] == "BASE_SUMMARY" if "@currency" in cash_report.columns else None
+        # Usually strict base currency summary has currency="BASE_SUMMARY"
+        if base_rows is not None and base_rows.any():
+            cash_rows = cash_report[base_rows]
+            return _sum_by(_accounts(cash_rows), numeric(cash_rows, "@endingCash"))
+        # Otherwise convert each currency's endingCash with the rate of the
+        # positions in that currency (CashReport has no fxRateToBase); a
+        # currency without positions is taken as base
+        ending_cash = numeric(cash_report, "@endingCash")
+        if "@currency" in cash_report.columns and "@currency" in positions.columns \
+                and "@fxRateToBase" in positions.columns:
+            fx = numeric(positions, "@fxRateToBase")
+            rates = pd.Series(fx[fx > 0], index=positions["@currency"].to_numpy()[fx > 0])
+            rates = rates[~rates.index.duplicated()]
+            ending_cash = ending_cash * cash_report["@currency"].map(rates).fillna(1.0).to_numpy()
+        return _sum_by(_accounts(cash_report), ending_cash)
+
+    # No CashReport: estimate cash from the NAV share of the positions
+    accounts = _accounts(positions)
+    value = pd.Series(_in_base(positions, "@positionValue")).groupby(accounts).sum()
+    nav_pct = pd.Series(numeric(positions, "@percentOfNAV")).groupby(accounts).sum()
+    estimated = (value / (nav_pct / 100.0) - value).where(nav_pct > 0, 0.0)
+    return estimated.to_dict()
+
+
+def _latest_accruals_by_account(equity_summary):
+    """dividendAccruals of the latest reportDate row of each account."""
+    if equity_summary.empty or "@dividendAccruals" not in equity_summary.columns:
+        return {}
+    if "@accountId" not in equity_summary.columns or "@reportDate" not in equity_summary.columns:
+        return {}
+    # parser imports this module
+    from parser import flex_datetimes
+
+    accruals = numeric(equity_summary, "@dividendAccruals")
+    # reportDate may be "20250115" or "2025-01-15"; rows without a date rank last
+    dates = flex_datetimes(equity_summary["@reportDate"]).to_numpy().astype("int64")
+    latest = pd.Series(dates).groupby(_accounts(equity_summary)).idxmax()
+    return dict(zip(latest.index, accruals[latest.to_numpy()]))
+
+
+def _realized_pnl(fifo_summary):
+    """(per-symbol realized PnL map, realized total by account) from FIFOPerformanceSummaryInBase."""
+    if fifo_summary.empty or "@totalRealizedPnl" not in fifo_summary.columns:
+        return {}, {}
+    realized = numeric(fifo_summary, "@totalRealizedPnl")
+
+    symbol_map = {}
+    if "@symbol" in fifo_summary.columns:
+        symbols = fifo_summary["@symbol"]
+        has_symbol = (symbols.notna() & (symbols != "")).to_numpy()
+        if has_symbol.any():
+            normalized = symbols[has_symbol].astype(str).str.strip().str.upper().to_numpy()
+            symbol_map = _sum_by(normalized, realized[has_symbol])
+
+    totals = {}
+    if "@description" in fifo_summary.columns:
+        is_total = (fifo_summary["@description"] == TOTAL_ROW_DESCRIPTION).to_numpy()
+        totals = _sum_by(_accounts(fifo_summary)[is_total], realized[is_total])
+    return symbol_map, totals
+
+
+def _currency_breakdown(positions, cash_report):
+    currencies = positions["@currency"].fillna("").astype(str).to_numpy() if "@currency" in positions.columns \
+        else np.full(len(positions), "", dtype=object)
+    value = numeric(positions, "@positionValue")
+    fx = numeric(positions, "@fxRateToBase")
+    fx = np.where(fx == 0, 1.0, fx)
+    frame = pd.DataFrame({
+        "position_value": value,
+        "position_value_base": value * fx,
+        "unrealized_pnl": numeric(positions, "@fifoPnlUnrealized"),
+        "positions": np.ones(len(positions), dtype=int),
+    }).groupby(currencies, sort=True).sum()
+
+    cash = {}
+    if not cash_report.empty and "@currency" in cash_report.columns:
+        is_currency = (cash_report["@currency"] != "BASE_SUMMARY").to_numpy()
+        cash = _sum_by(cash_report["@currency"].to_numpy()[is_currency],
+                       numeric(cash_report, "@endingCash")[is_currency])
+
+    breakdown = []
+    for currency in sorted(set(frame.index) | set(cash)):
+        row = frame.loc[currency] if currency in frame.index else None
+        breakdown.append({
+            "currency": currency,
+            "positions": int(row["positions"]) if row is not None else 0,
+            "position_value": _money(row["position_value"]) if row is not None else 0.0,
+            "position_value_base": _money(row["position_value_base"]) if row is not None else 0.0,
+            "unrealized_pnl": _money(row["unrealized_pnl"]) if row is not None else 0.0,
+            "cash": _money(cash.get(currency, 0.0)),
+        })
+    return breakdown
+
+
+def empty_summary():
+    return {
+        "total_equity": 0.0,
+        "estimated_cash": 0.0,
+        "total_unrealized_pnl": 0.0,
+        "total_realized_pnl": 0.0,
+        "total_position_value": 0.0,
+        "dividend_accruals": 0.0,
+        "top_positions": [],
+        "change_vs_last": 0.0,  # Placeholder
+        "accounts": [],
+        "currencies": []
+    }
+
+
+def compute_summary(sections, top_n=TOP_POSITIONS):
+    """
+    Portfolio summary from the OpenPositions, CashReport, EquitySummaryInBase
+    and FIFOPerformanceSummaryInBase DataFrames in `sections`.
+
+    Every figure is a column reduction or a groupby, so the cost does not
+    involve a Python loop over positions. Money figures are in base
+    currency: position values and unrealized PnL, which IBKR reports in
+    each position's currency, are converted row by row with @fxRateToBase
+    before summing. Besides the portfolio totals the
+    result carries an `accounts` breakdown (one entry per @accountId) and a
+    `currencies` breakdown of positions and cash per currency.
+
+    OpenPositions is typed in place and gets a `realized_pnl` column, as the
+    endpoints serve it alongside the summary.
+    """
+    summary = empty_summary()
+    positions = sections.get("OpenPositions", pd.DataFrame())
+    if positions.empty:
+        return summary
+
+    empty = pd.DataFrame()
+    cash_report = sections.get("CashReport", empty)
+    equity_summary = sections.get("EquitySummaryInBase", empty)
+    fifo_summary = sections.get("FIFOPerformanceSummaryInBase", empty)
+
+    type_positions(positions)
+    position_accounts = _accounts(positions)
+    value_base = _in_base(positions, "@positionValue")
+    pnl_base = _in_base(positions, "@fifoPnlUnrealized")
+    value_by_account = _sum_by(position_accounts, value_base)
+    pnl_by_account = _sum_by(position_accounts, pnl_base)
+    cash_by_account = _cash_by_account(cash_report, positions)
+    accruals_by_account = _latest_accruals_by_account(equity_summary)
+    realized_map, realized_by_account = _realized_pnl(fifo_summary)
+
+    # Merge Realized PnL into OpenPositions
+    positions["realized_pnl"] = 0.0
+    if "@symbol" in positions.columns and realized_map:
+        symbols_norm = positions["@symbol"].astype(str).str.strip().str.upper()
+        positions["realized_pnl"] = symbols_norm.map(realized_map).fillna(0.0)
+
+    total_pos_value = sum(value_by_account.values())
+    total_cash = sum(cash_by_account.values())
+    total_dividend_accruals = sum(accruals_by_account.values())
+
+    summary["total_equity"] = _money(total_pos_value + total_cash + total_dividend_accruals)
+    summary["estimated_cash"] = _money(total_cash)
+    summary["total_unrealized_pnl"] = _money(sum(pnl_by_account.values()))
+    summary["total_realized_pnl"] = _money(sum(realized_by_account.values()))
+    summary["total_position_value"] = _money(total_pos_value)
+    summary["dividend_accruals"] = _money(total_dividend_accruals)
+
+    top_rows = pd.Series(value_base).nlargest(top_n).index.to_numpy()
+    top = positions.iloc[top_rows]
+    symbols = top["@symbol"].to_numpy() if "@symbol" in top.columns else np.full(len(top), "Unknown")
+    summary["top_positions"] = [
+        {
+            "symbol": symbol,
+            "value": _money(value),
+            "pnl": _money(pnl),
+            "realized_pnl": _money(realized),
+            "allocation": _money(allocation)
+        }
+        for symbol, value, pnl, realized, allocation in zip(
+            symbols, value_base[top_rows], pnl_base[top_rows],
+            numeric(top, "realized_pnl"), numeric(top, "@percentOfNAV")
+        )
+    ]
+
+    accounts = sorted(set(value_by_account) | set(cash_by_account) | set(accruals_by_account) | set(realized_by_account))
+    for account in accounts:
+        value = value_by_account.get(account, 0.0)
+        cash = cash_by_account.get(account, 0.0)
+        accruals = accruals_by_account.get(account, 0.0)
+        summary["accounts"].append({
+            "account_id": account,
+            "total_equity": _money(value + cash + accruals),
+            "estimated_cash": _money(cash),
+            "total_unrealized_pnl": _money(pnl_by_account.get(account, 0.0)),
+            "total_realized_pnl": _money(realized_by_account.get(account, 0.0)),
+            "total_position_value": _money(value),
+            "dividend_accruals": _money(accruals)
+        })
+    summary["currencies"] = _currency_breakdown(positions, cash_report)
+    return summary
+
+
+# Money fields of a summary and of its per-account entries
+SUMMARY_MONEY_FIELDS = [
+    "total_equity", "estimated_cash", "total_unrealized_pnl",
+    "total_realized_pnl", "total_position_value", "dividend_accruals"
+]
+TOP_POSITION_MONEY_FIELDS = ["value", "pnl", "realized_pnl"]
+
+
+def convert_summary(summary, factor, currency, base_currency):
+    """
+    Copy of a compute_summary result with base-currency money figures
+    multiplied by `factor` (the base -> `currency` rate). compute_summary
+    has already converted every row into base currency, so one rate at the
+    report date applies to all of them. The per-currency breakdown keeps
+    its native and base amounts.
+    """
+    converted = dict(summary)
+    for field in SUMMARY_MONEY_FIELDS:
+        if field in converted:
+            converted[field] = _money(converted[field] * factor)
+    converted["top_positions"] = [
+        {**position, **{field: _money(position[field] * factor) for field in TOP_POSITION_MONEY_FIELDS}}
+        for position in summary.get("top_positions", [])
+    ]
+    converted["accounts"] = [
+        {**account, **{field: _money(account[field] * factor) for field in SUMMARY_MONEY_FIELDS}}
+        for account in summary.get("accounts", [])
+    ]
+    converted["currency"] = currency
+    converted["base_currency"] = base_currency
+    return converted
@@ -0,0 +1,206 @@
+import csv
+import io
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from parser import FlexReport, flex_datetimes
+from income import classify_cash_transactions
+from summary import numeric
+
+try:
+    import xlsxwriter
+except ImportError:  # XLSX export is optional, CSV is always available
+    xlsxwriter = None
+
+EXPORT_SECTIONS = ["trades", "income", "fees"]
+EXPORT_FORMATS = ["csv", "xlsx"]
+
+# Output column -> Trades attribute (text columns; numbers are added below)
+TRADE_TEXT_COLUMNS = {
+    "account_id": "@accountId",
+    "trade_id": "@tradeID",
+    "symbol": "@symbol",
+    "description": "@description",
+    "asset_category": "@assetCategory",
+    "conid": "@conid",
+    "buy_sell": "@buySell",
+    "open_close": "@openCloseIndicator",
+    "currency": "@currency",
+}
+TRADE_NUMERIC_COLUMNS = {
+    "quantity": "@quantity",
+    "trade_price": "@tradePrice",
+    "proceeds": "@proceeds",
+    "cost": "@cost",
+    "commission": "@ibCommission",
+    "realized_pnl": "@fifoPnlRealized",
+    "fx_rate_to_base": "@fxRateToBase",
+}
+TRADE_COLUMNS = (
+    ["date_time"] + list(TRADE_TEXT_COLUMNS) + list(TRADE_NUMERIC_COLUMNS) + ["realized_pnl_base"]
+)
+CASH_COLUMNS = [
+    "date", "account_id", "category", "type", "symbol", "conid", "description",
+    "country", "currency", "amount", "fx_rate_to_base", "amount_base"
+]
+EXPORT_COLUMNS = {"trades": TRADE_COLUMNS, "income": CASH_COLUMNS, "fees": CASH_COLUMNS}
+
+INCOME_EXPORT_CATEGORIES = ["dividend", "payment_in_lieu", "withholding_tax", "interest", "other"]
+FEE_EXPORT_CATEGORIES = ["fee", "interest_paid"]
+
+CSV_CHUNK_ROWS = 10000
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+FILE_CHUNK_SIZE = 1024 * 1024
+
+
+def _text(df, column):
+    if column not in df.columns:
+        return np.full(len(df), "", dtype=object)
+    return df[column].fillna("").astype(str).to_numpy()
+
+
+def _trade_times(trades):
+    date_column = "@dateTime" if "@dateTime" in trades.columns else "@tradeDate"
+    if date_column not in trades.columns:
+        return pd.Series(pd.NaT, index=trades.index, dtype="datetime64[s]")
+    return flex_datetimes(trades[date_column])
+
+
+def realized_trades(trades, year):
+    """Closing trades (or trades with realized P&L) executed in `year`, as TRADE_COLUMNS."""
+    if trades.empty:
+        return pd.DataFrame(columns=TRADE_COLUMNS)
+    times = _trade_times(trades)
+    pnl = numeric(trades, "@fifoPnlRealized")
+    closing = pd.Series(_text(trades, "@openCloseIndicator")).str.contains("C", regex=False).to_numpy()
+    keep = (times.dt.year == year).to_numpy() & ((pnl != 0) | closing)
+    trades = trades[keep]
+
+    frame = pd.DataFrame({"date_time": times[keep].to_numpy()})
+    for name, column in TRADE_TEXT_COLUMNS.items():
+        frame[name] = _text(trades, column)
+    for name, column in TRADE_NUMERIC_COLUMNS.items():
+        frame[name] = numeric(trades, column)
+    fx = frame["fx_rate_to_base"].to_numpy()
+    frame["realized_pnl_base"] = frame["realized_pnl"].to_numpy() * np.where(fx == 0, 1.0, fx)
+    return frame.sort_values("date_time", kind="stable").reset_index(drop=True)
+
+
+def _cash_rows(cash_transactions, year, categories):
+    classified = classify_cash_transactions(cash_transactions)
+    if classified.empty:
+        return pd.DataFrame(columns=CASH_COLUMNS)
+    rows = classified[(classified["year"] == year) & classified["category"].isin(categories)]
+    return rows[CASH_COLUMNS]
+
+
+def income_rows(cash_transactions, year):
+    """Dividends, payments in lieu, withholding and interest received in `year`, as CASH_COLUMNS."""
+    return _cash_rows(cash_transactions, year, INCOME_EXPORT_CATEGORIES).sort_values("date", kind="stable")
+
+
+def fee_rows(trades, cash_transactions, year):
+    """Fees and interest paid from CashTransactions plus trade commissions in `year`, as CASH_COLUMNS."""
+    fees = _cash_rows(cash_transactions, year, FEE_EXPORT_CATEGORIES)
+    if not trades.empty:
+        times = _trade_times(trades)
+        commission = numeric(trades, "@ibCommission")
+        keep = (times.dt.year == year).to_numpy() & (commission != 0)
+        charged = trades[keep]
+        fx = numeric(charged, "@fxRateToBase")
+        fx = np.where(fx == 0, 1.0, fx)
+        commissions = pd.DataFrame({
+            "date": times[keep].to_numpy(),
+            "account_id": _text(charged, "@accountId"),
+            "category": "commission",
+            "type": "Commission",
+            "symbol": _text(charged, "@symbol"),
+            "conid": _text(charged, "@conid"),
+            "description": _text(charged, "@tradeID"),
+            "country": "",
+            "currency": _text(charged, "@currency"),
+            "amount": commission[keep],
+            "fx_rate_to_base": fx,
+            "amount_base": commission[keep] * fx,
+        })
+        frames = [frame for frame in (fees, commissions) if not frame.empty]
+        fees = pd.concat(frames, ignore_index=True) if frames else fees
+    return fees.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def export_frame(report_path, section, year):
+    """One export section of a stored report, parsing only the Flex sections it needs."""
+    if section not in EXPORT_SECTIONS:
+        raise ValueError(f"section must be one of {', '.join(EXPORT_SECTIONS)}")
+    with FlexReport(report_path) as report:
+        if section == "trades":
+            return realized_trades(report.section("Trades"), year)
+        if section == "income":
+            return income_rows(report.section("CashTransactions"), year)
+        sections = report.sections(["Trades", "CashTransactions"])
+        return fee_rows(sections["Trades"], sections["CashTransactions"], year)
+
+
+def iter_csv(columns, load_frame, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Yield a CSV document as byte chunks: the header first, before
+    `load_frame()` parses anything, then `chunk_rows` rows at a time, so
+    the client sees data immediately and only one chunk of text exists at
+    a time.
+    """
+    header = io.StringIO()
+    csv.writer(header).writerow(columns)
+    yield header.getvalue().encode("utf-8")
+
+    frame = load_frame()
+    for start in range(0, len(frame), chunk_rows):
+        chunk = frame.iloc[start:start + chunk_rows]
+        yield chunk.to_csv(header=False, index=False, columns=columns, date_format=DATETIME_FORMAT).encode("utf-8")
+
+
+def write_xlsx(path, sheets, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Write `sheets` ({name: (columns, load_frame)}) to an XLSX file in
+    xlsxwriter's constant_memory mode: rows are flushed to disk as they are
+    written, and each sheet's frame is loaded only when its turn comes.
+    """
+    if xlsxwriter is None:
+        raise RuntimeError("XLSX export requires the 'xlsxwriter' package")
+    workbook = xlsxwriter.Workbook(path, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+        "remove_timezone": True,
+    })
+    try:
+        bold = workbook.add_format({"bold": True})
+        for name, (columns, load_frame) in sheets.items():
+            worksheet = workbook.add_worksheet(name)
+            worksheet.write_row(0, 0, columns, bold)
+            frame = load_frame()
+            row_number = 1
+            for start in range(0, len(frame), chunk_rows):
+                chunk = frame.iloc[start:start + chunk_rows][columns]
+                # Blank cells instead of NaN/NaT, which xlsxwriter rejects
+                chunk = chunk.astype(object).where(chunk.notna(), None)
+                for row in chunk.itertuples(index=False, name=None):
+                    worksheet.write_row(row_number, 0, row)
+                    row_number += 1
+    finally:
+        workbook.close()
+
+
+def iter_xlsx(sheets, chunk_size=FILE_CHUNK_SIZE):
+    """Build the workbook in a temporary file on first iteration, stream it and delete it."""
+    fd, path = tempfile.mkstemp(suffix=".xlsx", prefix="tax_export_")
+    os.close(fd)
+    try:
+        write_xlsx(path, sheets)
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
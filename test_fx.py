@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fx import FxRates
+from summary import compute_summary
+
+
+def rates_table():
+    return pd.DataFrame({
+        "date": pd.to_datetime(["2025-01-10", "2025-02-10", "2025-01-10"]),
+        "currency": ["EUR", "EUR", "GBP"],
+        "rate_to_base": [1.10, 1.20, 1.30],
+    })
+
+
+def test_amounts_use_the_latest_rate_on_or_before_their_date():
+    rates = FxRates(rates_table(), base_currency="USD")
+    dates = np.array(["2025-01-10", "2025-02-09", "2025-02-10", "2025-06-01"], dtype="datetime64[s]")
+    assert rates.rates_to_base(["EUR"] * 4, dates).tolist() == pytest.approx([1.10, 1.10, 1.20, 1.20])
+
+
+def test_amounts_before_every_rate_use_the_earliest_one():
+    rates = FxRates(rates_table(), base_currency="USD")
+    dates = np.array(["2024-12-31", "2024-12-31", "2024-12-31"], dtype="datetime64[s]")
+    result = rates.rates_to_base(["EUR", "USD", "JPY"], dates)
+    assert result[:2].tolist() == pytest.approx([1.10, 1.0])
+    assert np.isnan(result[2])
+
+
+def test_convert_between_two_foreign_currencies():
+    rates = FxRates(rates_table(), base_currency="USD")
+    dates = np.array(["2025-03-01"], dtype="datetime64[s]")
+    assert rates.convert([100.0], ["GBP"], dates, "EUR").tolist() == pytest.approx([100 * 1.30 / 1.20])
+
+
+def test_base_currency_comes_from_equity_summary():
+    sections = {
+        # Only EUR rows at 1.0: the guess from the rates alone would be EUR
+        "Trades": pd.DataFrame({"@dateTime": ["20250110;100000"], "@currency": ["EUR"], "@fxRateToBase": ["1"]}),
+        "EquitySummaryInBase": pd.DataFrame({"@reportDate": ["20250110"], "@currency": ["CHF"]}),
+    }
+    assert FxRates.from_sections(sections).base_currency == "CHF"
+    assert FxRates.from_sections({"Trades": sections["Trades"]}).base_currency == "EUR"
+
+
+def test_summary_converts_each_position_with_its_own_rate():
+    positions = pd.DataFrame({
+        "@accountId": ["A", "A"], "@symbol": ["US1", "EU1"], "@currency": ["USD", "EUR"],
+        "@fxRateToBase": ["1", "1.1"], "@positionValue": ["100", "200"], "@fifoPnlUnrealized": ["10", "-20"],
+        "@percentOfNAV": ["10", "20"],
+    })
+    cash_report = pd.DataFrame({
+        "@accountId": ["A", "A"], "@currency": ["USD", "EUR"], "@endingCash": ["50", "100"],
+    })
+    summary = compute_summary({"OpenPositions": positions, "CashReport": cash_report})
+    assert summary["total_position_value"] == pytest.approx(100 + 220)
+    assert summary["total_unrealized_pnl"] == pytest.approx(10 - 22)
+    # No BASE_SUMMARY row: cash in EUR is converted at the EUR positions' rate
+    assert summary["estimated_cash"] == pytest.approx(50 + 110)
+    assert [top["symbol"] for top in summary["top_positions"]] == ["EU1", "US1"]
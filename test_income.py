@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+from fx import FxRates
+from income import build_income_report, classify_cash_transactions, pair_withholding
+
+
+def cash_frame(*rows):
+    """CashTransactions from (conid, dateTime, type, amount, currency, fxRateToBase, description) tuples."""
+    return pd.DataFrame([
+        {"@accountId": "A", "@conid": conid, "@symbol": f"S{conid}", "@dateTime": when, "@type": kind,
+         "@amount": str(amount), "@currency": currency, "@fxRateToBase": str(fx), "@description": description,
+         "@issuerCountryCode": "US"}
+        for conid, when, kind, amount, currency, fx, description in rows
+    ])
+
+
+def test_withholding_is_paired_with_its_dividend():
+    cash = cash_frame(
+        ("1", "20250301", "Dividends", 100, "USD", 1, "S1 CASH DIVIDEND"),
+        ("1", "20250301", "Withholding Tax", -15, "USD", 1, "S1 US TAX"),
+        ("2", "20250302", "Dividends", 50, "USD", 1, "S2 CASH DIVIDEND"),
+    )
+    dividends, unmatched = pair_withholding(classify_cash_transactions(cash))
+    assert dividends[["conid", "gross", "withholding", "net"]].values.tolist() == [
+        ["1", 100.0, -15.0, 85.0], ["2", 50.0, 0.0, 50.0]
+    ]
+    assert dividends["withholding_rate"].tolist() == pytest.approx([0.15, 0.0])
+    assert unmatched.empty
+
+
+def test_rows_with_different_details_on_one_key_pair_once():
+    cash = cash_frame(
+        ("1", "20250301", "Dividends", 80, "USD", 1, "S1 CASH DIVIDEND"),
+        ("1", "20250301", "Payment In Lieu Of Dividends", 20, "USD", 1, "S1 PAYMENT IN LIEU"),
+        ("1", "20250301", "Withholding Tax", -10, "USD", 1, "S1 US TAX"),
+        ("1", "20250301", "Withholding Tax", -5, "USD", 1, "S1 US TAX ON PIL"),
+        ("9", "20250401", "Withholding Tax", 3, "USD", 1, "S9 TAX REFUND"),
+    )
+    dividends, unmatched = pair_withholding(classify_cash_transactions(cash))
+    assert len(dividends) == 1
+    assert dividends.iloc[0][["gross", "withholding", "net"]].tolist() == [100.0, -15.0, 85.0]
+    assert unmatched["conid"].tolist() == ["9"]
+
+
+def test_amounts_without_a_rate_are_counted_as_unconverted():
+    rates = FxRates(pd.DataFrame({
+        "date": pd.to_datetime(["2025-01-02"]), "currency": ["EUR"], "rate_to_base": [1.1],
+    }), base_currency="USD")
+    cash = cash_frame(
+        ("1", "20250301", "Dividends", 110, "USD", 1, "S1 CASH DIVIDEND"),
+        ("1", "20250301", "Withholding Tax", -11, "USD", 1, "S1 US TAX"),
+        ("2", "20250301", "Dividends", 100, "JPY", 0.0067, "S2 CASH DIVIDEND"),
+    )
+    report = build_income_report(cash, fx_rates=rates, target_currency="EUR")
+    assert report["currency"] == "EUR"
+    assert report["by_year"][2025]["dividend"] == pytest.approx(100.0)
+    assert report["by_year"][2025]["unconverted"] == 1
+
+    dividends = report["dividends"].set_index("conid")
+    assert dividends.loc["1", "net_converted"] == pytest.approx(90.0)
+    assert dividends.loc["2", "unconverted"] == 1
+    assert pd.isna(dividends.loc["2", "gross_converted"])
+    # The base amount still comes from the report's own rate
+    assert dividends.loc["2", "gross_base"] == pytest.approx(0.67)
+
+
+def test_transfers_are_not_income():
+    cash = cash_frame(("", "20250301", "Deposits/Withdrawals", 1000, "USD", 1, "DEPOSIT"))
+    assert classify_cash_transactions(cash).empty
@@ -0,0 +1,122 @@
+import pandas as pd
+import pytest
+from lots import OPENING_TRADE_ID, load_lot_state, lots_frame, update_lot_state
+
+
+def trades_frame(*rows):
+    """Trades section from (trade_id, account, conid, dateTime, quantity, price, openClose) tuples."""
+    return pd.DataFrame([
+        {"@tradeID": trade_id, "@accountId": account, "@conid": conid, "@symbol": f"S{conid}",
+         "@dateTime": when, "@quantity": str(quantity), "@tradePrice": str(price), "@multiplier": "1",
+         "@ibCommission": "-1", "@openCloseIndicator": open_close, "@levelOfDetail": "EXECUTION"}
+        for trade_id, account, conid, when, quantity, price, open_close in rows
+    ])
+
+
+def positions_frame(*rows):
+    """OpenPositions from (account, conid, levelOfDetail, position, costBasisMoney, openDateTime) tuples."""
+    return pd.DataFrame([
+        {"@accountId": account, "@conid": conid, "@symbol": f"S{conid}", "@levelOfDetail": detail,
+         "@position": str(position), "@costBasisMoney": str(cost), "@openDateTime": opened,
+         "@reportDate": "20251231"}
+        for account, conid, detail, position, cost, opened in rows
+    ])
+
+
+def lots_of(state, key):
+    return state["positions"].get(key, {}).get("lots", [])
+
+
+def test_positions_built_in_the_report_are_not_seeded(tmp_path):
+    trades = trades_frame(
+        ("t1", "A", "1", "20250110;100000", 100, 10, "O"),
+        ("t2", "A", "1", "20250120;100000", -40, 12, "C"),
+    )
+    state = update_lot_state(str(tmp_path), {
+        "Trades": trades, "OpenPositions": positions_frame(("A", "1", "SUMMARY", 60, 600.6, "")),
+    })
+    assert lots_of(state, "A|1") == [[60.0, pytest.approx(600.6), "2025-01-10T10:00:00", "t1"]]
+    assert state["reconciliation"]["mismatched"] == 0
+
+
+def test_open_position_held_before_the_report_is_seeded_from_lot_rows(tmp_path):
+    trades = trades_frame(("t1", "A", "1", "20250110;100000", -40, 12, "C"))
+    positions = positions_frame(
+        ("A", "1", "SUMMARY", 60, 600, ""),
+        ("A", "1", "LOT", 25, 200, "20240105;093000"),
+        ("A", "1", "LOT", 35, 400, "20240601;093000"),
+    )
+    state = update_lot_state(str(tmp_path), {"Trades": trades, "OpenPositions": positions})
+    assert [lot[:3] for lot in lots_of(state, "A|1")] == [
+        [25.0, 200.0, "2024-01-05T09:30:00"], [35.0, 400.0, "2024-06-01T09:30:00"]
+    ]
+    assert all(lot[0] > 0 for lot in lots_of(state, "A|1"))
+
+
+def test_seeded_lot_without_open_date_is_acquired_at_the_first_trade(tmp_path):
+    trades = trades_frame(("t1", "A", "1", "20250111;100000", -40, 12, "C"))
+    positions = positions_frame(("A", "1", "SUMMARY", 60, 600, ""))
+    state = update_lot_state(str(tmp_path), {"Trades": trades, "OpenPositions": positions})
+    # Never the report date (2025-12-31), which is after the sale that drew on the lot
+    assert lots_of(state, "A|1") == [[60.0, pytest.approx(600.0), "2025-01-11T10:00:00", OPENING_TRADE_ID]]
+
+
+def test_position_sold_off_in_the_report_leaves_no_short_lot(tmp_path):
+    user_dir = str(tmp_path)
+    trades = trades_frame(("t1", "A", "1", "20250110;100000", -100, 10, "C"))
+    # The report lists other positions, not conid 1: it ended flat
+    positions = positions_frame(("A", "2", "SUMMARY", 5, 50, ""))
+    update_lot_state(user_dir, {"Trades": trades, "OpenPositions": positions})
+    state = load_lot_state(user_dir)
+    assert lots_of(state, "A|1") == []
+
+    # A later buy opens a long lot instead of closing a phantom short one
+    rebuy = trades_frame(("t2", "A", "1", "20250201;100000", 30, 11, "O"))
+    state = update_lot_state(user_dir, {
+        "Trades": pd.concat([trades, rebuy], ignore_index=True),
+        "OpenPositions": positions_frame(("A", "1", "SUMMARY", 30, 331, ""), ("A", "2", "SUMMARY", 5, 50, "")),
+    })
+    assert lots_of(state, "A|1") == [[30.0, pytest.approx(331.0), "2025-02-01T10:00:00", "t2"]]
+
+
+def test_closing_trade_without_open_positions_never_opens_a_short_lot(tmp_path):
+    trades = trades_frame(
+        ("t1", "A", "1", "20250110;100000", -100, 10, "C"),
+        ("t2", "A", "1", "20250115;100000", 20, 9, "O"),
+    )
+    state = update_lot_state(str(tmp_path), {"Trades": trades})
+    assert lots_of(state, "A|1") == [[20.0, pytest.approx(181.0), "2025-01-15T10:00:00", "t2"]]
+
+
+def test_short_sales_still_open_short_lots(tmp_path):
+    trades = trades_frame(("t1", "A", "1", "20250110;100000", -50, 10, "O"))
+    state = update_lot_state(str(tmp_path), {
+        "Trades": trades, "OpenPositions": positions_frame(("A", "1", "SUMMARY", -50, -499, "")),
+    })
+    assert lots_of(state, "A|1")[0][0] == -50.0
+
+
+def test_overlapping_reports_only_apply_new_trades(tmp_path):
+    user_dir = str(tmp_path)
+    first = trades_frame(
+        ("t1", "A", "1", "20250110;100000", 100, 10, "O"),
+        ("t2", "A", "1", "20250110;100000", 50, 10, "O"),
+    )
+    update_lot_state(user_dir, {"Trades": first, "OpenPositions": positions_frame(("A", "1", "SUMMARY", 150, 1502, ""))})
+    second = pd.concat([first, trades_frame(
+        ("t3", "A", "1", "20250110;100000", -30, 12, "C"),
+        ("t4", "A", "1", "20250301;100000", -100, 12, "C"),
+    )], ignore_index=True)
+    state = update_lot_state(user_dir, {"Trades": second, "OpenPositions": positions_frame(("A", "1", "SUMMARY", 20, 200.8, ""))})
+
+    assert state["trades_applied"] == 4
+    assert state["watermark"] == {"date_time": "2025-03-01T10:00:00", "trade_ids": ["t4"]}
+    assert lots_frame(state)[["quantity", "trade_id"]].values.tolist() == [[20.0, "t2"]]
+    assert state["reconciliation"]["mismatched"] == 0
+
+
+def test_readers_do_not_save_the_state(tmp_path):
+    user_dir = str(tmp_path)
+    trades = trades_frame(("t1", "A", "1", "20250110;100000", 100, 10, "O"))
+    update_lot_state(user_dir, {"Trades": trades}, save=False)
+    assert load_lot_state(user_dir)["trades_applied"] == 0
@@ -1,6 +1,94 @@
-from parser import parse_ibkr_xml
+from parser import SECTION_ROW_TAGS, FlexReport, parse_ibkr_xml
+import gzip
 import os
 import pandas as pd
+import xmltodict
+
+REPORT = """<?xml version="1.0" encoding="UTF-8"?>
+<FlexQueryResponse queryName="Test" type="AF">
+<FlexStatements count="2">
+<FlexStatement accountId="U1" fromDate="20250101" toDate="20251231" whenGenerated="20251231;120000">
+<OpenPositions>
+<OpenPosition accountId="U1" conid="1" symbol="AAA" position="10" costBasisMoney="100" levelOfDetail="SUMMARY" />
+<OpenPosition accountId="U1" conid="2" symbol="B&amp;B" position="5" costBasisMoney="50" levelOfDetail="SUMMARY" />
+</OpenPositions>
+<Trades>
+<Trade accountId="U1" conid="1" tradeID="t1" dateTime="20250110;100000" quantity="10" />
+</Trades>
+<CashTransactions />
+<ChangeInDividendAccruals></ChangeInDividendAccruals>
+</FlexStatement>
+<FlexStatement accountId="U2" fromDate="20250101" toDate="20251231" whenGenerated="20251231;120500">
+<Trades>
+<Trade accountId="U2" conid="3" tradeID="t2" dateTime="20250111;100000" quantity="-4" openCloseIndicator="C" />
+<Trade accountId="U2" conid="3" tradeID="t3" dateTime="20250112;100000" quantity="4" />
+</Trades>
+<CashTransactions>
+<CashTransaction accountId="U2" type="Dividends" amount="1.5" description="CCC &quot;CASH&quot; DIVIDEND" />
+</CashTransactions>
+</FlexStatement>
+</FlexStatements>
+</FlexQueryResponse>
+"""
+
+
+def xmltodict_sections(xml):
+    """Sections as the original xmltodict-based parser built them."""
+    statements = xmltodict.parse(xml)["FlexQueryResponse"]["FlexStatements"].get("FlexStatement", [])
+    if not isinstance(statements, list):
+        statements = [statements]
+    results = {}
+    for name, tag in SECTION_ROW_TAGS.items():
+        frames = []
+        for statement in statements:
+            if isinstance(statement.get(name), dict):
+                items = statement[name].get(tag, [])
+                items = [items] if isinstance(items, dict) else items
+                if items:
+                    frames.append(pd.DataFrame(items))
+        results[name] = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return results
+
+
+def assert_same_sections(results, expected):
+    assert list(results) == list(expected)
+    for name, df in expected.items():
+        pd.testing.assert_frame_equal(results[name], df, obj=name)
+
+
+def test_sections_match_xmltodict():
+    with FlexReport(REPORT) as report:
+        assert_same_sections(report.sections(), xmltodict_sections(REPORT))
+
+
+def test_sections_match_xmltodict_on_gzip_archives(tmp_path):
+    path = tmp_path / "report_20251231.xml.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(REPORT)
+    expected = xmltodict_sections(REPORT)
+    with FlexReport(str(path)) as report:
+        # One section at a time, out of file order, then all at once from the cache
+        for name in reversed(list(SECTION_ROW_TAGS)):
+            pd.testing.assert_frame_equal(report.section(name), expected[name], obj=name)
+        assert_same_sections(report.sections(), expected)
+
+
+def test_single_statement_section():
+    with FlexReport(REPORT) as report:
+        trades = report.section("Trades", statement=1)
+    assert trades["@tradeID"].tolist() == ["t2", "t3"]
+
+
+def test_parse_ibkr_xml_returns_the_requested_sections():
+    results, last_update, summary = parse_ibkr_xml(REPORT, sections=["Trades"])
+    assert list(results) == ["Trades"]
+    assert last_update == "20251231;120000"
+    assert_same_sections(results, {"Trades": xmltodict_sections(REPORT)["Trades"]})
+
+
+def test_non_flex_documents_parse_to_nothing():
+    assert parse_ibkr_xml("<html><body>Error</body></html>") == ({}, None, {})
+
 
 if __name__ == "__main__":
     if os.path.exists("last_report.xml"):
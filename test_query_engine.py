@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+from query_engine import QueryError, QueryTimeout, duckdb
+
+pytestmark = pytest.mark.skipif(duckdb is None, reason="the query engine requires duckdb")
+
+
+@pytest.fixture
+def engine():
+    from query_engine import QueryEngine
+    return QueryEngine({
+        "Trades": pd.DataFrame({
+            "@conid": ["1", "2"], "@symbol": ["AAA", "BBB"], "@quantity": ["10", "-5"],
+            "@dateTime": ["20250110;100000", "20250111;093000"],
+        }),
+        "CashTransactions": pd.DataFrame(),
+    })
+
+
+def test_select_over_typed_tables(engine):
+    result, truncated = engine.execute('SELECT conid, quantity, dateTime FROM "Trades" ORDER BY conid')
+    assert not truncated
+    assert result["conid"].tolist() == ["1", "2"]
+    assert result["quantity"].tolist() == [10.0, -5.0]
+    assert result["dateTime"].iloc[0] == pd.Timestamp("2025-01-10 10:00:00")
+    assert "CashTransactions" not in engine.tables()
+
+
+def test_results_are_truncated_at_max_rows(engine):
+    result, truncated = engine.execute('SELECT * FROM "Trades"', max_rows=1)
+    assert len(result) == 1 and truncated
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM read_csv('/etc/passwd')",
+    "SELECT * FROM read_text('/etc/hostname')",
+    "SELECT * FROM 'requests.jsonl'",
+    "SELECT * FROM read_parquet('https://example.com/data.parquet')",
+])
+def test_file_and_network_access_is_rejected(engine, sql):
+    with pytest.raises(QueryError):
+        engine.execute(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SET enable_external_access = true",
+    "SET memory_limit = '64GB'",
+    "ATTACH '/tmp/other.duckdb' AS other",
+    "COPY \"Trades\" TO '/tmp/trades.csv'",
+    "CREATE TABLE copy AS SELECT * FROM \"Trades\"",
+    "DELETE FROM \"Trades\"",
+    "INSTALL httpfs",
+    "SELECT 1; DROP TABLE \"Trades\"",
+])
+def test_statements_other_than_one_select_are_rejected(engine, sql):
+    with pytest.raises(QueryError):
+        engine.execute(sql)
+    assert engine.execute('SELECT count(*) AS n FROM "Trades"')[0]["n"].tolist() == [2]
+
+
+def test_configuration_stays_locked(engine):
+    # Even a statement that got past validation could not lift the sandbox
+    with pytest.raises(duckdb.Error):
+        engine.conn.execute("SET enable_external_access = true")
+    settings = engine.execute("SELECT current_setting('enable_external_access') AS access")[0]
+    assert settings["access"].tolist() == [False]
+
+
+def test_long_queries_time_out(engine):
+    with pytest.raises(QueryTimeout):
+        engine.execute("SELECT count(*) FROM range(10000000000) AS a(x) WHERE x % 7 = 3", timeout=0.2)
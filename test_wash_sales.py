@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+from wash_sales import detect_wash_sales, summarize_wash_sales
+
+
+def trades_frame(*rows):
+    """Trades section from (trade_id, conid, dateTime, quantity, fifoPnlRealized) tuples."""
+    return pd.DataFrame([
+        {"@tradeID": trade_id, "@accountId": "A", "@conid": conid, "@symbol": f"S{conid}",
+         "@underlyingSymbol": "", "@dateTime": when, "@quantity": str(quantity), "@fifoPnlRealized": str(pnl)}
+        for trade_id, conid, when, quantity, pnl in rows
+    ])
+
+
+def test_loss_sale_replaced_within_the_window():
+    trades = trades_frame(
+        ("b1", "1", "20250101;100000", 100, 0),
+        ("s1", "1", "20250201;100000", -100, -500),
+        ("b2", "1", "20250215;100000", 40, 0),
+    )
+    adjustments = detect_wash_sales(trades)
+    assert adjustments[["sale_trade_id", "replacement_trade_id"]].values.tolist() == [["s1", "b2"]]
+    row = adjustments.iloc[0]
+    assert row["replacement_quantity"] == 40
+    assert row["disallowed_loss"] == pytest.approx(200)
+    assert row["allowed_loss"] == pytest.approx(-300)
+    assert row["basis_adjustment_per_share"] == pytest.approx(5)
+
+
+def test_purchase_outside_the_window_is_no_replacement():
+    trades = trades_frame(
+        ("b1", "1", "20250101;100000", 100, 0),
+        ("s1", "1", "20250201;100000", -100, -500),
+        ("b2", "1", "20250304;100000", 100, 0),
+    )
+    assert detect_wash_sales(trades).empty
+
+
+def test_one_purchase_replaces_one_sale_only():
+    trades = trades_frame(
+        ("b1", "1", "20250101;100000", 100, 0),
+        ("s1", "1", "20250201;100000", -50, -100),
+        ("s2", "1", "20250202;100000", -50, -100),
+        ("b2", "1", "20250210;100000", 50, 0),
+    )
+    adjustments = detect_wash_sales(trades)
+    # The earlier sale takes all 50 replacement shares; nothing is left for the second one
+    assert adjustments["sale_trade_id"].tolist() == ["s1"]
+    assert adjustments["replacement_quantity"].tolist() == [50]
+    assert summarize_wash_sales(adjustments)["disallowed_loss"] == pytest.approx(100)
+
+
+def test_held_purchase_before_the_sale_is_a_replacement():
+    trades = trades_frame(
+        ("b1", "1", "20250101;100000", 100, 0),
+        ("b2", "1", "20250125;100000", 100, 0),
+        # FIFO sells b1, so the shares of b2, bought 7 days earlier, are still held
+        ("s1", "1", "20250201;100000", -100, -300),
+    )
+    adjustments = detect_wash_sales(trades)
+    assert adjustments[["replacement_trade_id", "replacement_quantity"]].values.tolist() == [["b2", 100]]
+
+
+def test_match_on_symbol_groups_other_contracts():
+    trades = trades_frame(
+        ("b1", "1", "20250101;100000", 100, 0),
+        ("s1", "1", "20250201;100000", -100, -500),
+        ("b2", "2", "20250205;100000", 100, 0),
+    )
+    trades["@symbol"] = "XYZ"
+    assert detect_wash_sales(trades, match_on="conid").empty
+    assert detect_wash_sales(trades, match_on="symbol")["replacement_trade_id"].tolist() == ["b2"]
+
+    with pytest.raises(ValueError):
+        detect_wash_sales(trades, match_on="isin")
@@ -0,0 +1,236 @@
+import numpy as np
+import pandas as pd
+from parser import flex_datetimes
+from summary import numeric
+
+WASH_SALE_WINDOW_DAYS = 30
+MATCH_KEYS = {
+    # Same contract only
+    "conid": "@conid",
+    # Same ticker, e.g. across share classes listed under one symbol
+    "symbol": "@symbol",
+    # Anything on the same underlying (stock, its options, ...)
+    "underlying": "@underlyingSymbol",
+}
+
+SECONDS_PER_DAY = 86400
+
+ADJUSTMENT_COLUMNS = [
+    "account_id", "symbol", "conid", "match_key", "sale_trade_id", "sale_date",
+    "quantity_sold", "realized_loss", "replacement_quantity", "disallowed_loss",
+    "allowed_loss", "replacement_trade_id", "replacement_date", "basis_adjustment_per_share"
+]
+
+
+def prepare_trades(trades, match_on="conid"):
+    """
+    Typed view of the Trades section with one integer match-key code per
+    security group and trade times in epoch seconds, sorted by (key, time).
+    `row` is the position of each trade in `trades`.
+    """
+    if match_on not in MATCH_KEYS:
+        raise ValueError(f"match_on must be one of {', '.join(MATCH_KEYS)}")
+    if trades.empty:
+        return pd.DataFrame()
+
+    key_column = MATCH_KEYS[match_on]
+    keys = trades[key_column] if key_column in trades.columns else pd.Series("", index=trades.index)
+    if match_on != "conid":
+        keys = keys.fillna("").astype(str).str.strip().str.upper()
+        if match_on == "underlying" and "@symbol" in trades.columns:
+            # Stocks usually have an empty underlyingSymbol; they are their own underlying
+            symbols = trades["@symbol"].fillna("").astype(str).str.strip().str.upper()
+            keys = keys.where(keys != "", symbols)
+
+    date_column = "@dateTime" if "@dateTime" in trades.columns else "@tradeDate"
+    times = flex_datetimes(trades[date_column]) if date_column in trades.columns \
+        else pd.Series(pd.NaT, index=trades.index)
+
+    # Text columns are only looked up for flagged rows, through `row`
+    prepared = pd.DataFrame({
+        "row": np.arange(len(trades)),
+        "match_key": keys.fillna("").astype(str).to_numpy(),
+        "time": times.to_numpy(),
+        "quantity": numeric(trades, "@quantity"),
+        "pnl": numeric(trades, "@fifoPnlRealized"),
+    })
+    prepared = prepared[prepared["time"].notna() & (prepared["match_key"] != "")]
+    prepared["seconds"] = prepared["time"].to_numpy().astype("datetime64[s]").astype(np.int64)
+    prepared["key_code"] = pd.factorize(prepared["match_key"])[0].astype(np.int64)
+    return prepared.sort_values(["key_code", "seconds"], kind="stable").reset_index(drop=True)
+
+
+def _allocate_replacements(buy_quantity, sold, held, first_pre, first_post, past_end):
+    """
+    Replacement shares of each loss sale, taken from what earlier sales left
+    of the purchases (`buy_quantity`, in purchase order). Sales must come in
+    time order per key; purchases [first_pre, first_post) are before the
+    sale, of which at most `held` are still held, and [first_post, past_end)
+    after it. Returns the replacement quantity of each sale and the purchase
+    its basis adjustment goes to: the first one after the sale it used, else
+    the latest one before it.
+    """
+    remaining = buy_quantity.astype(float).tolist()
+    replacement = np.zeros(len(sold))
+    replacement_buy = np.zeros(len(sold), dtype=np.int64)
+    for i in range(len(sold)):
+        need = sold[i]
+        pre_need = min(need, held[i])
+        target = -1
+        # Held purchases before the sale: FIFO keeps the latest ones
+        j = first_post[i] - 1
+        while pre_need > 0 and j >= first_pre[i]:
+            used = min(remaining[j], pre_need)
+            if used > 0:
+                remaining[j] -= used
+                pre_need -= used
+                need -= used
+                if target < 0:
+                    target = j
+            j -= 1
+        post_target = -1
+        j = first_post[i]
+        while need > 0 and j < past_end[i]:
+            used = min(remaining[j], need)
+            if used > 0:
+                remaining[j] -= used
+                need -= used
+                if post_target < 0:
+                    post_target = j
+            j += 1
+        replacement[i] = sold[i] - need
+        replacement_buy[i] = post_target if post_target >= 0 else max(target, 0)
+    return replacement, replacement_buy
+
+
+def detect_wash_sales(trades, window_days=WASH_SALE_WINDOW_DAYS, match_on="conid"):
+    """
+    Flag loss sales that have replacement purchases of a substantially
+    identical security within `window_days` calendar days before or after
+    the sale, across all accounts.
+
+    Purchases are laid out as one sorted array of (key code, time) composites
+    with a prefix sum of bought quantity, so the quantity bought in any
+    window is two binary searches away. Those sums bound the replacement of
+    every sale with array operations; only sales with a possible replacement
+    go through the sequential allocation:
+
+    - purchases after the sale (same day included) up to `window_days` later
+      count in full;
+    - purchases in the `window_days` before the sale count only while still
+      held after it (FIFO sells older lots first), capped by the position
+      remaining after the sale.
+
+    The replaced fraction of the sale (at most 100%) is the disallowed loss;
+    it carries forward into the basis of the replacement shares. A share
+    replaces one sale only: loss sales are walked in time order per key and
+    take what is left of the purchases in their window, held purchases
+    before the sale first (the latest ones, which FIFO keeps) and then the
+    purchases after it in order.
+
+    Only positions built inside `trades` are known: a position held from
+    before the first trade counts as 0 (the position after a sale is clamped
+    at 0), so the disallowed losses are a lower bound when the history does
+    not start flat.
+
+    Returns a DataFrame with ADJUSTMENT_COLUMNS, one row per loss sale that
+    has a replacement.
+    """
+    prepared = prepare_trades(trades, match_on)
+    if prepared.empty:
+        return pd.DataFrame(columns=ADJUSTMENT_COLUMNS)
+
+    key_code = prepared["key_code"].to_numpy()
+    seconds = prepared["seconds"].to_numpy()
+    quantity = prepared["quantity"].to_numpy()
+    pnl = prepared["pnl"].to_numpy()
+    base = seconds.min()
+    composite = (key_code << 32) | (seconds - base)
+
+    # Position per key right after each trade
+    position_after = pd.Series(quantity).groupby(key_code).cumsum().to_numpy()
+
+    is_buy = quantity > 0
+    buy_rows = np.flatnonzero(is_buy)
+    buy_composite = composite[buy_rows]
+    bought = np.concatenate(([0.0], np.cumsum(quantity[buy_rows])))
+
+    sale_rows = np.flatnonzero((quantity < 0) & (pnl < 0))
+    if len(sale_rows) == 0 or len(buy_rows) == 0:
+        return pd.DataFrame(columns=ADJUSTMENT_COLUMNS)
+
+    # Calendar-day window around the sale day, relative to `base`
+    window = window_days * SECONDS_PER_DAY
+    sale_seconds = seconds[sale_rows]
+    sale_day_start = sale_seconds - sale_seconds % SECONDS_PER_DAY - base
+    sale_key = key_code[sale_rows] << 32
+    window_start = sale_key | np.maximum(sale_day_start - window, 0)
+    window_end = sale_key | (sale_day_start + window + SECONDS_PER_DAY)
+
+    first_pre = np.searchsorted(buy_composite, window_start, side="left")
+    first_post = np.searchsorted(buy_composite, composite[sale_rows], side="left")
+    past_end = np.searchsorted(buy_composite, window_end, side="left")
+
+    pre_quantity = bought[first_post] - bought[first_pre]
+    post_quantity = bought[past_end] - bought[first_post]
+    still_held = np.minimum(pre_quantity, np.maximum(position_after[sale_rows], 0.0))
+
+    sold = -quantity[sale_rows]
+    # Upper bound with every purchase available to every sale; only these
+    # candidates go through the allocation below
+    candidates = np.flatnonzero(np.minimum(sold, still_held + post_quantity) > 0)
+    if len(candidates) == 0:
+        return pd.DataFrame(columns=ADJUSTMENT_COLUMNS)
+
+    replacement, replacement_buy = _allocate_replacements(
+        quantity[buy_rows], sold[candidates], still_held[candidates],
+        first_pre[candidates], first_post[candidates], past_end[candidates]
+    )
+    has_replacement = replacement > 0
+    if not has_replacement.any():
+        return pd.DataFrame(columns=ADJUSTMENT_COLUMNS)
+
+    candidates = candidates[has_replacement]
+    sale_rows = sale_rows[candidates]
+    sold = sold[candidates]
+    replacement = replacement[has_replacement]
+    loss = pnl[sale_rows]
+    disallowed = -loss * replacement / sold
+    replacement_rows = buy_rows[replacement_buy[has_replacement]]
+
+    def text(column, rows):
+        if column not in trades.columns:
+            return np.full(len(rows), "", dtype=object)
+        return trades[column].iloc[prepared["row"].to_numpy()[rows]].fillna("").astype(str).to_numpy()
+
+    adjustments = pd.DataFrame({
+        "account_id": text("@accountId", sale_rows),
+        "symbol": text("@symbol", sale_rows),
+        "conid": text("@conid", sale_rows),
+        "match_key": prepared["match_key"].to_numpy()[sale_rows],
+        "sale_trade_id": text("@tradeID", sale_rows),
+        "sale_date": prepared["time"].to_numpy()[sale_rows],
+        "quantity_sold": sold,
+        "realized_loss": loss,
+        "replacement_quantity": replacement,
+        "disallowed_loss": disallowed,
+        "allowed_loss": loss + disallowed,
+        "replacement_trade_id": text("@tradeID", replacement_rows),
+        "replacement_date": prepared["time"].to_numpy()[replacement_rows],
+        "basis_adjustment_per_share": disallowed / replacement,
+    })
+    return adjustments.sort_values("sale_date", kind="stable").reset_index(drop=True)
+
+
+def summarize_wash_sales(adjustments):
+    """Totals and per-symbol disallowed losses of detect_wash_sales output."""
+    if adjustments.empty:
+        return {"wash_sales": 0, "realized_loss": 0.0, "disallowed_loss": 0.0, "allowed_loss": 0.0, "by_symbol": {}}
+    by_symbol = adjustments.groupby("symbol")["disallowed_loss"].sum().round(2)
+    return {
+        "wash_sales": int(len(adjustments)),
+        "realized_loss": round(float(adjustments["realized_loss"].sum()), 2),
+        "disallowed_loss": round(float(adjustments["disallowed_loss"].sum()), 2),
+        "allowed_loss": round(float(adjustments["allowed_loss"].sum()), 2),
+        "by_symbol": by_symbol.to_dict(),
+    }